@@ -1,6 +1,17 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        # Сводки DailyMetrics пересчитываются при изменении приёмов, оплат и пациентов
+        from helper import icd10, images, rollups
+
+        rollups.connect()
+        # Уменьшенные копии снимков, фото и логотипов строятся после сохранения
+        images.connect()
+        # Индекс МКБ-10 — при релизе: migrate пересобирает его, если нет файла или источник новее
+        post_migrate.connect(icd10.ensure_built, sender=self, dispatch_uid="icd10-index")
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from core.models import PatientFile
+from helper.files import digest
+
+
+class Command(BaseCommand):
+    help = "Размер, тип и SHA-256 для файлов пациентов, загруженных до появления колонок (один проход по хранилищу)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=200)
+
+    def handle(self, *args, **options):
+        done = missing = 0
+        queryset = PatientFile.objects.filter(sha256="").exclude(file="").only("id", "file")
+        for document in queryset.iterator(chunk_size=options["batch_size"]):
+            try:
+                with document.file.open("rb") as content:
+                    sha256, size, content_type = digest(content)
+            except FileNotFoundError:
+                missing += 1
+                continue
+            PatientFile.objects.filter(id=document.id).update(sha256=sha256, size=size, content_type=content_type)
+            done += 1
+        self.stdout.write(self.style.SUCCESS(f"Заполнено: {done}, нет в хранилище: {missing}"))
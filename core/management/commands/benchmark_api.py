@@ -0,0 +1,289 @@
+import asyncio
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test import AsyncClient, Client, override_settings
+
+from core.management.commands.generate_clinic_data import PASSWORD, SYNTHETIC_DOMAIN
+from core.models import CustomUser
+from helper import metrics
+from helper.benchmark import git_revision, summarize
+
+DEFAULT_METHODS = ["login", "patient_list", "doctor_list", "branch_list", "list_all_clinics_for_admin"]
+
+# Методы, которым нужен токен системного администратора
+SYSADMIN_METHODS = {"list_all_clinics_for_admin", "list_all_users_for_admin", "list_all_branches_for_admin",
+                    "list_plans", "get_plan", "list_clinic_subscriptions", "clinic_list"}
+
+QUERIES_RE = re.compile(r'^texelmed_api_db_queries_total\{method="([^"]+)"\} (\d+)$', re.M)
+
+
+class Command(BaseCommand):
+    help = "Нагрузочный прогон методов API: p50/p95/p99, пропускная способность, SQL-запросы на вызов (JSON)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--methods", nargs="+", default=DEFAULT_METHODS)
+        parser.add_argument("--requests", type=int, default=200, help="Вызовов на метод")
+        parser.add_argument("--concurrency", type=int, default=4)
+        parser.add_argument("--warmup", type=int, default=5, help="Прогревочных вызовов на метод")
+        parser.add_argument("--url", default=None, help="База сервера (http://host:port) — иначе прогон в процессе")
+        parser.add_argument("--metrics-token", default=None, help="Bearer-токен для /metrics/ при HTTP-прогоне")
+        parser.add_argument("--director", default=None, help="Email директора (по умолчанию последний синтетический)")
+        parser.add_argument("--sysadmin", default=None, help="Email системного администратора")
+        parser.add_argument("--password", default=PASSWORD)
+        parser.add_argument("--params", default="{}", help='JSON с params по методам: {"patient_list": {"search": "Ким"}}')
+        parser.add_argument("--output", default=None, help="Файл для JSON-отчёта (по умолчанию stdout)")
+        parser.add_argument(
+            "--server", choices=["wsgi", "asgi", "both"], default="wsgi",
+            help="В процессе: wsgi — Client и поток на вызов, asgi — AsyncClient и async-диспетчер "
+                 "(нужен API_ASYNC_DISPATCH=1), both — оба прогона в подпроцессах и сравнение. "
+                 "С --url — только метка сервера в отчёте",
+        )
+        parser.add_argument(
+            "--db-latency-ms", type=float, default=0,
+            help="Искусственная задержка каждого SQL-запроса (имитация удалённой/нагруженной БД)",
+        )
+
+    def handle(self, *args, **options):
+        if options["server"] == "both" and not options["url"]:
+            return self.compare(options)
+        if options["server"] == "asgi" and not options["url"] and not settings.API_ASYNC_DISPATCH:
+            raise CommandError("Для --server asgi запустите с API_ASYNC_DISPATCH=1 (или --server both)")
+        if options["db_latency_ms"]:
+            self.add_db_latency(options["db_latency_ms"] / 1000)
+
+        try:
+            extra_params = json.loads(options["params"])
+        except ValueError as e:
+            raise CommandError(f"--params: {e}")
+
+        self.url = options["url"].rstrip("/") if options["url"] else None
+        self.metrics_token = options["metrics_token"]
+        self.server = options["server"]
+        self.local = threading.local()
+
+        director = self.find_user(options["director"], CustomUser.Roles.CLINIC_DIRECTOR)
+        sysadmin = self.find_user(options["sysadmin"], CustomUser.Roles.SYSTEM_ADMIN)
+        password = options["password"]
+        tokens = {
+            "director": self.login(director.email, password),
+            "sysadmin": self.login(sysadmin.email, password) if sysadmin else None,
+        }
+
+        report = {
+            "revision": git_revision(),
+            "mode": "http" if self.url else "in-process",
+            "server": self.server,
+            "url": self.url,
+            "db_latency_ms": options["db_latency_ms"],
+            "concurrency": options["concurrency"],
+            "requests_per_method": options["requests"],
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "methods": {},
+        }
+
+        for method in options["methods"]:
+            if method == "login":
+                token, params = None, {"email": director.email, "password": password}
+            else:
+                token = tokens["sysadmin"] if method in SYSADMIN_METHODS else tokens["director"]
+                params = {}
+                if token is None:
+                    raise CommandError(f"Для {method} нужен системный администратор (--sysadmin)")
+            params.update(extra_params.get(method, {}))
+
+            for _ in range(options["warmup"]):
+                self.call(method, params, token)
+            report["methods"][method] = self.run(method, params, token, options["requests"], options["concurrency"])
+            self.stderr.write(f"{method}: {report['methods'][method]}")
+
+        self.write_report(report, options["output"])
+
+    def write_report(self, report, path):
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(output + "\n")
+            self.stderr.write(self.style.SUCCESS(f"Отчёт: {path}"))
+        else:
+            self.stdout.write(output)
+
+    def compare(self, options):
+        """WSGI и ASGI в отдельных процессах (выбор диспетчера фиксируется при загрузке urls) → сводка"""
+        forwarded = ["--methods", *options["methods"]]
+        for name in ("requests", "concurrency", "warmup", "director", "sysadmin", "password", "params", "db_latency_ms"):
+            if options[name] is not None:
+                forwarded += [f"--{name.replace('_', '-')}", str(options[name])]
+
+        servers = {}
+        for server in ("wsgi", "asgi"):
+            env = {**os.environ, "API_ASYNC_DISPATCH": "1" if server == "asgi" else "0"}
+            result = subprocess.run(
+                [sys.executable, str(settings.BASE_DIR / "manage.py"), "benchmark_api", *forwarded, "--server", server],
+                env=env, capture_output=True, text=True,
+            )
+            if result.returncode:
+                raise CommandError(f"{server}: {result.stderr.strip()}")
+            servers[server] = json.loads(result.stdout)
+
+        comparison = {}
+        for method in options["methods"]:
+            wsgi, asgi = servers["wsgi"]["methods"][method], servers["asgi"]["methods"][method]
+            comparison[method] = {
+                "wsgi_rps": wsgi["throughput_rps"],
+                "asgi_rps": asgi["throughput_rps"],
+                "asgi_to_wsgi": round(asgi["throughput_rps"] / wsgi["throughput_rps"], 2) if wsgi["throughput_rps"] else None,
+                "wsgi_p95_ms": wsgi["p95_ms"],
+                "asgi_p95_ms": asgi["p95_ms"],
+            }
+            self.stderr.write(f"{method}: {comparison[method]}")
+
+        self.write_report({
+            "revision": git_revision(),
+            "mode": "in-process",
+            "concurrency": options["concurrency"],
+            "db_latency_ms": options["db_latency_ms"],
+            "comparison": comparison,
+            "servers": servers,
+        }, options["output"])
+
+    @staticmethod
+    def add_db_latency(seconds):
+        """Задержка на каждый запрос во всех соединениях, включая соединения потоков"""
+        def delay(execute, sql, params, many, context):
+            time.sleep(seconds)
+            return execute(sql, params, many, context)
+
+        def install(connection, **kwargs):
+            if delay not in connection.execute_wrappers:
+                connection.execute_wrappers.append(delay)
+
+        connection_created.connect(install, weak=False)
+        for alias in connections:
+            install(connections[alias])
+
+    def find_user(self, email, role):
+        users = CustomUser.objects.filter(role=role, is_active=True)
+        users = users.filter(email=email) if email else users.filter(email__endswith=f"@{SYNTHETIC_DOMAIN}")
+        user = users.order_by("-date_joined").first()
+        if user is None and role == CustomUser.Roles.CLINIC_DIRECTOR:
+            raise CommandError("Нет директора клиники — сначала generate_clinic_data")
+        return user
+
+    def login(self, email, password):
+        data = self.call("login", {"email": email, "password": password})[0]
+        try:
+            return data["response"]["access_token"]
+        except (KeyError, TypeError):
+            raise CommandError(f"Не удалось войти как {email}: {data}")
+
+    def run(self, method, params, token, total, concurrency):
+        if not self.url:
+            metrics.reset()
+        before = self.remote_queries(method)
+
+        def one(_):
+            start = time.perf_counter()
+            data, queries = self.call(method, params, token)
+            return time.perf_counter() - start, self.failed(data), queries
+
+        started = time.perf_counter()
+        if self.server == "asgi" and not self.url:
+            # AsyncClient всегда шлёт Host: testserver
+            with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]):
+                results = asyncio.run(self.run_async(method, params, token, total, concurrency))
+        else:
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                results = list(pool.map(one, range(total)))
+        wall = time.perf_counter() - started
+
+        latencies = [r[0] for r in results]
+        errors = sum(r[1] for r in results)
+        if self.url:
+            after = self.remote_queries(method)
+            queries = [(after - before) / total] if before is not None and after is not None else None
+        elif self.server == "asgi":
+            # Запросы идут в потоках пула диспетчера — берём из метрик процесса
+            stats = metrics.snapshot().get(method)
+            queries = [stats["queries_sum"] / stats["count"]] if stats and stats["count"] else None
+        else:
+            queries = [r[2] for r in results]
+        return summarize(latencies, errors, wall, queries)
+
+    async def run_async(self, method, params, token, total, concurrency):
+        """total вызовов через ASGI-обработчик Django, не больше concurrency одновременно"""
+        client = AsyncClient()
+        body = json.dumps({"method": method, "params": params})
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        limit = asyncio.Semaphore(concurrency)
+
+        async def one():
+            async with limit:
+                start = time.perf_counter()
+                response = await client.post("/api/v1/", body, content_type="application/json", headers=headers)
+                return time.perf_counter() - start, self.failed(response.json()), None
+
+        return await asyncio.gather(*(one() for _ in range(total)))
+
+    @staticmethod
+    def host():
+        # testserver не входит в ALLOWED_HOSTS вне тестов
+        return next((h for h in settings.ALLOWED_HOSTS if h not in ("*",) and not h.startswith(".")), "localhost")
+
+    @staticmethod
+    def failed(data):
+        status = data.get("status") if isinstance(data, dict) else None
+        return not isinstance(data, dict) or "frame" in data or status is False or (
+            isinstance(status, int) and not isinstance(status, bool) and status >= 400
+        )
+
+    def call(self, method, params, token=None):
+        """Один вызов API → (ответ, число SQL-запросов или None для HTTP)"""
+        body = json.dumps({"method": method, "params": params})
+        headers = {"Content-Type": "application/json"}
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+
+        if self.url:
+            request = urllib.request.Request(f"{self.url}/api/v1/", data=body.encode(), headers=headers, method="POST")
+            with urllib.request.urlopen(request) as response:
+                return json.loads(response.read()), None
+
+        client = getattr(self.local, "client", None)
+        if client is None:
+            client = self.local.client = Client(HTTP_HOST=self.host())
+        extra = {"HTTP_AUTHORIZATION": headers["Authorization"]} if token else {}
+        try:
+            with metrics.track_queries() as tracker:
+                response = client.post("/api/v1/", body, content_type="application/json", **extra)
+        finally:
+            # Соединения потоков пула закрываем сами — иначе они висят до конца процесса
+            if threading.current_thread() is not threading.main_thread():
+                connections.close_all()
+        return response.json(), tracker.queries
+
+    def remote_queries(self, method):
+        """Счётчик SQL-запросов метода из /metrics/ сервера (дельта до/после прогона)"""
+        if not self.url:
+            return None
+        headers = {"Authorization": f"Bearer {self.metrics_token}"} if self.metrics_token else {}
+        try:
+            with urllib.request.urlopen(urllib.request.Request(f"{self.url}/metrics/", headers=headers)) as response:
+                text = response.read().decode()
+        except OSError:
+            return None
+        for name, value in QUERIES_RE.findall(text):
+            if name == method:
+                return int(value)
+        return 0
@@ -0,0 +1,80 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+from rest_framework.renderers import JSONRenderer
+
+from core.management.commands.generate_clinic_data import SYNTHETIC_DOMAIN
+from core.models import CustomUser
+from helper import renderers
+from helper.benchmark import git_revision, summarize
+from v1 import services
+from v1.services.auth import generate_tokens
+
+DEFAULT_METHODS = ["patient_list", "doctor_list", "doctor_leaderboard", "finance_report", "diagnosis_report"]
+
+
+class Command(BaseCommand):
+    help = "Сериализация ответов API: стандартный JSONRenderer DRF против helper.renderers (orjson) на реальных данных"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--methods", nargs="+", default=DEFAULT_METHODS)
+        parser.add_argument("--page-size", type=int, default=500)
+        parser.add_argument("--repeat", type=int, default=50, help="Сериализаций на рендерер")
+        parser.add_argument("--director", default=None, help="Email директора (по умолчанию последний синтетический)")
+        parser.add_argument("--output", default=None, help="Файл для JSON-отчёта (по умолчанию stdout)")
+
+    def handle(self, *args, **options):
+        users = CustomUser.objects.filter(role=CustomUser.Roles.CLINIC_DIRECTOR, is_active=True)
+        email = options["director"]
+        users = users.filter(email=email) if email else users.filter(email__endswith=f"@{SYNTHETIC_DOMAIN}")
+        director = users.order_by("-date_joined").first()
+        if director is None:
+            raise CommandError("Нет директора клиники — сначала generate_clinic_data")
+
+        request = RequestFactory().post("/api/v1/", HTTP_AUTHORIZATION=f"Bearer {generate_tokens(director.id)[0]}")
+        candidates = {
+            "drf": JSONRenderer(),
+            "fast": renderers.FastJSONRenderer(),
+        }
+        report = {
+            "revision": git_revision(),
+            "backend": "orjson" if renderers.orjson is not None else "json",
+            "page_size": options["page_size"],
+            "repeat": options["repeat"],
+            "methods": {},
+        }
+
+        for method in options["methods"]:
+            func = getattr(services, method, None)
+            if not callable(func):
+                raise CommandError(f"Нет метода {method}")
+            data = func(request, {"page_size": options["page_size"]})
+            if data.get("status") != 200:
+                raise CommandError(f"{method}: {data}")
+
+            results = {}
+            for name, renderer in candidates.items():
+                latencies = []
+                for _ in range(options["repeat"]):
+                    start = time.perf_counter()
+                    body = renderer.render(data)
+                    latencies.append(time.perf_counter() - start)
+                results[name] = {**summarize(latencies, errors=0, wall=sum(latencies)), "bytes": len(body)}
+
+            # Один и тот же документ, отличаться может только запись чисел и дат
+            same = json.loads(candidates["drf"].render(data)) == json.loads(candidates["fast"].render(data))
+            drf, fast = results["drf"]["p50_ms"], results["fast"]["p50_ms"]
+            report["methods"][method] = {
+                "rows": len(next((v for v in data["response"].values() if isinstance(v, list)), [])),
+                "speedup_p50": round(drf / fast, 2) if fast else None,
+                "same_document": same,
+                **results,
+            }
+            self.stderr.write(f"{method}: drf {drf} мс, fast {fast} мс")
+
+        self.stdout.write(json.dumps(report, ensure_ascii=False, indent=2))
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from helper import icd10
+
+
+class Command(BaseCommand):
+    help = "Сборка mmap-индекса справочника МКБ-10 для diagnosis_search (при деплое, до запуска воркеров)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--source", default=None, help="TSV: code, title_ru, title_uz (по умолчанию ICD10_SOURCE)")
+        parser.add_argument("--output", default=None, help="Файл индекса (по умолчанию ICD10_INDEX)")
+
+    def handle(self, *args, **options):
+        source = options["source"] or icd10.source_path()
+        output = options["output"] or icd10.index_path()
+        started = time.perf_counter()
+        try:
+            count = icd10.build(source, output)
+        except FileNotFoundError:
+            raise CommandError(f"Нет файла: {source}")
+        self.stdout.write(self.style.SUCCESS(
+            f"МКБ-10: {count} кодов → {output} за {time.perf_counter() - started:.2f} с"
+        ))
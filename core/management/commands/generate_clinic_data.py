@@ -0,0 +1,249 @@
+import random
+import time
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max, Min, OuterRef, Subquery
+from django.utils import timezone
+
+from core.models import (
+    Appointment, Branch, Clinic, ClinicDirectorProfile, CustomUser, DoctorProfile, MedicalRecord, Patient,
+    Payment, Plan, Service, ServiceCategory, Subscription,
+)
+from helper.rollups import rollup
+from v1.services.director.dedupe import recompute_patient_counters
+
+FIRST_NAMES = ["Алишер", "Дилшод", "Азиз", "Бахтиёр", "Жасур", "Нодира", "Гулнора", "Мадина", "Севара", "Камола",
+               "Иван", "Ольга", "Сергей", "Анна", "Тимур", "Лола", "Шахзод", "Зарина", "Рустам", "Малика"]
+LAST_NAMES = ["Каримов", "Усманов", "Рахимов", "Юсупов", "Ахмедов", "Назаров", "Исмоилов", "Иванов", "Ким", "Тошматов"]
+SPECIALIZATIONS = ["Терапевт", "Кардиолог", "Невролог", "ЛОР", "Стоматолог", "Педиатр", "Гинеколог", "Хирург", "Офтальмолог", "Уролог"]
+CATEGORIES = ["Консультации", "Диагностика", "Анализы", "Процедуры", "Стоматология"]
+ICD10 = ["J06.9", "I10", "K29.7", "M54.5", "E11.9", "R51", "J20.9", "N39.0", "H10.9", "L20.8"]
+PAYMENT_METHODS = ["cash", "card", "uzcard", "payme", "click", "transfer"]
+
+# Распределение статусов приёмов (прошедшие)
+PAST_STATUSES = [
+    (Appointment.Status.COMPLETED, 0.78),
+    (Appointment.Status.CANCELLED, 0.12),
+    (Appointment.Status.NO_SHOW, 0.10),
+]
+
+PASSWORD = "texelmed123"
+
+# Домен синтетических пользователей (по нему benchmark_api находит учётки)
+SYNTHETIC_DOMAIN = "synthetic.texelmed"
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = "Генерирует синтетические клиники (филиалы, врачи, пациенты, приёмы, оплаты) для нагрузочных тестов"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clinics", type=int, default=1)
+        parser.add_argument("--branches", type=int, default=5, help="Филиалов на клинику")
+        parser.add_argument("--doctors", type=int, default=30, help="Врачей на клинику")
+        parser.add_argument("--services", type=int, default=40, help="Услуг на клинику")
+        parser.add_argument("--patients", type=int, default=100_000, help="Пациентов на клинику")
+        parser.add_argument("--appointments", type=int, default=1_000_000, help="Приёмов на клинику")
+        parser.add_argument("--days", type=int, default=730, help="Глубина истории приёмов в днях")
+        parser.add_argument("--payment-ratio", type=float, default=0.9, help="Доля завершённых приёмов с оплатой")
+        parser.add_argument("--record-ratio", type=float, default=0.5, help="Доля завершённых приёмов с мед. записью")
+        parser.add_argument("--chunk-size", type=int, default=5000)
+        parser.add_argument("--seed", type=int, default=None)
+        parser.add_argument("--tag", default=None, help="Метка для email/slug (по умолчанию случайная)")
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options["seed"])
+        self.chunk_size = options["chunk_size"]
+        self.tag = options["tag"] or uuid.uuid4().hex[:6]
+        self.password = make_password(PASSWORD)
+        self.now = timezone.now()
+        started = time.perf_counter()
+
+        plan, _ = Plan.objects.get_or_create(
+            slug=f"synthetic-{self.tag}",
+            defaults={
+                "name": f"Synthetic {self.tag}", "price_monthly": Decimal("1000000"),
+                "limit_users": 1_000_000, "limit_branches": 10_000, "limit_clinics": 10_000, "limit_patients": 100_000_000,
+            },
+        )
+
+        CustomUser.objects.get_or_create(
+            email=f"sysadmin-{self.tag}@{SYNTHETIC_DOMAIN}",
+            defaults={"password": self.password, "full_name": f"Sysadmin {self.tag}", "role": CustomUser.Roles.SYSTEM_ADMIN},
+        )
+
+        for index in range(options["clinics"]):
+            self.generate_clinic(index, plan, options)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Готово за {time.perf_counter() - started:.1f} с. Метка: {self.tag}, пароль пользователей: {PASSWORD}"
+        ))
+
+    def bulk(self, model, objects):
+        """bulk_create чанками; objects может быть генератором"""
+        total = 0
+        for chunk in chunked(objects, self.chunk_size):
+            model.objects.bulk_create(chunk, batch_size=self.chunk_size)
+            total += len(chunk)
+        return total
+
+    def person(self):
+        return f"{self.rng.choice(LAST_NAMES)} {self.rng.choice(FIRST_NAMES)}"
+
+    def phone(self):
+        return f"+99890{self.rng.randint(1000000, 9999999)}"
+
+    def generate_clinic(self, index, plan, options):
+        rng = self.rng
+        prefix = f"{self.tag}-{index}"
+        step = time.perf_counter()
+
+        with transaction.atomic():
+            clinic = Clinic.objects.create(name=f"Клиника {prefix}", legal_name=f"ООО «Клиника {prefix}»")
+            Subscription.objects.create(
+                clinic=clinic, plan=plan, status="active",
+                period_start=self.now.date(), period_end=self.now.date() + timedelta(days=30),
+            )
+            director = CustomUser(
+                email=f"director-{prefix}@{SYNTHETIC_DOMAIN}", password=self.password, full_name=self.person(),
+                phone=self.phone(), role=CustomUser.Roles.CLINIC_DIRECTOR, clinic=clinic,
+            )
+            CustomUser.objects.bulk_create([director])
+            ClinicDirectorProfile.objects.create(user=director, clinic=clinic)
+
+            branches = [
+                Branch(clinic=clinic, name=f"Филиал {b + 1}", address=f"ул. {b + 1}, Ташкент", phone=self.phone(),
+                       working_hours="Пн-Сб 08:00 - 20:00")
+                for b in range(options["branches"])
+            ]
+            self.bulk(Branch, branches)
+
+            doctors = [
+                CustomUser(
+                    email=f"doctor-{prefix}-{d}@{SYNTHETIC_DOMAIN}", password=self.password, full_name=self.person(),
+                    phone=self.phone(), role=CustomUser.Roles.DOCTOR, clinic=clinic, branch=rng.choice(branches),
+                )
+                for d in range(options["doctors"])
+            ]
+            self.bulk(CustomUser, doctors)
+            schedule = {day: {"start": "09:00", "end": "18:00"} for day in ("mon", "tue", "wed", "thu", "fri")}
+            self.bulk(DoctorProfile, (
+                DoctorProfile(
+                    user=doctor, branch=doctor.branch, specialization=rng.choice(SPECIALIZATIONS),
+                    cabinet=str(rng.randint(1, 60)), experience_years=rng.randint(1, 35), schedule=schedule,
+                    rating=Decimal(rng.randint(300, 500)) / 100,
+                )
+                for doctor in doctors
+            ))
+
+            categories = [ServiceCategory(clinic=clinic, name=name, order=i) for i, name in enumerate(CATEGORIES)]
+            self.bulk(ServiceCategory, categories)
+            services = [
+                Service(
+                    clinic=clinic, category=rng.choice(categories), name=f"Услуга {s + 1}",
+                    price=Decimal(rng.randint(5, 100) * 10_000), duration_minutes=rng.choice([15, 20, 30, 45, 60]),
+                )
+                for s in range(options["services"])
+            ]
+            self.bulk(Service, services)
+        self.log(f"[{prefix}] структура клиники", step)
+
+        # Пациенты: храним только id и филиал — объекты уходят в БД чанками
+        step = time.perf_counter()
+        patient_ids = []
+        birth_start = self.now.date() - timedelta(days=365 * 90)
+
+        def patients():
+            for p in range(options["patients"]):
+                patient = Patient(
+                    clinic=clinic, primary_branch=rng.choice(branches), full_name=self.person(), phone=self.phone(),
+                    birth_date=birth_start + timedelta(days=rng.randint(0, 365 * 89)),
+                    gender=rng.choice(["male", "female"]), card_number=f"{prefix}-{p + 1:07d}",
+                )
+                patient_ids.append(patient.id)
+                yield patient
+
+        with transaction.atomic():
+            created = self.bulk(Patient, patients())
+        self.log(f"[{prefix}] пациентов: {created}", step)
+
+        # Приёмы + оплаты + мед. записи потоком, чанками
+        step = time.perf_counter()
+        counts = {"appointments": 0, "payments": 0, "records": 0}
+        history = timedelta(days=options["days"])
+        statuses, weights = zip(*PAST_STATUSES)
+
+        for chunk in chunked(range(options["appointments"]), self.chunk_size):
+            appointments, payments, records = [], [], []
+            for _ in chunk:
+                doctor = rng.choice(doctors)
+                service = rng.choice(services)
+                start = self.now - history + timedelta(minutes=rng.randint(0, int(history.total_seconds() // 60) + 60 * 24 * 14))
+                start = start.replace(second=0, microsecond=0)
+                if start > self.now:
+                    status = rng.choice([Appointment.Status.PENDING, Appointment.Status.CONFIRMED])
+                else:
+                    status = rng.choices(statuses, weights)[0]
+                completed = status == Appointment.Status.COMPLETED
+                appointment = Appointment(
+                    clinic=clinic, branch=doctor.branch, doctor=doctor, patient_id=rng.choice(patient_ids),
+                    service=service, start_time=start, end_time=start + timedelta(minutes=service.duration_minutes),
+                    status=status, price_paid=service.price if completed else None,
+                )
+                appointments.append(appointment)
+                if completed and rng.random() < options["payment_ratio"]:
+                    payments.append(Payment(
+                        clinic=clinic, patient_id=appointment.patient_id, appointment=appointment,
+                        amount=service.price, method=rng.choice(PAYMENT_METHODS),
+                    ))
+                if completed and rng.random() < options["record_ratio"]:
+                    records.append(MedicalRecord(
+                        patient_id=appointment.patient_id, doctor=doctor, appointment=appointment, visit_date=start,
+                        complaints="Жалобы на самочувствие", diagnosis_icd10=rng.choice(ICD10),
+                        diagnosis_text="Синтетический диагноз", prescriptions="Назначения по протоколу",
+                    ))
+            with transaction.atomic():
+                Appointment.objects.bulk_create(appointments, batch_size=self.chunk_size)
+                Payment.objects.bulk_create(payments, batch_size=self.chunk_size)
+                MedicalRecord.objects.bulk_create(records, batch_size=self.chunk_size)
+            counts["appointments"] += len(appointments)
+            counts["payments"] += len(payments)
+            counts["records"] += len(records)
+        self.log(f"[{prefix}] приёмов: {counts['appointments']}, оплат: {counts['payments']}, записей: {counts['records']}", step)
+
+        step = time.perf_counter()
+        self.finalize(clinic)
+        self.log(f"[{prefix}] даты оплат, счётчики пациентов и сводка DailyMetrics", step)
+
+    def finalize(self, clinic):
+        """Set-based UPDATE: paid_at = конец приёма (auto_now_add при bulk_create ставит now) и счётчики пациентов.
+        bulk_create и update() сигналов не шлют — сводка DailyMetrics пересчитывается за весь период данных"""
+        Payment.objects.filter(clinic=clinic, appointment__isnull=False).update(
+            paid_at=Subquery(Appointment.objects.filter(pk=OuterRef("appointment_id")).values("end_time")[:1])
+        )
+
+        recompute_patient_counters(Patient.objects.filter(clinic=clinic))
+
+        bounds = Appointment.objects.filter(clinic=clinic).aggregate(first=Min("start_time"), last=Max("end_time"))
+        today = timezone.localdate()
+        first = min(timezone.localdate(bounds["first"]), today) if bounds["first"] else today
+        last = max(timezone.localdate(bounds["last"]), today) if bounds["last"] else today
+        rollup([clinic.id], first, last)
+
+    def log(self, message, started):
+        self.stdout.write(f"{message} — {time.perf_counter() - started:.1f} с")
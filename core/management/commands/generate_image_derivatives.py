@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from core.models import Clinic, CustomUser, PatientFile
+from helper import images
+
+MODELS = {"users": CustomUser, "clinics": Clinic, "files": PatientFile}
+
+
+class Command(BaseCommand):
+    help = "WebP-копии изображений без готовых копий: загруженные до пайплайна или потерянные при остановке воркера"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--only", choices=sorted(MODELS), action="append", help="Только эти строки (по умолчанию все)")
+
+    def handle(self, *args, **options):
+        for name in options["only"] or MODELS:
+            model = MODELS[name]
+            done = skipped = 0
+            for pk in images.pending(model).values_list("pk", flat=True).iterator():
+                if images.generate(model, pk):
+                    done += 1
+                else:
+                    skipped += 1
+            self.stdout.write(self.style.SUCCESS(f"{name}: готово {done}, пропущено {skipped}"))
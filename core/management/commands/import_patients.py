@@ -0,0 +1,55 @@
+import json
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Clinic
+from v1.services.director.imports import IMPORT_CHUNK_SIZE, PatientImportError, import_patients, read_rows
+
+
+class Command(BaseCommand):
+    help = "Импорт пациентов клиники из CSV/JSONL (проверка всех строк, затем bulk_create в одной транзакции)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--clinic", required=True, help="id клиники")
+        parser.add_argument("--branch", default=None, help="id филиала по умолчанию (если в файле нет колонки филиала)")
+        parser.add_argument("--format", choices=["csv", "jsonl"], default=None, help="По умолчанию по расширению файла")
+        parser.add_argument("--dry-run", action="store_true", help="Только проверить, ничего не записывать")
+        parser.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE)
+        parser.add_argument("--report", default=None, help="Файл для JSON-отчёта с ошибками по строкам")
+
+    def handle(self, *args, **options):
+        path = Path(options["path"])
+        file_format = options["format"] or ("jsonl" if path.suffix.lower() in (".jsonl", ".ndjson") else "csv")
+        clinic = Clinic.objects.filter(id=options["clinic"]).first()
+        if clinic is None:
+            raise CommandError("Клиника не найдена")
+
+        started = time.perf_counter()
+        try:
+            with path.open(encoding="utf-8-sig", newline="") as f:
+                rows = read_rows(f, file_format)
+            report = import_patients(
+                clinic, rows, branch_id=options["branch"], dry_run=options["dry_run"], chunk_size=options["chunk_size"],
+            )
+        except OSError as e:
+            raise CommandError(f"Не удалось прочитать файл: {e}")
+        except PatientImportError as e:
+            raise CommandError(str(e))
+
+        for item in report["errors"][:20]:
+            self.stderr.write(f"строка {item['row']}: {'; '.join(item['errors'])}")
+        if len(report["errors"]) > 20:
+            self.stderr.write(f"… ещё {len(report['errors']) - 20} строк с ошибками")
+
+        if options["report"]:
+            with open(options["report"], "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+
+        action = "Проверено" if options["dry_run"] else "Создано"
+        self.stdout.write(self.style.SUCCESS(
+            f"{action}: {report['valid']} из {report['total']}, пропущено (уже есть): {report['skipped']}, "
+            f"ошибок: {report['failed']} — {time.perf_counter() - started:.1f} с"
+        ))
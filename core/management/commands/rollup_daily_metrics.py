@@ -0,0 +1,70 @@
+import time
+from datetime import timedelta
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from core.models import Clinic
+from helper.rollups import drain, rollup
+
+
+class Command(BaseCommand):
+    help = (
+        "Пересчёт суточных сводок DailyMetrics и DiagnosisMetrics (по умолчанию — вчера и сегодня; для ночного запуска по cron). "
+        "--pending — только дни из очереди изменений PendingRollup (cron раз в минуту)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--from", dest="date_from", default=None, help="Первый день, YYYY-MM-DD")
+        parser.add_argument("--to", dest="date_to", default=None, help="Последний день, YYYY-MM-DD (по умолчанию сегодня)")
+        parser.add_argument("--days", type=int, default=2, help="Дней до сегодня включительно, если нет --from")
+        parser.add_argument("--clinic", action="append", default=None, help="id клиники (можно несколько раз)")
+        parser.add_argument("--chunk-days", type=int, default=31, help="Дней в одной транзакции пересчёта")
+        parser.add_argument("--pending", action="store_true", help="Разобрать очередь PendingRollup и выйти")
+
+    def handle(self, *args, **options):
+        if options["pending"]:
+            started = time.perf_counter()
+            groups = drain()
+            self.stdout.write(self.style.SUCCESS(f"PendingRollup: {groups} пересчётов за {time.perf_counter() - started:.1f} с"))
+            return
+
+        date_to = self.parse(options["date_to"]) or timezone.localdate()
+        date_from = self.parse(options["date_from"]) or date_to - timedelta(days=max(options["days"], 1) - 1)
+        if date_from > date_to:
+            raise CommandError("--from позже --to")
+
+        clinic_ids = None
+        if options["clinic"]:
+            try:
+                clinic_ids = list(Clinic.objects.filter(id__in=options["clinic"]).values_list("id", flat=True))
+            except ValidationError:
+                clinic_ids = []
+            if len(clinic_ids) != len(set(options["clinic"])):
+                raise CommandError("Клиника не найдена")
+
+        started = time.perf_counter()
+        total = 0
+        step = timedelta(days=max(options["chunk_days"], 1))
+        start = date_from
+        while start <= date_to:
+            end = min(start + step - timedelta(days=1), date_to)
+            total += rollup(clinic_ids, start, end)
+            start = end + timedelta(days=1)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"DailyMetrics {date_from} — {date_to}: {total} строк за {time.perf_counter() - started:.1f} с"
+        ))
+
+    def parse(self, value):
+        if value is None:
+            return None
+        try:
+            parsed = parse_date(value)
+        except ValueError:
+            parsed = None
+        if parsed is None:
+            raise CommandError(f"Неверная дата: {value}")
+        return parsed
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.8 on 2026-10-19 05:24
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_remove_branch_photo_remove_branch_work_hours_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyMetrics',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('date', models.DateField()),
+                ('dimension', models.CharField(choices=[('clinic', 'Клиника'), ('branch', 'Филиал'), ('doctor', 'Врач'), ('service', 'Услуга')], max_length=10)),
+                ('key', models.UUIDField()),
+                ('appointments', models.PositiveIntegerField(default=0)),
+                ('visits', models.PositiveIntegerField(default=0)),
+                ('cancellations', models.PositiveIntegerField(default=0)),
+                ('no_shows', models.PositiveIntegerField(default=0)),
+                ('new_patients', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('clinic', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_metrics', to='core.clinic')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['clinic', 'dimension', 'date'], name='core_dailym_clinic__6c24c2_idx')],
+                'constraints': [models.UniqueConstraint(fields=('clinic', 'dimension', 'key', 'date'), name='daily_metrics_unique')],
+            },
+        ),
+    ]
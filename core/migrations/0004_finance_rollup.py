@@ -0,0 +1,57 @@
+# Generated by Django 5.2.8 on 2026-10-19 05:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_daily_metrics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dailymetrics',
+            name='payments',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='dailymetrics',
+            name='revenue_card',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='dailymetrics',
+            name='revenue_cash',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='dailymetrics',
+            name='revenue_click',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='dailymetrics',
+            name='revenue_payme',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='dailymetrics',
+            name='revenue_transfer',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='dailymetrics',
+            name='revenue_uzcard',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=14),
+        ),
+        migrations.AlterField(
+            model_name='dailymetrics',
+            name='dimension',
+            field=models.CharField(choices=[('clinic', 'Клиника'), ('branch', 'Филиал'), ('doctor', 'Врач'), ('service', 'Услуга'), ('category', 'Категория услуг')], max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['clinic', 'paid_at'], name='core_paymen_clinic__efd8d0_idx'),
+        ),
+    ]
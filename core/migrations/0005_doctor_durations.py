@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-19 05:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_finance_rollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dailymetrics',
+            name='booked_seconds',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='dailymetrics',
+            name='visit_seconds',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
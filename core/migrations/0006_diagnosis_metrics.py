@@ -0,0 +1,31 @@
+# Generated by Django 5.2.8 on 2026-10-19 05:53
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_doctor_durations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DiagnosisMetrics',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('date', models.DateField()),
+                ('code', models.CharField(max_length=20)),
+                ('gender', models.CharField(blank=True, max_length=10)),
+                ('age_band', models.CharField(max_length=16)),
+                ('records', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('clinic', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='diagnosis_metrics', to='core.clinic')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('clinic', 'date', 'code', 'gender', 'age_band'), name='diagnosis_metrics_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-19 06:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_patient_file_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='clinic',
+            name='logo_sha256',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='photo_sha256',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='patientfile',
+            name='has_preview',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
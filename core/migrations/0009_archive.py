@@ -0,0 +1,39 @@
+# Generated by Django 5.2.8 on 2026-10-19 06:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='clinic',
+            name='archived_before',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.CreateModel(
+            name='ArchivedRecord',
+            fields=[
+                ('id', models.UUIDField(editable=False, primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('appointment', 'Приём'), ('payment', 'Оплата'), ('medical_record', 'Запись медкарты')], max_length=20)),
+                ('occurred_at', models.DateTimeField()),
+                ('status', models.CharField(blank=True, max_length=20)),
+                ('amount', models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True)),
+                ('branch_id', models.UUIDField(blank=True, null=True)),
+                ('doctor_id', models.UUIDField(blank=True, null=True)),
+                ('category_id', models.UUIDField(blank=True, null=True)),
+                ('payload', models.BinaryField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('clinic', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_records', to='core.clinic')),
+                ('patient', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='archived_records', to='core.patient')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['patient', 'kind', 'occurred_at'], name='core_archiv_patient_e089ae_idx'), models.Index(fields=['clinic', 'kind', 'occurred_at'], name='core_archiv_clinic__29c3da_idx')],
+            },
+        ),
+    ]
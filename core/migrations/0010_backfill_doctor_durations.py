@@ -0,0 +1,63 @@
+from collections import defaultdict
+
+from django.db import migrations
+from django.db.models import DurationField, ExpressionWrapper, F, Q, Sum
+from django.db.models.functions import TruncDate
+
+# Разрез сводки → поле приёма (как в helper/rollups.py на момент 0005)
+DIMENSIONS = {
+    "branch": "branch_id",
+    "doctor": "doctor_id",
+    "service": "service_id",
+    "category": "service__category_id",
+}
+
+
+def _seconds(value):
+    return max(int(value.total_seconds()), 0) if value else 0
+
+
+def backfill(apps, schema_editor):
+    """visit_seconds / booked_seconds для строк DailyMetrics, построенных до 0005 (там они 0)"""
+    Appointment = apps.get_model("core", "Appointment")
+    DailyMetrics = apps.get_model("core", "DailyMetrics")
+    stale = DailyMetrics.objects.filter(appointments__gt=0, visit_seconds=0, booked_seconds=0)
+    if not stale.exists():
+        return
+
+    duration = ExpressionWrapper(F("end_time") - F("start_time"), output_field=DurationField())
+    grouped = Appointment.objects.annotate(day=TruncDate("start_time")).values(
+        "clinic_id", "day", *DIMENSIONS.values()
+    ).annotate(
+        visit_time=Sum(duration, filter=Q(status="completed")),
+        booked_time=Sum(duration, filter=~Q(status="cancelled")),
+    ).order_by()
+
+    totals = defaultdict(lambda: [0, 0])
+    for row in grouped.iterator():
+        keys = [("clinic", row["clinic_id"])] + [(dimension, row[field]) for dimension, field in DIMENSIONS.items()]
+        for dimension, key in keys:
+            if key is None:
+                continue
+            bucket = totals[(row["clinic_id"], row["day"], dimension, key)]
+            bucket[0] += _seconds(row["visit_time"])
+            bucket[1] += _seconds(row["booked_time"])
+
+    changed = []
+    for metrics in stale.iterator():
+        visit, booked = totals.get((metrics.clinic_id, metrics.date, metrics.dimension, metrics.key), (0, 0))
+        if visit or booked:
+            metrics.visit_seconds, metrics.booked_seconds = visit, booked
+            changed.append(metrics)
+    DailyMetrics.objects.bulk_update(changed, ["visit_seconds", "booked_seconds"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_archive'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.8 on 2026-10-19 06:34
+
+import json
+import zlib
+
+from django.db import migrations, models
+
+
+def backfill(apps, schema_editor):
+    """method / code архивных строк — из их payload"""
+    ArchivedRecord = apps.get_model("core", "ArchivedRecord")
+    changed = []
+    for record in ArchivedRecord.objects.filter(kind__in=("payment", "medical_record")).iterator(chunk_size=1000):
+        data = json.loads(zlib.decompress(bytes(record.payload)))
+        record.method = data.get("method") or ""
+        record.code = data.get("diagnosis_icd10") or ""
+        changed.append(record)
+        if len(changed) >= 1000:
+            ArchivedRecord.objects.bulk_update(changed, ["method", "code"])
+            changed = []
+    ArchivedRecord.objects.bulk_update(changed, ["method", "code"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_backfill_doctor_durations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedrecord',
+            name='code',
+            field=models.CharField(blank=True, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='archivedrecord',
+            name='method',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
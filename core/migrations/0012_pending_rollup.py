@@ -0,0 +1,26 @@
+# Generated by Django 5.2.8 on 2026-10-19 06:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_archive_method_code'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('daily', 'DailyMetrics'), ('diagnosis', 'DiagnosisMetrics')], max_length=10)),
+                ('date', models.DateField()),
+                ('clinic', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pending_rollups', to='core.clinic')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('clinic', 'kind', 'date'), name='pending_rollup_unique')],
+            },
+        ),
+    ]
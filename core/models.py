@@ -42,6 +42,8 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
     phone = PhoneNumberField(blank=True, null=True, db_index=True)
     full_name = models.CharField(max_length=255)
     photo = models.ImageField(upload_to='users/photos/', blank=True, null=True)
+    # SHA-256 фото, для которого готовы уменьшенные копии (helper/images.py); пусто — только оригинал
+    photo_sha256 = models.CharField(max_length=64, blank=True, editable=False)
 
     role = models.CharField(max_length=20, choices=Roles.choices, db_index=True, default=Roles.PENDING_DIRECTOR)
 
@@ -188,22 +190,28 @@ class Clinic(models.Model):
     legal_name = models.CharField(max_length=500, blank=True)
     inn = models.CharField(max_length=20, blank=True)
     logo = models.ImageField(upload_to='clinics/logos/', blank=True, null=True)
+    logo_sha256 = models.CharField(max_length=64, blank=True, editable=False)
     status = models.CharField(max_length=20, choices=Status.choices, default=Status.ACTIVE)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Граница архива (helper/archive.py): старые приёмы, оплаты и записи — в ArchivedRecord, сводки до неё не пересчитываются
+    archived_before = models.DateTimeField(null=True, blank=True, editable=False)
 
     def __str__(self):
         return self.name
 
-    def check_limits(self):
-        """Проверка лимитов по подписке"""
+    def check_limits(self, users=None, branches=None, patients=None):
+        """Проверка лимитов по подписке (счётчики можно передать уже посчитанными)"""
         sub = getattr(self, 'subscription', None)
         if not sub or not sub.plan:
             return {"ok": False, "error": "Нет активного плана"}
 
         plan = sub.plan
-        users = self.users.filter(is_active=True).count()
-        branches = self.branches.filter(is_active=True).count()
-        patients = self.patients.count()
+        if users is None:
+            users = self.users.filter(is_active=True).count()
+        if branches is None:
+            branches = self.branches.filter(is_active=True).count()
+        if patients is None:
+            patients = self.patients.count()
 
         if users > plan.limit_users:
             return {"ok": False, "error": f"Пользователи: {users}/{plan.limit_users}"}
@@ -385,6 +393,12 @@ class Payment(models.Model):
     transaction_id = models.CharField(max_length=255, blank=True)
     paid_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Отчёты по клинике за период (finance_report, сводки DailyMetrics)
+            models.Index(fields=['clinic', 'paid_at']),
+        ]
+
     def __str__(self):
         return f"{self.amount} UZS • {self.get_method_display()}"
 
@@ -430,6 +444,21 @@ class PatientFile(models.Model):
     uploaded_by = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
+    # Метаданные содержимого — считаются при загрузке, списки не обращаются к хранилищу
+    size = models.PositiveBigIntegerField(null=True, blank=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    sha256 = models.CharField(max_length=64, blank=True, db_index=True)
+    # Для снимков построены WebP-миниатюра и превью (helper/images.py)
+    has_preview = models.BooleanField(default=False, editable=False)
+
+    def save(self, *args, **kwargs):
+        # Новое содержимое ещё не в хранилище — метаданные считаются по локальной копии
+        if self.file and not self.file._committed and not self.sha256:
+            from helper.files import digest
+
+            self.sha256, self.size, self.content_type = digest(self.file)
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.get_file_type_display()} • {self.patient}"
 # === 13. МАРКЕТИНГ И ПАКЕТЫ ===
@@ -484,3 +513,138 @@ class Promotion(models.Model):
 
     def __str__(self):
         return self.name
+
+
+# === 14. СВОДНЫЕ МЕТРИКИ ===
+class DailyMetrics(models.Model):
+    """Суточная сводка клиники и её разрезов — пересчитывается helper/rollups.py, отчёты суммируют строки"""
+    class Dimension(models.TextChoices):
+        CLINIC = 'clinic', 'Клиника'
+        BRANCH = 'branch', 'Филиал'
+        DOCTOR = 'doctor', 'Врач'
+        SERVICE = 'service', 'Услуга'
+        CATEGORY = 'category', 'Категория услуг'
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    clinic = models.ForeignKey(Clinic, on_delete=models.CASCADE, related_name='daily_metrics')
+    date = models.DateField()
+    dimension = models.CharField(max_length=10, choices=Dimension.choices)
+    # id клиники, филиала, врача, услуги или категории — по dimension
+    key = models.UUIDField()
+
+    appointments = models.PositiveIntegerField(default=0)
+    visits = models.PositiveIntegerField(default=0)
+    cancellations = models.PositiveIntegerField(default=0)
+    no_shows = models.PositiveIntegerField(default=0)
+    new_patients = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    payments = models.PositiveIntegerField(default=0)
+    # Длительность приёмов в секундах: завершённых и всех неотменённых (загрузка врача)
+    visit_seconds = models.PositiveBigIntegerField(default=0)
+    booked_seconds = models.PositiveBigIntegerField(default=0)
+
+    # Выручка по способам оплаты (Payment.method) — для finance_report
+    revenue_cash = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    revenue_card = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    revenue_uzcard = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    revenue_payme = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    revenue_click = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    revenue_transfer = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['clinic', 'dimension', 'key', 'date'], name='daily_metrics_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['clinic', 'dimension', 'date']),
+        ]
+
+    def __str__(self):
+        return f"{self.clinic_id} • {self.dimension} • {self.date}"
+
+
+class DiagnosisMetrics(models.Model):
+    """Суточная сводка диагнозов клиники: код МКБ-10 × пол × возрастная группа — для diagnosis_report"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    clinic = models.ForeignKey(Clinic, on_delete=models.CASCADE, related_name='diagnosis_metrics')
+    date = models.DateField()
+    # Код в верхнем регистре без пробелов; пол и возрастная группа пациента на дату визита
+    code = models.CharField(max_length=20)
+    gender = models.CharField(max_length=10, blank=True)
+    age_band = models.CharField(max_length=16)
+    records = models.PositiveIntegerField(default=0)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['clinic', 'date', 'code', 'gender', 'age_band'], name='diagnosis_metrics_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.clinic_id} • {self.code} • {self.date}"
+
+
+class PendingRollup(models.Model):
+    """Очередь пересчёта сводок: день клиники, в котором изменились приёмы, оплаты, пациенты или медкарты.
+
+    Пишется в транзакции изменения, разбирается вне запроса (helper/rollups.py: drain)
+    """
+    class Kind(models.TextChoices):
+        DAILY = 'daily', 'DailyMetrics'
+        DIAGNOSIS = 'diagnosis', 'DiagnosisMetrics'
+
+    clinic = models.ForeignKey(Clinic, on_delete=models.CASCADE, related_name='pending_rollups')
+    kind = models.CharField(max_length=10, choices=Kind.choices)
+    date = models.DateField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['clinic', 'kind', 'date'], name='pending_rollup_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.clinic_id} • {self.kind} • {self.date}"
+
+
+# === 15. АРХИВ ===
+class ArchivedRecord(models.Model):
+    """Приём, оплата или запись медкарты, перенесённые из рабочих таблиц в архив (helper/archive.py).
+
+    Строка целиком — в payload (JSON, сжатый zlib); в колонках — то, по чему архив ищут и суммируют.
+    id совпадает с id исходной строки.
+    """
+    class Kind(models.TextChoices):
+        APPOINTMENT = 'appointment', 'Приём'
+        PAYMENT = 'payment', 'Оплата'
+        MEDICAL_RECORD = 'medical_record', 'Запись медкарты'
+
+    id = models.UUIDField(primary_key=True, editable=False)
+    kind = models.CharField(max_length=20, choices=Kind.choices)
+    clinic = models.ForeignKey(Clinic, on_delete=models.CASCADE, related_name='archived_records')
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, null=True, blank=True, related_name='archived_records')
+    # start_time приёма, paid_at оплаты, visit_date записи
+    occurred_at = models.DateTimeField()
+    status = models.CharField(max_length=20, blank=True)
+    # Сумма оплаты / оплачено за приём
+    amount = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    # Разрезы отчётов — без внешних ключей: архив переживает удаление филиала, врача, категории
+    branch_id = models.UUIDField(null=True, blank=True)
+    doctor_id = models.UUIDField(null=True, blank=True)
+    category_id = models.UUIDField(null=True, blank=True)
+    # Способ оплаты и код диагноза — для выписки пациента и статистики диагнозов без распаковки payload
+    method = models.CharField(max_length=50, blank=True)
+    code = models.CharField(max_length=20, blank=True)
+    payload = models.BinaryField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['patient', 'kind', 'occurred_at']),
+            models.Index(fields=['clinic', 'kind', 'occurred_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} • {self.occurred_at:%d.%m.%Y}"
@@ -1,3 +1,15 @@
+from django.conf import settings
+from django.urls import path
+
+from core import views
+from helper.concurrency import async_view
+
 urlpatterns = [
-    
+    path('metrics/', views.api_metrics, name='api_metrics'),
+    # Под ASGI файл отдаётся по кускам, а не читается целиком (helper.concurrency.async_streaming)
+    path(
+        'files/<uuid:file_id>/',
+        async_view(views.patient_file) if settings.API_ASYNC_DISPATCH else views.patient_file,
+        name='patient_file',
+    ),
 ]
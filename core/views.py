@@ -1,3 +1,150 @@
-from django.shortcuts import render
+import mimetypes
+import os
+from urllib.parse import quote
 
-# Create your views here.
+from django.conf import settings
+from django.db.models import Exists, F, OuterRef
+from django.http import FileResponse, HttpResponse, HttpResponseForbidden, JsonResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_http_methods
+
+from core.models import ClinicDirectorProfile, CustomUser, PatientFile
+from helper import images, metrics
+from helper.files import CHUNK_SIZE, parse_range
+from v1.services.auth import authenticate_user
+
+# Сотрудники клиники, которым открыты файлы её пациентов (директор — через ClinicDirectorProfile)
+FILE_READER_ROLES = (CustomUser.Roles.CLINIC_ADMIN, CustomUser.Roles.DOCTOR)
+
+
+def api_metrics(request):
+    """Метрики диспетчера /api/v1/ в формате Prometheus"""
+    token = getattr(settings, "API_METRICS_TOKEN", None)
+    if token:
+        if request.headers.get("Authorization", "") != f"Bearer {token}":
+            return HttpResponseForbidden()
+    elif not settings.DEBUG:
+        return HttpResponseForbidden()
+
+    return HttpResponse(metrics.render_prometheus(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+class _Slice:
+    """Диапазон открытого файла для FileResponse: read() не выходит за конец диапазона,
+    fileno() — чтобы WSGI-сервер (gunicorn) отдал его через sendfile, не читая в Python"""
+
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file, self.remaining = file, length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b""
+        data = self.file.read(self.remaining if size is None or size < 0 else min(size, self.remaining))
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def _readable(user, document):
+    if user.role == CustomUser.Roles.SYSTEM_ADMIN or document.director:
+        return True
+    return user.role in FILE_READER_ROLES and user.clinic_id == document.clinic_id
+
+
+def _range_applies(request, etag, last_modified):
+    """If-Range: диапазон — только если файл не изменился с указанной версии"""
+    if_range = request.headers.get("If-Range")
+    if not if_range:
+        return True
+    if if_range.startswith(('"', "W/")):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
+
+
+@require_http_methods(["GET", "HEAD"])
+def patient_file(request, file_id):
+    """Файл пациента (?variant=thumb|preview — его WebP-копия) с проверкой доступа к клинике пациента.
+
+    Доступ проверяется одним запросом вместе с поиском файла. Поддерживаются Range (один диапазон),
+    ETag / Last-Modified (304, If-Range). Тело не читается в память: API_FILE_DELIVERY = "django" —
+    FileResponse (sendfile WSGI-сервера, если он умеет), "x-accel" / "x-sendfile" — отдаёт nginx / Apache.
+    """
+    user = authenticate_user(request)
+    if not user:
+        return JsonResponse({"error": "401"}, status=401)
+
+    director = ClinicDirectorProfile.objects.filter(user=user, clinic=OuterRef("patient__clinic_id"))
+    document = PatientFile.objects.filter(id=file_id).annotate(
+        clinic_id=F("patient__clinic_id"), director=Exists(director),
+    ).only("id", "file", "file_type", "uploaded_at", "size", "content_type", "sha256", "has_preview").first()
+    if not document or not document.file:
+        return JsonResponse({"error": "Not found"}, status=404)
+    if not _readable(user, document):
+        return JsonResponse({"error": "Нет прав"}, status=403)
+
+    storage = document.file.storage
+    variant = request.GET.get("variant")
+    if variant:
+        if variant not in images.DERIVATIVES or not document.has_preview:
+            return JsonResponse({"error": "Not found"}, status=404)
+        name, content_type = images.derivative_name(document.sha256, variant), "image/webp"
+        size, etag = None, f'"{document.sha256}-{variant}"'
+    else:
+        name = document.file.name
+        content_type = document.content_type or mimetypes.guess_type(name)[0] or "application/octet-stream"
+        size = document.size
+        etag = f'"{document.sha256}"' if document.sha256 else None
+    if size is None:
+        size = storage.size(name)
+    etag = etag or f'"{document.id.hex}-{size}"'
+    last_modified = int(document.uploaded_at.timestamp())
+
+    headers = {
+        "ETag": etag,
+        "Last-Modified": http_date(last_modified),
+        "Cache-Control": "private, max-age=86400",
+        "Accept-Ranges": "bytes",
+    }
+    # 304 / 412 — с заголовками версии из этого ответа
+    unchanged = HttpResponse(headers=headers)
+    conditional = get_conditional_response(request, etag=etag, last_modified=last_modified, response=unchanged)
+    if conditional is not unchanged:
+        return conditional
+
+    delivery = getattr(settings, "API_FILE_DELIVERY", "django")
+    if delivery in ("x-accel", "x-sendfile"):
+        # Range, длину и тело отдаёт веб-сервер по внутреннему пути
+        response = HttpResponse(content_type=content_type, headers=headers)
+        if delivery == "x-accel":
+            response["X-Accel-Redirect"] = getattr(settings, "API_FILE_ACCEL_PREFIX", "/protected-media/") + quote(name)
+        else:
+            response["X-Sendfile"] = storage.path(name)
+        return response
+
+    try:
+        byte_range = parse_range(request.headers.get("Range"), size) if _range_applies(request, etag, last_modified) else None
+    except ValueError:
+        return HttpResponse(status=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+    start, end = byte_range or (0, size - 1)
+    length = end - start + 1 if size else 0
+
+    if request.method == "HEAD":
+        response = HttpResponse(content_type=content_type, headers=headers)
+    else:
+        response = FileResponse(
+            _Slice(storage.open(name, "rb"), start, length), content_type=content_type,
+            filename=os.path.basename(name), headers=headers,
+        )
+        response.block_size = CHUNK_SIZE
+    response["Content-Length"] = length
+    if byte_range:
+        response.status_code = 206
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return response
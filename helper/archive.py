@@ -0,0 +1,231 @@
+"""Архив: закрытые приёмы, оплаты и записи медкарты старше горизонта переносятся из рабочих таблиц в ArchivedRecord.
+
+Рабочие таблицы и их индексы держат только живую историю. Единица переноса — закрытый приём вместе с его
+оплатами и записью медкарты; оплаты и записи без приёма переносятся сами по себе. Приём остаётся в рабочих
+таблицах, пока он не закрыт или пока его оплата или запись моложе горизонта.
+
+Граница Clinic.archived_before сдвигается до переноса: сводки DailyMetrics / DiagnosisMetrics за дни до неё
+заморожены (helper/rollups.py) — пересчитывать их из рабочих таблиц уже не из чего. Замораживаются и дни,
+строки которых остались в рабочих таблицах (открытый приём, приём с оплатой моложе горизонта): сводка таких
+дней остаётся такой, какой была на момент сдвига, позднее закрытие приёма или возврат её не меняют —
+archive_records показывает, сколько таких строк осталось (remaining). Чтения (история и оплаты пациента,
+finance_report, выгрузки) обращаются к архиву, только если у клиники есть граница и запрос её пересекает.
+"""
+import datetime
+import json
+import zlib
+from collections import Counter
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from core.models import Appointment, ArchivedRecord, Clinic, MedicalRecord, PatientFile, Payment
+from helper import cache, rollups
+from helper.listing import after
+
+Kind = ArchivedRecord.Kind
+
+CLOSED_STATUSES = (Appointment.Status.COMPLETED, Appointment.Status.CANCELLED, Appointment.Status.NO_SHOW)
+
+
+def horizon(days=None, today=None):
+    """Граница переноса — начало дня days дней назад (целые дни: сводки замораживаются по дням)"""
+    days = settings.API_ARCHIVE_AFTER_DAYS if days is None else days
+    day = (today or timezone.localdate()) - datetime.timedelta(days=days)
+    return rollups.day_range(day, day)[0]
+
+
+def pack(data):
+    return zlib.compress(json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False, separators=(",", ":")).encode())
+
+
+def unpack(payload):
+    return json.loads(zlib.decompress(bytes(payload)))
+
+
+def _fields(instance):
+    return {field.attname: getattr(instance, field.attname) for field in instance._meta.concrete_fields}
+
+
+def _name(instance, field):
+    return getattr(instance, field) if instance is not None else None
+
+
+def _appointment_columns(appointment):
+    if appointment is None:
+        return {}
+    return {
+        "branch_id": appointment.branch_id,
+        "doctor_id": appointment.doctor_id,
+        "category_id": appointment.service.category_id if appointment.service else None,
+    }
+
+
+def _names(appointment):
+    """Подписи на момент переноса: архив читается без join-ов и переживает удаление справочников"""
+    return {
+        "branch_name": _name(appointment and appointment.branch, "name"),
+        "service_name": _name(appointment and appointment.service, "name"),
+        "price_paid": appointment.price_paid if appointment else None,
+    }
+
+
+def _appointment(appointment, clinic_id):
+    return ArchivedRecord(
+        id=appointment.id, kind=Kind.APPOINTMENT, clinic_id=clinic_id, patient_id=appointment.patient_id,
+        occurred_at=appointment.start_time, status=appointment.status, amount=appointment.price_paid,
+        **_appointment_columns(appointment),
+        payload=pack({**_fields(appointment), **_names(appointment), "doctor_name": _name(appointment.doctor, "full_name")}),
+    )
+
+
+def _payment(payment, clinic_id):
+    appointment = payment.appointment
+    return ArchivedRecord(
+        id=payment.id, kind=Kind.PAYMENT, clinic_id=clinic_id, patient_id=payment.patient_id,
+        occurred_at=payment.paid_at, status=payment.status, amount=payment.amount, method=payment.method,
+        **_appointment_columns(appointment),
+        payload=pack({
+            **_fields(payment), "service_name": _name(appointment and appointment.service, "name"),
+            # Колонки выгрузки оплат: приём переносится вместе с оплатой, join-а к нему в архиве нет
+            "appointment_start": appointment.start_time if appointment else None,
+            "branch_name": _name(appointment and appointment.branch, "name"),
+        }),
+    )
+
+
+def _record(record, clinic_id, file_ids):
+    appointment = record.appointment
+    return ArchivedRecord(
+        id=record.id, kind=Kind.MEDICAL_RECORD, clinic_id=clinic_id, patient_id=record.patient_id,
+        occurred_at=record.visit_date, amount=appointment.price_paid if appointment else None, code=record.diagnosis_icd10,
+        **{**_appointment_columns(appointment), "doctor_id": record.doctor_id},
+        payload=pack({
+            **_fields(record), **_names(appointment),
+            "doctor_name": _name(record.doctor, "full_name"),
+            # Файлы пациента остаются в рабочей таблице, связь с записью (SET_NULL при удалении) — здесь
+            "file_ids": file_ids.get(record.id, []),
+        }),
+    )
+
+
+def _move(clinic_id, appointment_ids=(), payment_ids=(), record_ids=()):
+    """Одна транзакция: строки → ArchivedRecord, затем удаление из рабочих таблиц"""
+    appointments = list(Appointment.objects.filter(pk__in=appointment_ids).select_related("branch", "doctor", "service"))
+    payments = list(
+        Payment.objects.filter(pk__in=payment_ids) | Payment.objects.filter(appointment_id__in=appointment_ids)
+    )
+    records = list(
+        (MedicalRecord.objects.filter(pk__in=record_ids) | MedicalRecord.objects.filter(appointment_id__in=appointment_ids))
+        .select_related("doctor", "appointment__branch", "appointment__service")
+    )
+    by_appointment = {appointment.id: appointment for appointment in appointments}
+    for payment in payments:
+        # Свой приём уже загружен (с филиалом и услугой) — не запрашиваем заново
+        payment.appointment = by_appointment.get(payment.appointment_id)
+    file_ids = {}
+    for record_id, file_id in PatientFile.objects.filter(medical_record__in=records).values_list("medical_record_id", "id"):
+        file_ids.setdefault(record_id, []).append(str(file_id))
+
+    archived = (
+        [_appointment(appointment, clinic_id) for appointment in appointments]
+        + [_payment(payment, clinic_id) for payment in payments]
+        + [_record(record, clinic_id, file_ids) for record in records]
+    )
+    ArchivedRecord.objects.bulk_create(archived)
+    MedicalRecord.objects.filter(pk__in=[record.id for record in records]).delete()
+    Payment.objects.filter(pk__in=[payment.id for payment in payments]).delete()
+    Appointment.objects.filter(pk__in=list(by_appointment)).delete()
+    return Counter(record.kind for record in archived)
+
+
+def candidates(clinic, before):
+    """QuerySet-ы строк клиники к переносу: (приёмы, оплаты без приёма, записи без приёма)"""
+    young_payment = Payment.objects.filter(appointment=OuterRef("pk"), paid_at__gte=before)
+    young_record = MedicalRecord.objects.filter(appointment=OuterRef("pk"), visit_date__gte=before)
+    appointments = Appointment.objects.filter(
+        clinic=clinic, start_time__lt=before, status__in=CLOSED_STATUSES,
+    ).exclude(Exists(young_payment)).exclude(Exists(young_record))
+    payments = Payment.objects.filter(clinic=clinic, paid_at__lt=before, appointment__isnull=True)
+    records = MedicalRecord.objects.filter(patient__clinic=clinic, visit_date__lt=before, appointment__isnull=True)
+    return appointments, payments, records
+
+
+def remaining(clinic, before):
+    """Строки клиники до before, оставшиеся в рабочих таблицах: (приёмов, оплат) — их дни заморожены как есть"""
+    return (
+        Appointment.objects.filter(clinic=clinic, start_time__lt=before).count(),
+        Payment.objects.filter(clinic=clinic, paid_at__lt=before).count(),
+    )
+
+
+def archive_clinic(clinic, before, batch_size=None):
+    """Перенос строк клиники старше before пачками по batch_size (каждая — своя транзакция)"""
+    batch_size = batch_size or settings.API_ARCHIVE_BATCH_SIZE
+    if clinic.archived_before is None or clinic.archived_before < before:
+        # Граница — до переноса: пересчёт сводки посреди переноса дней до неё уже не тронет
+        Clinic.objects.filter(pk=clinic.pk).update(archived_before=before)
+        clinic.archived_before = before
+
+    moved = Counter()
+    for queryset, argument in zip(candidates(clinic, before), ("appointment_ids", "payment_ids", "record_ids")):
+        while True:
+            ids = list(queryset.order_by().values_list("pk", flat=True)[:batch_size])
+            if not ids:
+                break
+            with transaction.atomic(), rollups.paused(), cache.paused():
+                moved += _move(clinic.pk, **{argument: ids})
+            for model in (Appointment, Payment, MedicalRecord, PatientFile, ArchivedRecord):
+                cache.bump(model, clinic.pk)
+    return moved
+
+
+# --- Чтение ---
+
+def history(patient, desc, cursor, limit):
+    """Записи медкарты пациента из архива в порядке ленты (дата, затем id), после cursor = [дата, id]"""
+    records = ArchivedRecord.objects.filter(patient=patient, kind=Kind.MEDICAL_RECORD)
+    keys = [("date", "occurred_at", desc), ("pk", "pk", False)]
+    if cursor:
+        records = records.filter(after(keys, cursor))
+    order = "-occurred_at" if desc else "occurred_at"
+    return list(records.order_by(order, "pk")[:limit])
+
+
+def record(record_id):
+    return ArchivedRecord.objects.filter(pk=record_id, kind=Kind.MEDICAL_RECORD).select_related("patient").first()
+
+
+def payments(patient):
+    return ArchivedRecord.objects.filter(patient=patient, kind=Kind.PAYMENT).order_by("-occurred_at")
+
+
+def _period(clinic, kind, start, end):
+    """Строки клиники из архива за [start, end) или None, если период архив не задевает"""
+    if clinic.archived_before is None or start >= clinic.archived_before:
+        return None
+    return ArchivedRecord.objects.filter(clinic=clinic, kind=kind, occurred_at__gte=start, occurred_at__lt=end)
+
+
+def successful_payments(clinic, start, end):
+    period = _period(clinic, Kind.PAYMENT, start, end)
+    return None if period is None else period.filter(status="success")
+
+
+def records(clinic, start, end):
+    """Записи медкарты с диагнозом из архива за [start, end) или None"""
+    period = _period(clinic, Kind.MEDICAL_RECORD, start, end)
+    return None if period is None else period.exclude(code="")
+
+
+def exported(clinics, kind, date_from=None):
+    """Архивные строки клиник (QuerySet клиник) для выгрузки с date_from или None, если выгрузку архив не задевает"""
+    touched = clinics.filter(archived_before__isnull=False)
+    if date_from is not None:
+        touched = touched.filter(archived_before__gt=rollups.day_range(date_from, date_from)[0])
+    if not touched.exists():
+        return None
+    return ArchivedRecord.objects.filter(clinic__in=touched, kind=kind)
@@ -1,4 +1,5 @@
 import random
+from functools import wraps
 from django.conf import settings
 from django.core.mail import send_mail
 from django.utils import timezone as dj_timezone
@@ -29,4 +30,18 @@ def send_password_reset_email(user: CustomUser, otp_code: str):
         from_email=settings.DEFAULT_FROM_EMAIL,
         recipient_list=[user.email],
         fail_silently=False,
-    )
\ No newline at end of file
+    )
+
+
+def token_user_per_request(func):
+    """Пользователь по токену запоминается на объекте запроса: повторные проверки
+    в том же запросе (вызовы batch) не декодируют токен и не ходят в БД"""
+    @wraps(func)
+    def wrapper(request):
+        header = request.headers.get("Authorization", "")
+        cached = getattr(request, "_token_user", None)
+        if cached is None or cached[0] != header:
+            cached = (header, func(request))
+            request._token_user = cached
+        return cached[1]
+    return wrapper
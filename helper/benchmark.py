@@ -0,0 +1,43 @@
+import math
+import subprocess
+from pathlib import Path
+
+
+def percentile(sorted_values, p):
+    """Перцентиль методом nearest-rank по уже отсортированному списку"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies, errors, wall, queries=None):
+    """Сводка по серии вызовов: латентности в секундах → миллисекунды"""
+    values = sorted(latencies)
+    count = len(values)
+
+    def ms(value):
+        return round(value * 1000, 3) if value is not None else None
+
+    return {
+        "requests": count,
+        "errors": errors,
+        "p50_ms": ms(percentile(values, 50)),
+        "p95_ms": ms(percentile(values, 95)),
+        "p99_ms": ms(percentile(values, 99)),
+        "mean_ms": ms(sum(values) / count) if count else None,
+        "max_ms": ms(values[-1]) if count else None,
+        "throughput_rps": round(count / wall, 2) if wall else None,
+        "queries_per_request": round(sum(queries) / len(queries), 2) if queries else None,
+    }
+
+
+def git_revision():
+    """Текущий коммит (для сравнения прогонов между коммитами)"""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).resolve().parent.parent,
+            stderr=subprocess.DEVNULL, text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
@@ -0,0 +1,182 @@
+import contextlib
+import contextvars
+import hashlib
+import json
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+from core.models import Clinic, ClinicDirectorProfile, CustomUser
+
+# Генерация «все клиники»: растёт при любом изменении модели (ключи сисадмина, ответы по всем клиникам)
+ALL = "*"
+# Генерация «без клиники»: изменение, которое не отнести к клинике (тарифы, профиль без клиники) —
+# входит в ключ каждого пользователя
+UNSCOPED = "-"
+
+_tracked = set()
+
+
+def _cache():
+    return caches[getattr(settings, "API_CACHE_ALIAS", "default")]
+
+
+def _generation_key(model, clinic_id):
+    return f"api:gen:{model._meta.label_lower}:{clinic_id}"
+
+
+def generations(models, clinic_ids):
+    """Текущие счётчики поколений (модель × клиника) — одним get_many.
+
+    Пропавший из кэша счётчик начинается со времени, а не с нуля: старые ответы с ним не совпадут.
+    """
+    cache = _cache()
+    keys = [_generation_key(model, clinic_id) for model in models for clinic_id in clinic_ids]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            cache.add(key, time.time_ns())
+            found[key] = cache.get(key)
+    return [found[key] for key in keys]
+
+
+def bump(model, clinic_id=None):
+    """Инвалидация: новое поколение модели для клиники (без клиники — для всех) и для «всех клиник»"""
+    cache = _cache()
+    for key in (_generation_key(model, clinic_id or UNSCOPED), _generation_key(model, ALL)):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), None)
+
+
+def _instance_clinic(instance):
+    if isinstance(instance, Clinic):
+        return instance.pk
+    if hasattr(instance, "clinic_id"):
+        return instance.clinic_id
+    # Медкарта, файлы пациента — клиника пациента
+    if getattr(instance, "patient_id", None):
+        try:
+            return instance.patient.clinic_id
+        except ObjectDoesNotExist:
+            return None
+    # Профили сотрудников — клиника пользователя
+    if getattr(instance, "user_id", None):
+        try:
+            return instance.user.clinic_id
+        except ObjectDoesNotExist:
+            return None
+    return None
+
+
+# Массовые операции (перенос в архив) сдвигают поколения сами — один раз на пачку, а не на каждую строку
+_paused = contextvars.ContextVar("api_cache_paused", default=False)
+
+
+@contextlib.contextmanager
+def paused():
+    token = _paused.set(True)
+    try:
+        yield
+    finally:
+        _paused.reset(token)
+
+
+def _on_change(sender, instance, **kwargs):
+    if _paused.get():
+        return
+    clinic_id = _instance_clinic(instance)
+    bump(sender, clinic_id)
+    # Повторно после коммита: конкурентное чтение могло закэшировать данные до коммита
+    transaction.on_commit(lambda: bump(sender, clinic_id))
+
+
+def track(model):
+    """post_save / post_delete / m2m_changed модели сдвигают её поколение (подключается один раз)"""
+    if model in _tracked:
+        return
+    _tracked.add(model)
+    uid = f"api-cache:{model._meta.label_lower}"
+    post_save.connect(_on_change, sender=model, dispatch_uid=uid)
+    post_delete.connect(_on_change, sender=model, dispatch_uid=uid)
+    for field in model._meta.many_to_many:
+        through = field.remote_field.through
+
+        def on_m2m(sender, instance, action, model=model, **kwargs):
+            if action.startswith("post_"):
+                _on_change(model, instance)
+
+        m2m_changed.connect(on_m2m, sender=through, dispatch_uid=f"{uid}:{field.name}", weak=False)
+
+
+def user_clinics(user):
+    """Область данных пользователя: ALL для сисадмина, иначе id клиник (директорские — из кэша)"""
+    if user.role == CustomUser.Roles.SYSTEM_ADMIN:
+        return [ALL]
+    clinic_ids = {str(user.clinic_id)} if user.clinic_id else set()
+    if user.role == CustomUser.Roles.CLINIC_DIRECTOR:
+        cache = _cache()
+        generation, = generations([ClinicDirectorProfile], [ALL])
+        key = f"api:clinics:{user.pk}:{generation}"
+        linked = cache.get(key)
+        if linked is None:
+            linked = [str(pk) for pk in ClinicDirectorProfile.objects.filter(user=user).values_list("clinic_id", flat=True)]
+            cache.set(key, linked, getattr(settings, "API_CACHE_TIMEOUT", 300))
+        clinic_ids.update(linked)
+    return sorted(clinic_ids)
+
+
+def params_key(params):
+    """Параметры → хэш: порядок ключей не важен"""
+    normalized = json.dumps(params, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha1(normalized.encode()).hexdigest()
+
+
+def cached_method(*models, timeout=None, all_clinics=False):
+    """Кэш ответа метода чтения.
+
+    Ключ: метод, роль и клиники пользователя, params и поколения models по этим клиникам и «без клиники».
+    all_clinics=True — ответ считается по данным всех клиник (list_plans): поколения ALL для любого пользователя.
+    Сохраняются только ответы 200; аутентификация выполняется всегда, до обращения к кэшу.
+    Изменения через queryset.update() / bulk_create сигналов не шлют — после них вызывайте bump().
+
+        @cached_method(Service, ServiceCategory)
+        def service_list(request, params): ...
+    """
+    for model in (*models, ClinicDirectorProfile):
+        track(model)
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(request, params):
+            # v1.services сам импортирует helper — импорт при вызове
+            from v1.services.auth import get_user_from_token
+
+            user = get_user_from_token(request)
+            if not user or getattr(settings, "API_CACHE_TIMEOUT", 300) == 0:
+                return func(request, params)
+
+            clinic_ids = user_clinics(user)
+            scope = [func.__module__, func.__name__, user.role, ",".join(clinic_ids), params_key(params)]
+            scopes = [ALL] if all_clinics or clinic_ids == [ALL] else [*clinic_ids, UNSCOPED]
+            scope += [str(generation) for generation in generations(models, scopes)]
+            key = "api:resp:" + hashlib.sha1(":".join(scope).encode()).hexdigest()
+
+            cache = _cache()
+            response = cache.get(key)
+            if response is not None:
+                return response
+            response = func(request, params)
+            if isinstance(response, dict) and response.get("status") == 200:
+                cache.set(key, response, timeout if timeout is not None else getattr(settings, "API_CACHE_TIMEOUT", 300))
+            return response
+
+        return wrapper
+
+    return decorator
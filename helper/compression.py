@@ -0,0 +1,61 @@
+import brotli
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+from django.utils.regex_helper import _lazy_re_compile
+
+re_accepts_br = _lazy_re_compile(r"\bbr\b")
+
+# Уже сжатое содержимое (XLSX/DOCX — zip-архивы, архивы, картинки, видео): повторное сжатие только тратит CPU
+COMPRESSED_TYPES = (
+    "application/zip", "application/gzip", "application/x-7z-compressed", "application/vnd.openxmlformats-officedocument.",
+    "image/jpeg", "image/png", "image/webp", "image/gif", "video/", "audio/",
+)
+
+
+def compress_sequence_br(sequence, quality):
+    """Потоковое brotli-сжатие: каждый кусок отдаётся сразу (flush), как у compress_sequence для gzip"""
+    compressor = brotli.Compressor(quality=quality)
+    for item in sequence:
+        data = compressor.process(item) + compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """Сжатие ответов API (API_COMPRESS_PATHS) больше API_COMPRESS_MIN_BYTES.
+
+    brotli — если клиент его принимает, иначе gzip (GZipMiddleware Django). Уже сжатые типы (COMPRESSED_TYPES)
+    отдаются как есть.
+    """
+
+    def process_response(self, request, response):
+        if not request.path.startswith(tuple(getattr(settings, "API_COMPRESS_PATHS", ["/api/"]))):
+            return response
+        if not response.streaming and len(response.content) < getattr(settings, "API_COMPRESS_MIN_BYTES", 1024):
+            return response
+        if response.has_header("Content-Encoding") or response.get("Content-Type", "").startswith(COMPRESSED_TYPES):
+            return response
+
+        accepts = request.META.get("HTTP_ACCEPT_ENCODING", "")
+        if not re_accepts_br.search(accepts) or (response.streaming and response.is_async):
+            return super().process_response(request, response)
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+        quality = getattr(settings, "API_BROTLI_QUALITY", 5)
+        if response.streaming:
+            response.streaming_content = compress_sequence_br(response.streaming_content, quality)
+            del response.headers["Content-Length"]
+        else:
+            compressed = brotli.compress(response.content, quality=quality)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers["Content-Length"] = str(len(compressed))
+
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response.headers["ETag"] = "W/" + etag
+        response.headers["Content-Encoding"] = "br"
+        return response
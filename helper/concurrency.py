@@ -0,0 +1,121 @@
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connections
+
+from helper import metrics
+
+# Пулы создаются при первом использовании: в каждом процессе-воркере свои
+_pools = {}
+_pools_lock = threading.Lock()
+_local = threading.local()
+
+
+def _pool(name, workers):
+    with _pools_lock:
+        pool = _pools.get(name)
+        if pool is None:
+            pool = _pools[name] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"texelmed-{name}")
+        return pool
+
+
+def parallel_enabled():
+    """Параллельно — только вне транзакций: у потока пула своё соединение, незакоммиченных данных оно не видит"""
+    if getattr(settings, "API_PARALLEL_WORKERS", 0) < 2 or getattr(_local, "in_pool", False):
+        return False
+    return not any(connections[alias].in_atomic_block for alias in connections)
+
+
+def _run_task(func, trackers):
+    _local.in_pool = True
+    try:
+        with metrics.track_queries() as own:
+            return func()
+    finally:
+        for tracker in trackers:
+            tracker.add(own.queries, own.db_time)
+        _local.in_pool = False
+        # Соединение потока пула живёт по CONN_MAX_AGE, как соединение обычного запроса
+        close_old_connections()
+
+
+def run_parallel(*funcs):
+    """Вызывает независимые функции (обычно — запросы к БД) одновременно в ограниченном пуле потоков.
+
+    Возвращает результаты в порядке аргументов, исключение первой упавшей функции пробрасывается.
+    Внутри транзакции, при API_PARALLEL_WORKERS < 2 и из потока самого пула — последовательно.
+    Функции должны сами материализовать результат (list(), aggregate()), ленивый QuerySet
+    выполнится уже в вызывающем потоке.
+    """
+    if len(funcs) < 2 or not parallel_enabled():
+        return [func() for func in funcs]
+
+    pool = _pool("parallel", settings.API_PARALLEL_WORKERS)
+    trackers = metrics.active_trackers()
+    # Контекст (contextvars: маршрутизация БД и т.п.) — копия вызывающего на каждую задачу
+    futures = [pool.submit(contextvars.copy_context().run, _run_task, func, trackers) for func in funcs]
+    return [future.result() for future in futures]
+
+
+def _run_request(func, args):
+    try:
+        return func(*args)
+    finally:
+        close_old_connections()
+
+
+def run_in_background(func, *args, pool="background", workers=2):
+    """Задача, результат которой запросу не нужен (обработка файлов и т.п.), — в отдельном пуле.
+
+    workers < 1 — выполняется сразу в вызывающем потоке. Очередь живёт в памяти процесса:
+    задачи, не выполненные до его остановки, теряются — их доделывают команды обслуживания.
+    """
+    if workers < 1:
+        return func(*args)
+    return _pool(pool, workers).submit(_run_request, func, args)
+
+
+async def run_in_threadpool(func, *args):
+    """Синхронный код из async-view: в отдельном ограниченном пуле (API_ASYNC_WORKERS), не блокируя event loop.
+
+    Размер пула ограничивает и число одновременных соединений с БД от ASGI-воркера.
+    """
+    pool = _pool("asgi", getattr(settings, "API_ASYNC_WORKERS", 16))
+    return await sync_to_async(_run_request, thread_sensitive=False, executor=pool)(func, args)
+
+
+def async_streaming(response):
+    """Потоковый ответ для ASGI: sync-итератор тела → async, по куску за раз.
+
+    С sync-итератором Django под ASGI сначала читает всё тело в память (sync_to_async(list)) —
+    экспорт и файл пациента уходили бы клиенту только целиком. Куски читаются в потоке запроса
+    (thread_sensitive): там же, где Django выполнил бы sync-view, с тем же соединением с БД.
+    """
+    if not getattr(response, "streaming", False) or response.is_async:
+        return response
+    chunks = iter(response.streaming_content)
+    read = sync_to_async(next)
+
+    async def stream():
+        while True:
+            chunk = await read(chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+
+    response.streaming_content = stream()
+    return response
+
+
+def async_view(view):
+    """Sync-view для ASGI: выполняется как обычно, потоковое тело отдаётся без чтения в память"""
+
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        return async_streaming(await sync_to_async(view)(request, *args, **kwargs))
+
+    return wrapper
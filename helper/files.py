@@ -0,0 +1,86 @@
+"""Файлы пациентов в хранилище: метаданные при загрузке, адресация по содержимому.
+
+Размер, тип и SHA-256 считаются один раз — потоком по кускам, пока загруженный файл лежит локально
+(Django уже сложил его во временный файл или в память), и хранятся колонками PatientFile: списки
+документов хранилище не трогают. Имя в хранилище выводится из хэша — одинаковое содержимое
+записывается один раз, остальные строки PatientFile ссылаются на тот же объект.
+"""
+import hashlib
+import mimetypes
+import os
+
+# Размер куска при чтении загрузки и записи в хранилище
+CHUNK_SIZE = 64 * 1024
+
+# Сигнатуры форматов: (смещение, байты, content type); объявленному клиентом типу не доверяем
+SIGNATURES = (
+    (0, b"%PDF-", "application/pdf"),
+    (0, b"\x89PNG\r\n\x1a\n", "image/png"),
+    (0, b"\xff\xd8\xff", "image/jpeg"),
+    (0, b"GIF87a", "image/gif"),
+    (0, b"GIF89a", "image/gif"),
+    (0, b"II*\x00", "image/tiff"),
+    (0, b"MM\x00*", "image/tiff"),
+    (128, b"DICM", "application/dicom"),
+    (0, b"PK\x03\x04", "application/zip"),
+)
+DEFAULT_CONTENT_TYPE = "application/octet-stream"
+
+
+def sniff(head, name=""):
+    """Тип содержимого по первым байтам; неизвестная сигнатура — по расширению имени"""
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    for offset, signature, content_type in SIGNATURES:
+        if head[offset:offset + len(signature)] == signature:
+            return content_type
+    guessed, _ = mimetypes.guess_type(name or "")
+    return guessed or DEFAULT_CONTENT_TYPE
+
+
+def digest(content):
+    """(sha256, размер, content type) файла Django одним проходом по кускам"""
+    sha256, size, head = hashlib.sha256(), 0, b""
+    if hasattr(content, "seek"):
+        content.seek(0)
+    for chunk in content.chunks(CHUNK_SIZE):
+        if len(head) < 512:
+            head += chunk[:512 - len(head)]
+        sha256.update(chunk)
+        size += len(chunk)
+    if hasattr(content, "seek"):
+        content.seek(0)
+    return sha256.hexdigest(), size, sniff(head, getattr(content, "name", ""))
+
+
+def content_name(sha256, name, directory="patient_files"):
+    """Имя объекта в хранилище по хэшу: patient_files/ab/abcdef….pdf"""
+    extension = os.path.splitext(name or "")[1].lower()[:10]
+    return f"{directory}/{sha256[:2]}/{sha256}{extension}"
+
+
+def parse_range(header, size):
+    """Один диапазон заголовка Range ("bytes=a-b", "bytes=a-", "bytes=-n") → (начало, конец включительно).
+
+    None — отдать файл целиком (заголовка нет, он некорректен или диапазонов несколько);
+    ValueError — диапазон за концом файла (416).
+    """
+    unit, _, spec = (header or "").partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, dash, last = spec.strip().partition("-")
+    if not dash or not (first or last) or not (first or "0").isdigit() or not (last or "0").isdigit():
+        return None
+    if not first:
+        # Суффикс: последние n байт
+        length = int(last)
+        if length == 0 or size == 0:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size:
+        raise ValueError(header)
+    if end < start:
+        return None
+    return start, end
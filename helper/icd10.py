@@ -0,0 +1,348 @@
+"""Справочник МКБ-10: подсказки диагнозов по коду и словам названия (ru/uz).
+
+Источник — TSV «code, title_ru, title_uz» (ICD10_SOURCE, в репозитории — core/data/icd10.tsv;
+полный справочник подкладывается тем же форматом). Из него один раз собирается бинарный индекс
+(ICD10_INDEX, команда build_icd10_index): отсортированный массив ключей — код без точки и слова
+названий — со ссылками на записи. Индекс открывается через mmap: воркеры на одной машине делят
+одни страницы page cache, справочник в память процесса не загружается, поиск — бинарный поиск
+по префиксу. Индекс собирается при деплое: командой build_icd10_index или после migrate (ensure_built —
+нет файла, другой формат или источник новее). В запросе он не строится: без индекса search() падает
+с IndexUnavailable, а titles() отдаёт пустые подписи — отчёты показывают голые коды.
+"""
+import csv
+import logging
+import mmap
+import os
+import re
+import struct
+import tempfile
+import threading
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+MAGIC = b"ICD3"
+HEADER = struct.Struct("<4sII")
+OFFSET = struct.Struct("<I")
+# Ключ: байты ключа, \0, номер записи и вид ключа
+KEY_TAIL = struct.Struct("<IB")
+
+# Вид ключа — он же первый критерий ранжирования; ключи в индексе лежат по виду, затем по ключу
+CODE, FIRST_WORD, WORD = 0, 1, 2
+
+# Больше ключей одного префикса одного вида не перебираем: короткий префикс не должен читать весь
+# индекс. Лимит на каждый вид отдельно — слова в середине названий не вытесняют коды и начала названий
+MAX_CANDIDATES = 2000
+
+_WORD = re.compile(r"[\w']+")
+_CODE = re.compile(r"^[a-z]\d")
+_NORMALIZE = str.maketrans({"‘": "'", "’": "'", "ʻ": "'", "ʼ": "'", "`": "'", "ё": "е"})
+
+# Классы МКБ-10: (номер, первая рубрика, последняя рубрика, название)
+CHAPTERS = (
+    ("I", "A00", "B99", "Некоторые инфекционные и паразитарные болезни"),
+    ("II", "C00", "D48", "Новообразования"),
+    ("III", "D50", "D89", "Болезни крови, кроветворных органов и отдельные нарушения, вовлекающие иммунный механизм"),
+    ("IV", "E00", "E90", "Болезни эндокринной системы, расстройства питания и нарушения обмена веществ"),
+    ("V", "F00", "F99", "Психические расстройства и расстройства поведения"),
+    ("VI", "G00", "G99", "Болезни нервной системы"),
+    ("VII", "H00", "H59", "Болезни глаза и его придаточного аппарата"),
+    ("VIII", "H60", "H95", "Болезни уха и сосцевидного отростка"),
+    ("IX", "I00", "I99", "Болезни системы кровообращения"),
+    ("X", "J00", "J99", "Болезни органов дыхания"),
+    ("XI", "K00", "K93", "Болезни органов пищеварения"),
+    ("XII", "L00", "L99", "Болезни кожи и подкожной клетчатки"),
+    ("XIII", "M00", "M99", "Болезни костно-мышечной системы и соединительной ткани"),
+    ("XIV", "N00", "N99", "Болезни мочеполовой системы"),
+    ("XV", "O00", "O99", "Беременность, роды и послеродовой период"),
+    ("XVI", "P00", "P96", "Отдельные состояния, возникающие в перинатальном периоде"),
+    ("XVII", "Q00", "Q99", "Врожденные аномалии (пороки развития), деформации и хромосомные нарушения"),
+    ("XVIII", "R00", "R99", "Симптомы, признаки и отклонения от нормы, не классифицированные в других рубриках"),
+    ("XIX", "S00", "T98", "Травмы, отравления и некоторые другие последствия воздействия внешних причин"),
+    ("XXII", "U00", "U99", "Коды для особых целей"),
+    ("XX", "V01", "Y98", "Внешние причины заболеваемости и смертности"),
+    ("XXI", "Z00", "Z99", "Факторы, влияющие на состояние здоровья и обращения в учреждения здравоохранения"),
+)
+
+_lock = threading.Lock()
+_index = None
+logger = logging.getLogger(__name__)
+
+
+class IndexUnavailable(ImproperlyConfigured):
+    """Нет индекса ICD10_INDEX или он другого формата — нужен build_icd10_index"""
+
+
+def source_path():
+    return Path(getattr(settings, "ICD10_SOURCE", None) or settings.BASE_DIR / "core" / "data" / "icd10.tsv")
+
+
+def index_path():
+    return Path(getattr(settings, "ICD10_INDEX", None) or settings.BASE_DIR / "var" / "icd10.idx")
+
+
+def normalize(text):
+    return text.lower().translate(_NORMALIZE)
+
+
+def words(text):
+    return [word.strip("'") for word in _WORD.findall(normalize(text)) if len(word.strip("'")) > 1]
+
+
+def code_key(code):
+    return normalize(code).replace(".", "").strip()
+
+
+def chapter(code):
+    """Класс МКБ-10 кода («J45.0» → X) или None для кода вне классификации"""
+    category = code_key(code)[:3].upper()
+    if not _CODE.match(category.lower()):
+        return None
+    for item in CHAPTERS:
+        if item[1] <= category <= item[2]:
+            return item
+    return None
+
+
+def read_source(path):
+    """Строки TSV → [(code, title_ru, title_uz)]; заголовок и пустые строки пропускаются"""
+    entries = []
+    with open(path, encoding="utf-8", newline="") as f:
+        for row in csv.reader(f, delimiter="\t"):
+            if not row or not row[0].strip() or row[0].strip().lower() == "code":
+                continue
+            code, title_ru, title_uz = (row + ["", ""])[:3]
+            entries.append((code.strip().upper(), title_ru.strip(), title_uz.strip() or title_ru.strip()))
+    return entries
+
+
+def _search_text(code, title_ru, title_uz):
+    """Слова записи через пробел для проверки остальных токенов запроса: « код первые_слова | прочие»"""
+    titles = [words(title_ru), words(title_uz)]
+    head = [code_key(code), *(title[0] for title in titles if title)]
+    return " " + " ".join(head) + " | " + " ".join(word for title in titles for word in title[1:])
+
+
+def build(source=None, target=None):
+    """Собрать индекс из TSV; файл заменяется атомарно — открытые воркерами копии остаются целыми.
+
+    Возвращает число записей.
+    """
+    source, target = Path(source or source_path()), Path(target or index_path())
+    entries = sorted(read_source(source))
+
+    keys = set()
+    for number, (code, title_ru, title_uz) in enumerate(entries):
+        keys.add((code_key(code).encode(), number, CODE))
+        for title in (title_ru, title_uz):
+            for position, word in enumerate(words(title)):
+                keys.add((word.encode(), number, FIRST_WORD if position == 0 else WORD))
+    # На одно слово записи — лучший вид ключа
+    best = {}
+    for key, number, kind in keys:
+        best[(key, number)] = min(kind, best.get((key, number), kind))
+    keys = sorted((key, number, kind) for (key, number), kind in best.items())
+    keys.sort(key=lambda item: item[2])
+
+    key_blob, key_offsets = bytearray(), []
+    for key, number, kind in keys:
+        key_offsets.append(len(key_blob))
+        key_blob += key + b"\0" + KEY_TAIL.pack(number, kind)
+    entry_blob, entry_offsets = bytearray(), []
+    for entry in entries:
+        entry_offsets.append(len(entry_blob))
+        entry_blob += "\t".join((*entry, _search_text(*entry))).encode()
+    entry_offsets.append(len(entry_blob))
+
+    keys_start = HEADER.size + OFFSET.size * (len(key_offsets) + len(entry_offsets))
+    entries_start = keys_start + len(key_blob)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    fd, temporary = tempfile.mkstemp(dir=target.parent, prefix=target.name, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(HEADER.pack(MAGIC, len(key_offsets), len(entries)))
+            f.write(b"".join(OFFSET.pack(keys_start + offset) for offset in key_offsets))
+            f.write(b"".join(OFFSET.pack(entries_start + offset) for offset in entry_offsets))
+            f.write(key_blob)
+            f.write(entry_blob)
+        os.replace(temporary, target)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+    return len(entries)
+
+
+class Index:
+    """Открытый через mmap индекс: только чтение, потокобезопасен"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            self.stat = os.fstat(f.fileno())
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.key_count, self.entry_count = HEADER.unpack_from(self.data)
+        if magic != MAGIC:
+            raise IndexUnavailable(f"{self.path}: не индекс МКБ-10 этой версии, пересоберите: manage.py build_icd10_index")
+        self.key_table = HEADER.size
+        self.entry_table = self.key_table + OFFSET.size * self.key_count
+
+    def __len__(self):
+        return self.entry_count
+
+    def key(self, i):
+        start, = OFFSET.unpack_from(self.data, self.key_table + OFFSET.size * i)
+        end = self.data.find(b"\0", start)
+        number, kind = KEY_TAIL.unpack_from(self.data, end + 1)
+        return self.data[start:end], number, kind
+
+    def entry(self, number):
+        """(code, title_ru, title_uz, слова для поиска)"""
+        start, end = struct.unpack_from("<II", self.data, self.entry_table + OFFSET.size * number)
+        return self.data[start:end].decode().split("\t")
+
+    def lower_bound(self, kind, prefix):
+        lo, hi = 0, self.key_count
+        while lo < hi:
+            middle = (lo + hi) // 2
+            key, _, key_kind = self.key(middle)
+            if (key_kind, key) < (kind, prefix):
+                lo = middle + 1
+            else:
+                hi = middle
+        return lo
+
+    def prefix(self, prefix, kind):
+        """Ключи вида kind с префиксом по порядку: (ключ, номер записи), не больше MAX_CANDIDATES.
+
+        Точные совпадения идут первыми. Ключи лежат в файле подряд в порядке сортировки —
+        после бинарного поиска читаем их потоком.
+        """
+        prefix = prefix.encode()
+        lo = self.lower_bound(kind, prefix)
+        # 0xff в UTF-8 не встречается: всё с префиксом меньше prefix + 0xff
+        count = min(self.lower_bound(kind, prefix + b"\xff") - lo, MAX_CANDIDATES)
+        if count <= 0:
+            return
+        data, tail = self.data, KEY_TAIL.size
+        position, = OFFSET.unpack_from(data, self.key_table + OFFSET.size * lo)
+        for _ in range(count):
+            end = data.find(b"\0", position)
+            number, _ = KEY_TAIL.unpack_from(data, end + 1)
+            yield data[position:end], number
+            position = end + 1 + tail
+
+    def stale(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return True
+        return (stat.st_ino, stat.st_mtime_ns) != (self.stat.st_ino, self.stat.st_mtime_ns)
+
+
+def outdated(source=None, target=None):
+    """Индекс нужно собрать: файла нет, он другого формата или источник TSV новее него"""
+    source, target = Path(source or source_path()), Path(target or index_path())
+    try:
+        with open(target, "rb") as f:
+            magic = f.read(len(MAGIC))
+        built = target.stat().st_mtime
+    except FileNotFoundError:
+        return True
+    return magic != MAGIC or (source.exists() and source.stat().st_mtime > built)
+
+
+def ensure_built(**kwargs):
+    """Собрать индекс, если он устарел (post_migrate: релиз обычно запускает migrate). Число записей или None"""
+    if not outdated():
+        return None
+    count = build()
+    logger.info("МКБ-10: индекс %s собран, %s кодов", index_path(), count)
+    return count
+
+
+def index():
+    """Индекс процесса: открывается один раз, заново — если файл пересобран.
+
+    В запросе индекс не строится: нет файла или он другого формата — IndexUnavailable.
+    Источник новее индекса здесь не проверяется — это дело деплоя (ensure_built, build_icd10_index).
+    """
+    global _index
+    current = _index
+    if current is not None and current.path == index_path() and not current.stale():
+        return current
+    with _lock:
+        if _index is None or _index.path != index_path() or _index.stale():
+            path = index_path()
+            if not path.exists():
+                raise IndexUnavailable(f"Нет индекса МКБ-10 {path}: соберите его командой manage.py build_icd10_index")
+            _index = Index(path)
+        return _index
+
+
+def search(query, limit=10, lang="ru"):
+    """Подсказки по началу кода («J45», «j450») или слов названия («бронх остр»), лучшие первыми.
+
+    Ранг: код, затем слово в начале названия, затем в середине; точное слово — выше префикса;
+    при равенстве — раньше код (записи в индексе отсортированы по коду).
+    """
+    tokens = words(query)
+    if not tokens or limit < 1:
+        return []
+    idx = index()
+
+    ranked, rest = {}, []
+    code = code_key(query)
+    if len(tokens) == 1 and _CODE.match(code):
+        for key, number in idx.prefix(code, CODE):
+            ranked[number] = (CODE, 0 if key == code.encode() else 1)
+    if not ranked:
+        # Перебираем самый длинный токен — у него меньше ключей; остальные проверяются по записи
+        tokens.sort(key=len, reverse=True)
+        first, rest = tokens[0], tokens[1:]
+        for kind in (FIRST_WORD, WORD):
+            for key, number in idx.prefix(first, kind):
+                rank = (kind, 0 if key == first.encode() else 1)
+                ranked[number] = min(rank, ranked.get(number, rank))
+
+    entries = {}
+    if rest:
+        # Остальные токены — по словам записи; токен в начале названия поднимает запись
+        rest = [" " + token for token in rest]
+        for number, rank in list(ranked.items()):
+            entries[number] = entry = idx.entry(number)
+            text = entry[3]
+            if not all(token in text for token in rest):
+                del ranked[number]
+            elif any(token in text.partition(" |")[0] for token in rest):
+                ranked[number] = min(rank, (FIRST_WORD, 1))
+
+    results = []
+    for number in sorted(ranked, key=lambda number: (*ranked[number], number))[:limit]:
+        code, title_ru, title_uz, _ = entries.get(number) or idx.entry(number)
+        results.append({"code": code, "title": title_uz if lang == "uz" else title_ru})
+    return results
+
+
+def titles(codes, lang="ru"):
+    """{код: название} для кодов, найденных в справочнике (для подписей отчётов).
+
+    Без индекса — {}: подсчёту отчёта справочник не нужен, подписи остаются голыми кодами.
+    """
+    try:
+        idx = index()
+    except IndexUnavailable:
+        logger.warning("Справочник МКБ-10 недоступен — подписи диагнозов без названий", exc_info=True)
+        return {}
+    found = {}
+    for code in codes:
+        key = code_key(code)
+        if not key:
+            continue
+        # Точное совпадение, если есть, идёт первым
+        for candidate, number in idx.prefix(key, CODE):
+            if candidate == key.encode():
+                _, title_ru, title_uz, _ = idx.entry(number)
+                found[code] = title_uz if lang == "uz" else title_ru
+            break
+    return found
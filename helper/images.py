@@ -0,0 +1,199 @@
+"""Уменьшенные копии изображений: WebP-миниатюра для списков и превью для просмотра.
+
+Исходники — снимки пациентов (рентген, УЗИ), фото пользователей и логотипы клиник. Копии
+строятся после коммита в фоновом пуле (API_IMAGE_WORKERS) и лежат в хранилище под именем из
+SHA-256 содержимого: одинаковые файлы обрабатываются один раз, готовая копия повторно не пишется.
+Признак готовности хранится в строке (photo_sha256 / logo_sha256 / PatientFile.has_preview),
+поэтому списки строят URL копий без обращений к хранилищу; пока копий нет — отдаётся оригинал.
+Копии, потерянные при остановке воркера, доделывает команда generate_image_derivatives.
+"""
+import io
+import logging
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models.signals import post_init, post_save
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from core.models import Clinic, CustomUser, PatientFile
+from helper.cache import bump
+from helper.concurrency import run_in_background
+from helper.files import digest
+
+logger = logging.getLogger(__name__)
+
+# Вид копии → (наибольшая сторона в пикселях, качество WebP); превью строится первым, миниатюра — из него
+DERIVATIVES = {"preview": (1600, 82), "thumb": (320, 75)}
+
+# Модель → (поле изображения, поле хэша готовых копий)
+SOURCES = {
+    CustomUser: ("photo", "photo_sha256"),
+    Clinic: ("logo", "logo_sha256"),
+}
+# Файлы пациентов: копии только для снимков; хэш уже есть в PatientFile.sha256
+PATIENT_IMAGE_TYPES = (PatientFile.FileType.XRAY, PatientFile.FileType.ULTRASOUND)
+
+# Защита от «бомб»: изображение больше этого числа пикселей не декодируется
+MAX_PIXELS = 200_000_000
+
+
+def derivative_name(sha256, kind):
+    """Имя копии в хранилище: derivatives/ab/abcdef…_thumb.webp"""
+    return f"derivatives/{sha256[:2]}/{sha256}_{kind}.webp"
+
+
+def url(file, sha256, kind="thumb"):
+    """URL копии; копий ещё нет — URL оригинала, нет файла — None"""
+    if not file:
+        return None
+    if not sha256:
+        return file.url
+    return file.storage.url(derivative_name(sha256, kind))
+
+
+def _prepare(image):
+    """Поворот по EXIF и режим, который умеет WebP: 16-битные снимки растягиваются в 8 бит"""
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ("I;16", "I;16B", "I;16L", "I", "F"):
+        image = image.convert("I") if image.mode.startswith("I;16") else image
+        low, high = image.getextrema()
+        scale = 255 / (high - low) if high > low else 0
+        image = image.point(lambda value: (value - low) * scale).convert("L")
+    elif image.mode == "P":
+        image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+    elif image.mode not in ("RGB", "RGBA", "L", "LA"):
+        image = image.convert("RGB")
+    return image
+
+
+def render(content, sha256, storage):
+    """Копии одного изображения в хранилище. False — содержимое не изображение (PDF, DICOM…)"""
+    names = {kind: derivative_name(sha256, kind) for kind in DERIVATIVES}
+    missing = [kind for kind in DERIVATIVES if not storage.exists(names[kind])]
+    if not missing:
+        return True
+
+    content.seek(0)
+    try:
+        image = Image.open(content)
+        if image.width * image.height > MAX_PIXELS:
+            return False
+        # JPEG декодируется сразу в уменьшенном масштабе (DCT), а не в полном размере
+        image.draft("RGB", (DERIVATIVES["preview"][0],) * 2)
+        image = _prepare(image)
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+        return False
+
+    for kind, (side, quality) in DERIVATIVES.items():
+        image.thumbnail((side, side), Image.Resampling.LANCZOS)
+        if kind not in missing:
+            continue
+        buffer = io.BytesIO()
+        image.save(buffer, "WEBP", quality=quality, method=4)
+        # Одинаковые имена у одинакового содержимого: параллельная задача могла успеть раньше
+        if not storage.exists(names[kind]):
+            storage.save(names[kind], ContentFile(buffer.getvalue()))
+    return True
+
+
+def _generate_patient_file(pk):
+    document = PatientFile.objects.filter(pk=pk).select_related("patient").only(
+        "id", "file", "file_type", "sha256", "patient__clinic_id",
+    ).first()
+    if not document or not document.file or not document.sha256 or document.file_type not in PATIENT_IMAGE_TYPES:
+        return False
+    with document.file.open("rb") as content:
+        if not render(content, document.sha256, document.file.storage):
+            return False
+    # Файл могли заменить, пока строились копии
+    updated = PatientFile.objects.filter(pk=pk, sha256=document.sha256).update(has_preview=True)
+    if updated:
+        bump(PatientFile, document.patient.clinic_id)
+    return bool(updated)
+
+
+def _generate_source(model, pk):
+    field, hash_field = SOURCES[model]
+    instance = model.objects.filter(pk=pk).only("pk", field, *(("clinic_id",) if model is CustomUser else ())).first()
+    file = getattr(instance, field, None)
+    if not file:
+        return False
+    with file.open("rb") as content:
+        sha256, _, _ = digest(content)
+        if not render(content, sha256, file.storage):
+            return False
+    updated = model.objects.filter(pk=pk, **{field: file.name}).update(**{hash_field: sha256})
+    if updated:
+        bump(model, instance.pk if model is Clinic else instance.clinic_id)
+    return bool(updated)
+
+
+def generate(model, pk):
+    """Копии изображения строки (в фоне). True — копии готовы и отмечены в строке"""
+    try:
+        if model is PatientFile:
+            return _generate_patient_file(pk)
+        return _generate_source(model, pk)
+    except Exception:
+        # Битый или пропавший файл не должен ронять пул; строка остаётся с оригиналом
+        logger.exception("Копии изображения %s %s не построены", model._meta.label, pk)
+        return False
+
+
+def schedule(model, pk):
+    """После коммита — в фоновый пул: транзакция запроса изображение не ждёт"""
+    transaction.on_commit(lambda: run_in_background(
+        generate, model, pk, pool="images", workers=getattr(settings, "API_IMAGE_WORKERS", 2),
+    ))
+
+
+def _field(sender):
+    return SOURCES[sender][0] if sender in SOURCES else "file"
+
+
+def _remember(sender, instance, **kwargs):
+    # Отложенное (only/defer) поле не читаем — это был бы запрос на каждый объект
+    field = _field(sender)
+    value = instance.__dict__.get(field)
+    instance._image_original = getattr(value, "name", value)
+
+
+def _on_save(sender, instance, created=False, update_fields=None, **kwargs):
+    field = _field(sender)
+    if field not in instance.__dict__:
+        return
+    name = getattr(instance, field).name or ""
+    changed = name != (getattr(instance, "_image_original", None) or "")
+    _remember(sender, instance)
+    if not changed and not created:
+        return
+
+    if sender is PatientFile:
+        if name and instance.file_type in PATIENT_IMAGE_TYPES and not instance.has_preview:
+            schedule(sender, instance.pk)
+        return
+
+    # Копии прежнего изображения новому не подходят — до готовности новых списки отдают оригинал
+    hash_field = SOURCES[sender][1]
+    if instance.__dict__.get(hash_field, True):
+        instance.__dict__[hash_field] = ""
+        sender.objects.filter(pk=instance.pk).update(**{hash_field: ""})
+    if name:
+        schedule(sender, instance.pk)
+
+
+def pending(model):
+    """Строки с изображением, для которых копий ещё нет (для команды generate_image_derivatives)"""
+    if model is PatientFile:
+        return PatientFile.objects.filter(file_type__in=PATIENT_IMAGE_TYPES, has_preview=False).exclude(file="")
+    field, hash_field = SOURCES[model]
+    return model.objects.filter(**{hash_field: ""}).exclude(**{f"{field}__isnull": True}).exclude(**{field: ""})
+
+
+def connect():
+    """Подписка на сохранение строк с изображениями (CoreConfig.ready)"""
+    for model in (*SOURCES, PatientFile):
+        uid = f"image-derivatives:{model._meta.label_lower}"
+        post_init.connect(_remember, sender=model, dispatch_uid=uid)
+        post_save.connect(_on_save, sender=model, dispatch_uid=uid)
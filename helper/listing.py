@@ -0,0 +1,248 @@
+import base64
+import binascii
+import datetime
+import json
+import uuid
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
+from django.db.models import F, Q
+
+
+class ListingError(ValueError):
+    """Некорректные page_size / order_by / fields / cursor (→ 400)"""
+
+
+class Field:
+    """Поле элемента списка.
+
+    value — функция объект → значение. only / related / prefetch / annotate —
+    что нужно загрузить для этого поля; поля, не запрошенные в fields=, не грузятся.
+    """
+
+    def __init__(self, value, only=(), related=(), prefetch=(), annotate=None):
+        self.value = value
+        self.only = tuple(only)
+        self.related = tuple(related)
+        self.prefetch = tuple(prefetch)
+        self.annotate = annotate or {}
+
+
+class ListSpec:
+    """Описание списка: поля ответа, допустимые сортировки (имя → путь ORM) и сортировка по умолчанию"""
+
+    def __init__(self, fields, ordering, default_order, required=("id",)):
+        self.fields = fields
+        self.ordering = ordering
+        self.default_order = tuple(default_order)
+        self.required = tuple(required)
+
+
+class Page:
+    def __init__(self, spec, fields, objects, next_cursor, page_size, queryset=None):
+        self.spec = spec
+        self.fields = fields
+        self.objects = objects
+        self.next_cursor = next_cursor
+        self.page_size = page_size
+        # Отфильтрованный список без курсора — для total()
+        self.queryset = queryset
+
+    def __iter__(self):
+        return iter(self.objects)
+
+    def __len__(self):
+        return len(self.objects)
+
+    @property
+    def has_more(self):
+        return self.next_cursor is not None
+
+    def wants(self, *names):
+        """Запрошено ли хотя бы одно из полей (для дорогих вычислений вне запроса)"""
+        return any(name in self.fields for name in names)
+
+    def rows(self):
+        fields = [(name, self.spec.fields[name].value) for name in self.fields]
+        return [{name: value(obj) for name, value in fields} for obj in self.objects]
+
+    def total(self):
+        """Число строк списка с учётом фильтров (не страницы) — один COUNT"""
+        if self.queryset is None:
+            return len(self.objects)
+        return self.queryset.order_by().count()
+
+    def meta(self):
+        return {"next_cursor": self.next_cursor, "has_more": self.has_more, "page_size": self.page_size}
+
+
+def split(value):
+    """Строка через запятую или список → список имён"""
+    if value in (None, ""):
+        return []
+    if isinstance(value, str):
+        value = value.split(",")
+    if not isinstance(value, (list, tuple)):
+        raise ListingError("Ожидается строка через запятую или список")
+    return [str(item).strip() for item in value if str(item).strip()]
+
+
+def get_page_size(params):
+    default = getattr(settings, "API_PAGE_SIZE", 50)
+    maximum = getattr(settings, "API_MAX_PAGE_SIZE", 500)
+    raw = params.get("page_size")
+    try:
+        size = default if raw in (None, "") else int(raw)
+    except (TypeError, ValueError):
+        raise ListingError("page_size должен быть числом")
+    if size < 1:
+        raise ListingError("page_size должен быть больше нуля")
+    return min(size, maximum)
+
+
+def select_fields(spec, params):
+    requested = split(params.get("fields"))
+    unknown = [name for name in requested if name not in spec.fields]
+    if unknown:
+        raise ListingError(f"Неизвестные поля: {', '.join(unknown)}. Доступно: {', '.join(spec.fields)}")
+    wanted = set(requested or spec.fields) | set(spec.required)
+    return [name for name in spec.fields if name in wanted]
+
+
+def resolve_order(spec, params):
+    """[(имя, путь ORM, desc)], в конце всегда pk — чтобы ключ курсора был уникальным"""
+    keys = []
+    for name in split(params.get("order_by")) or spec.default_order:
+        public = name.lstrip("-")
+        if public not in spec.ordering:
+            raise ListingError(f"Недопустимая сортировка: {public}. Доступно: {', '.join(spec.ordering)}")
+        keys.append((name, spec.ordering[public], name.startswith("-")))
+    if not any(path == "pk" for _, path, _ in keys):
+        keys.append(("pk", "pk", False))
+    return keys
+
+
+def _encode_value(value):
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (Decimal, uuid.UUID)):
+        return str(value)
+    raise TypeError(f"{type(value).__name__} нельзя положить в cursor")
+
+
+def dump_cursor(payload):
+    """JSON → непрозрачная строка cursor (значения — даты, Decimal, UUID — в строки)"""
+    raw = json.dumps(payload, ensure_ascii=False, separators=(",", ":"), default=_encode_value).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def load_cursor(cursor):
+    if not isinstance(cursor, str):
+        raise ListingError("Некорректный cursor")
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError):
+        raise ListingError("Некорректный cursor")
+
+
+def encode_cursor(keys, values):
+    return dump_cursor({"o": [name for name, _, _ in keys], "v": list(values)})
+
+
+def decode_cursor(cursor, keys, queryset):
+    payload = load_cursor(cursor)
+    try:
+        names, values = payload["o"], payload["v"]
+    except (TypeError, KeyError):
+        raise ListingError("Некорректный cursor")
+    if names != [name for name, _, _ in keys] or not isinstance(values, list) or len(values) != len(keys):
+        raise ListingError("cursor не соответствует order_by")
+
+    query = queryset.query.chain()
+    decoded = []
+    for (_, path, _), value in zip(keys, values):
+        if value is None:
+            decoded.append(None)
+            continue
+        try:
+            decoded.append(query.resolve_ref(path).output_field.to_python(value))
+        except (ValidationError, TypeError, ValueError):
+            raise ListingError("Некорректный cursor")
+    return decoded
+
+
+def after(keys, values):
+    """Условие «строго после» для keyset-пагинации; NULL всегда в конце (как в order_by)"""
+    condition = None
+    for (_, path, desc), value in reversed(list(zip(keys, values))):
+        is_null = Q(**{f"{path}__isnull": True})
+        if value is None:
+            step = (is_null & condition) if condition is not None else Q(pk__in=[])
+        else:
+            beyond = Q(**{f"{path}__lt" if desc else f"{path}__gt": value})
+            if path != "pk":
+                beyond |= is_null
+            step = (beyond | (Q(**{path: value}) & condition)) if condition is not None else beyond
+        condition = step
+    return condition
+
+
+def _value_at(obj, path):
+    for part in path.split("__"):
+        if obj is None:
+            return None
+        try:
+            obj = getattr(obj, part)
+        except ObjectDoesNotExist:
+            return None
+    return obj
+
+
+def paginate(queryset, params, spec):
+    """Страница списка: fields= → .only()/select_related, order_by из белого списка, cursor + page_size.
+
+    Бросает ListingError при некорректных параметрах.
+    """
+    size = get_page_size(params)
+    fields = select_fields(spec, params)
+    keys = resolve_order(spec, params)
+    filtered = queryset
+
+    only, related, prefetch, annotations = set(), set(), [], {}
+    for name in fields:
+        field = spec.fields[name]
+        only.update(field.only)
+        related.update(field.related)
+        for item in field.prefetch:
+            if item not in prefetch:
+                prefetch.append(item)
+        # Аннотации можно задать функцией — если выражение зависит от времени запроса
+        annotations.update({key: expr() if callable(expr) else expr for key, expr in field.annotate.items()})
+    # Колонки сортировки нужны для следующего курсора
+    for _, path, _ in keys:
+        if path != "pk":
+            only.add(path)
+            if "__" in path:
+                related.add(path.rsplit("__", 1)[0])
+
+    queryset = queryset.select_related(*sorted(related)) if related else queryset
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    if annotations:
+        queryset = queryset.annotate(**annotations)
+    queryset = queryset.only(*sorted(only)).order_by(*[
+        F(path).desc(nulls_last=True) if desc else F(path).asc(nulls_last=True) for _, path, desc in keys
+    ])
+
+    cursor = params.get("cursor")
+    if cursor:
+        queryset = queryset.filter(after(keys, decode_cursor(cursor, keys, queryset)))
+
+    objects = list(queryset[:size + 1])
+    next_cursor = None
+    if len(objects) > size:
+        objects = objects[:size]
+        last = objects[-1]
+        next_cursor = encode_cursor(keys, [_value_at(last, path) for _, path, _ in keys])
+    return Page(spec, fields, objects, next_cursor, size, queryset=filtered)
@@ -0,0 +1,210 @@
+import cProfile
+import io
+import json
+import logging
+import pstats
+import random
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger("texelmed.api")
+
+# Границы гистограммы времени ответа (секунды)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+UNKNOWN_METHOD = "__unknown__"
+
+
+class QueryTracker:
+    """Считает SQL-запросы и время БД через connection.execute_wrapper"""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.add(1, time.perf_counter() - start)
+
+    def add(self, queries, db_time):
+        """Запросы, выполненные в другом потоке от имени этого вызова (helper/concurrency.py)"""
+        with self._lock:
+            self.queries += queries
+            self.db_time += db_time
+
+
+class MethodStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.wall_sum = 0.0
+        self.wall_max = 0.0
+        self.queries_sum = 0
+        self.queries_max = 0
+        self.db_time_sum = 0.0
+        self.bytes_sum = 0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+
+    def add(self, wall, queries, db_time, size, error):
+        self.count += 1
+        self.errors += int(error)
+        self.wall_sum += wall
+        self.wall_max = max(self.wall_max, wall)
+        self.queries_sum += queries
+        self.queries_max = max(self.queries_max, queries)
+        self.db_time_sum += db_time
+        self.bytes_sum += size
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if wall <= bound:
+                self.buckets[i] += 1
+
+
+# Реестр метрик процесса (у каждого воркера свой)
+_registry = {}
+_lock = threading.Lock()
+
+# Открытые в потоке track_queries — чтобы запросы из пула потоков попали в метрики вызова
+_active = threading.local()
+
+
+@contextmanager
+def track_queries():
+    """Подключает QueryTracker ко всем настроенным базам на время блока"""
+    tracker = QueryTracker()
+    trackers = _active.__dict__.setdefault("trackers", [])
+    trackers.append(tracker)
+    try:
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(tracker))
+            yield tracker
+    finally:
+        trackers.remove(tracker)
+
+
+def active_trackers():
+    """track_queries, открытые в текущем потоке (снаружи внутрь)"""
+    return list(getattr(_active, "trackers", ()))
+
+
+@contextmanager
+def profile(method):
+    """cProfile для методов из settings.API_PROFILE_METHODS (с сэмплированием)"""
+    methods = getattr(settings, "API_PROFILE_METHODS", [])
+    rate = getattr(settings, "API_PROFILE_SAMPLE_RATE", 1.0)
+    if (method not in methods and "*" not in methods) or random.random() >= rate:
+        yield None
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        _dump_profile(method, profiler)
+
+
+def _dump_profile(method, profiler):
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream).sort_stats("cumulative")
+    stats.print_stats(getattr(settings, "API_PROFILE_TOP", 30))
+    logger.info("profile %s\n%s", method, stream.getvalue())
+
+    profile_dir = getattr(settings, "API_PROFILE_DIR", None)
+    if profile_dir:
+        path = Path(profile_dir)
+        path.mkdir(parents=True, exist_ok=True)
+        stats.dump_stats(path / f"{method}-{int(time.time() * 1000)}.prof")
+
+
+def record(method, wall, queries, db_time, size, status):
+    """Сохраняет метрики вызова и пишет структурированный лог: каждый вызов — DEBUG (INFO при API_LOG_CALLS),
+    медленный — WARNING"""
+    error = status is False or (isinstance(status, int) and not isinstance(status, bool) and status >= 400)
+    with _lock:
+        stats = _registry.get(method)
+        if stats is None:
+            stats = _registry[method] = MethodStats()
+        stats.add(wall, queries, db_time, size, error)
+
+    payload = {
+        "event": "api_call",
+        "method": method,
+        "status": status,
+        "wall_ms": round(wall * 1000, 2),
+        "queries": queries,
+        "db_ms": round(db_time * 1000, 2),
+        "bytes": size,
+    }
+    slow_ms = getattr(settings, "API_SLOW_THRESHOLD_MS", None)
+    if slow_ms is not None and wall * 1000 >= slow_ms:
+        payload["slow"] = True
+        logger.warning(json.dumps(payload))
+    else:
+        level = logging.INFO if getattr(settings, "API_LOG_CALLS", False) else logging.DEBUG
+        if logger.isEnabledFor(level):
+            logger.log(level, json.dumps(payload))
+
+
+def snapshot():
+    with _lock:
+        return {name: vars(stats).copy() for name, stats in _registry.items()}
+
+
+def reset():
+    with _lock:
+        _registry.clear()
+
+
+def render_prometheus():
+    """Метрики в текстовом формате Prometheus (exposition format 0.0.4)"""
+    data = snapshot()
+    lines = []
+
+    def metric(name, kind, help_text, rows):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(rows)
+
+    def label(method, le=None):
+        if le is None:
+            return f'{{method="{method}"}}'
+        return f'{{method="{method}",le="{le}"}}'
+
+    names = sorted(data)
+    metric("texelmed_api_requests_total", "counter", "Вызовы API по методам",
+           [f"texelmed_api_requests_total{label(m)} {data[m]['count']}" for m in names])
+    metric("texelmed_api_errors_total", "counter", "Вызовы API со статусом ошибки",
+           [f"texelmed_api_errors_total{label(m)} {data[m]['errors']}" for m in names])
+
+    rows = []
+    for m in names:
+        # MethodStats.buckets уже накопительные (le)
+        for bound, count in zip(LATENCY_BUCKETS, data[m]["buckets"]):
+            rows.append(f"texelmed_api_request_seconds_bucket{label(m, bound)} {count}")
+        rows.append(f"texelmed_api_request_seconds_bucket{label(m, '+Inf')} {data[m]['count']}")
+        rows.append(f"texelmed_api_request_seconds_sum{label(m)} {data[m]['wall_sum']:.6f}")
+        rows.append(f"texelmed_api_request_seconds_count{label(m)} {data[m]['count']}")
+    metric("texelmed_api_request_seconds", "histogram", "Время обработки вызова", rows)
+
+    metric("texelmed_api_request_seconds_max", "gauge", "Максимальное время вызова",
+           [f"texelmed_api_request_seconds_max{label(m)} {data[m]['wall_max']:.6f}" for m in names])
+    metric("texelmed_api_db_queries_total", "counter", "SQL-запросы по методам",
+           [f"texelmed_api_db_queries_total{label(m)} {data[m]['queries_sum']}" for m in names])
+    metric("texelmed_api_db_queries_max", "gauge", "Максимум SQL-запросов за один вызов",
+           [f"texelmed_api_db_queries_max{label(m)} {data[m]['queries_max']}" for m in names])
+    metric("texelmed_api_db_seconds_total", "counter", "Время в БД по методам",
+           [f"texelmed_api_db_seconds_total{label(m)} {data[m]['db_time_sum']:.6f}" for m in names])
+    metric("texelmed_api_response_bytes_total", "counter", "Размер ответов по методам",
+           [f"texelmed_api_response_bytes_total{label(m)} {data[m]['bytes_sum']}" for m in names])
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,18 @@
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_subquery(queryset, field, outer="pk"):
+    """Коррелированный COUNT(*) для annotate(): число строк queryset, где field = внешний outer.
+
+    В отличие от Count() через JOIN не размножает строки при нескольких счётчиках
+    и не требует GROUP BY во внешнем запросе.
+    """
+    counts = (
+        queryset.filter(**{field: OuterRef(outer)})
+        .order_by()
+        .values(field)
+        .annotate(total=Count("*"))
+        .values("total")
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
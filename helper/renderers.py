@@ -0,0 +1,69 @@
+import decimal
+import json
+import uuid
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # без orjson — тот же формат через stdlib json
+    orjson = None
+
+_fallback = JSONEncoder()
+
+
+def default(value):
+    """Типы, которые сервисы отдают как есть: Decimal → число, UUID → строка.
+
+    Даты и всё остальное (ленивые строки, QuerySet…) — как стандартный энкодер DRF,
+    чтобы формат ответа не зависел от рендерера: datetime в UTC → «…T10:00:00.123Z».
+    """
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return _fallback.default(value)
+
+
+def dumps(data):
+    """JSON в bytes: orjson, если установлен, иначе stdlib json с тем же выводом"""
+    if orjson is not None:
+        return orjson.dumps(data, default=default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME)
+    return json.dumps(data, default=default, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSON-рендерер API на orjson (REST_FRAMEWORK.DEFAULT_RENDERER_CLASSES).
+
+    Отступы (Accept: application/json; indent=2) — через стандартный рендерер DRF.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        if self.get_indent(accepted_media_type or "", renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        return dumps(data)
+
+
+def columnar(value):
+    """Колоночный формат ответа: списки однородных объектов → {"columns": [...], "rows": [[...], ...]}.
+
+    Ключи передаются один раз на список, а не в каждой строке. Преобразуются сам ответ (если это
+    список) и списки на верхнем уровне ответа; пустые списки и списки не-объектов остаются как есть.
+    """
+    if isinstance(value, dict):
+        return {key: _columns(item) if isinstance(item, list) else item for key, item in value.items()}
+    if isinstance(value, list):
+        return _columns(value)
+    return value
+
+
+def _columns(items):
+    if not items or not all(isinstance(item, dict) for item in items):
+        return items
+    columns = list(items[0])
+    if any(len(item) != len(columns) or any(key not in item for key in columns) for item in items):
+        return items
+    return {"columns": columns, "rows": [[item[key] for key in columns] for item in items]}
@@ -0,0 +1,460 @@
+"""Суточные сводки DailyMetrics: клиника, филиал, врач, услуга × день; DiagnosisMetrics: диагнозы × день.
+
+Пересчёт — целыми днями (rollup): группирующие запросы по Appointment, Payment, Patient и MedicalRecord,
+затем строки дня заменяются. Изменение приёма, оплаты, пациента или медкарты (сигналы) ставит затронутые
+дни клиники в очередь PendingRollup той же транзакцией; очередь разбирает drain() вне запроса — фоновый
+пул процесса после коммита или cron (rollup_daily_metrics --pending). Ночной rollup_daily_metrics
+пересчитывает последние дни целиком и исправляет всё, что очередь упустила.
+queryset.update() / bulk_create сигналов не шлют — после них вызывайте rollup() или mark() сами; перенос услуги
+в другую категорию прошлые дни тоже не трогает — пересчёт периода командой.
+Дни до границы архива клиники (Clinic.archived_before, helper/archive.py) заморожены: их строк в рабочих
+таблицах уже нет, rollup такие дни пропускает — в том числе дни, где остались открытые приёмы: их позднее
+закрытие сводку не меняет.
+"""
+import contextlib
+import contextvars
+import datetime
+import logging
+import threading
+import weakref
+from collections import defaultdict
+from decimal import Decimal
+from functools import partial, update_wrapper
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, DurationField, ExpressionWrapper, F, Q, Sum, Value, When
+from django.db.models.functions import ExtractDay, ExtractMonth, ExtractYear, TruncDate
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.utils import timezone
+
+from core.models import Appointment, Clinic, DailyMetrics, DiagnosisMetrics, MedicalRecord, Patient, Payment, PendingRollup
+from helper.cache import bump
+from helper.concurrency import run_in_background
+
+logger = logging.getLogger(__name__)
+
+Dimension = DailyMetrics.Dimension
+
+APPOINTMENT_COUNTERS = ("appointments", "visits", "cancellations", "no_shows")
+COUNTERS = (*APPOINTMENT_COUNTERS, "new_patients")
+METRICS = (*COUNTERS, "revenue")
+DURATIONS = ("visit_seconds", "booked_seconds")
+
+# Способ оплаты → колонка выручки; оплаты неизвестным способом входят только в revenue
+METHOD_FIELDS = {method: f"revenue_{method}" for method, _ in Payment._meta.get_field("method").choices}
+
+# Разрез → поле приёма; для оплат — через appointment__, для новых пациентов — только филиал
+APPOINTMENT_DIMENSIONS = {
+    Dimension.BRANCH: "branch_id",
+    Dimension.DOCTOR: "doctor_id",
+    Dimension.SERVICE: "service_id",
+    Dimension.CATEGORY: "service__category_id",
+}
+PATIENT_DIMENSIONS = {Dimension.BRANCH: "primary_branch_id"}
+
+# Возрастные группы диагнозов на дату визита: (подпись, верхняя граница включительно; None — без границы)
+AGE_BANDS = (("0-17", 17), ("18-29", 29), ("30-44", 44), ("45-59", 59), ("60-74", 74), ("75+", None))
+NOT_SPECIFIED = "Не указан"
+
+# Поля, от которых зависят строки сводки: их прежние значения читаются из БД перед сохранением
+WATCHED = {
+    Appointment: ("clinic_id", "start_time", "branch_id", "doctor_id", "service_id"),
+    Payment: ("clinic_id", "paid_at", "appointment_id"),
+    Patient: ("clinic_id", "created_at", "primary_branch_id", "birth_date", "gender"),
+    MedicalRecord: ("patient_id", "visit_date", "diagnosis_icd10"),
+}
+
+
+def local_date(value):
+    if value is None:
+        return None
+    return timezone.localdate(value) if timezone.is_aware(value) else value.date()
+
+
+def day_range(date_from, date_to):
+    """Границы [начало date_from, начало следующего за date_to дня) в текущей зоне"""
+    start = datetime.datetime.combine(date_from, datetime.time.min)
+    end = datetime.datetime.combine(date_to + datetime.timedelta(days=1), datetime.time.min)
+    if timezone.is_naive(start):
+        start, end = timezone.make_aware(start), timezone.make_aware(end)
+    return start, end
+
+
+def _seconds(value):
+    return max(int(value.total_seconds()), 0) if value else 0
+
+
+def _scope(queryset, clinic_ids, field, start, end):
+    queryset = queryset.filter(**{f"{field}__gte": start, f"{field}__lt": end})
+    if clinic_ids is not None:
+        queryset = queryset.filter(clinic_id__in=clinic_ids)
+    return queryset.annotate(day=TruncDate(field)).order_by()
+
+
+def compute(clinic_ids, date_from, date_to):
+    """Строки DailyMetrics за дни [date_from, date_to] (clinic_ids=None — все клиники), без записи"""
+    start, end = day_range(date_from, date_to)
+    totals = defaultdict(
+        lambda: dict.fromkeys((*COUNTERS, *DURATIONS, "payments"), 0)
+        | dict.fromkeys(("revenue", *METHOD_FIELDS.values()), Decimal(0))
+    )
+
+    def add(row, dimensions, prefix="", **values):
+        keys = [(Dimension.CLINIC, row["clinic_id"])]
+        keys += [(dimension, row[prefix + field]) for dimension, field in dimensions.items()]
+        for dimension, key in keys:
+            if key is None:
+                continue
+            bucket = totals[(row["clinic_id"], row["day"], dimension, key)]
+            for name, value in values.items():
+                bucket[name] += value or 0
+
+    duration = ExpressionWrapper(F("end_time") - F("start_time"), output_field=DurationField())
+    completed = Q(status=Appointment.Status.COMPLETED)
+    booked = ~Q(status=Appointment.Status.CANCELLED)
+    appointments = _scope(Appointment.objects.all(), clinic_ids, "start_time", start, end).values(
+        "clinic_id", "day", *APPOINTMENT_DIMENSIONS.values()
+    ).annotate(
+        appointments=Count("id"),
+        visits=Count("id", filter=completed),
+        cancellations=Count("id", filter=Q(status=Appointment.Status.CANCELLED)),
+        no_shows=Count("id", filter=Q(status=Appointment.Status.NO_SHOW)),
+        visit_time=Sum(duration, filter=completed),
+        booked_time=Sum(duration, filter=booked),
+    )
+    for row in appointments:
+        add(
+            row, APPOINTMENT_DIMENSIONS, **{name: row[name] for name in APPOINTMENT_COUNTERS},
+            visit_seconds=_seconds(row["visit_time"]), booked_seconds=_seconds(row["booked_time"]),
+        )
+
+    payment_fields = [f"appointment__{field}" for field in APPOINTMENT_DIMENSIONS.values()]
+    payments = _scope(Payment.objects.filter(status="success"), clinic_ids, "paid_at", start, end).values(
+        "clinic_id", "day", "method", *payment_fields
+    ).annotate(revenue=Sum("amount"), payments=Count("id"))
+    for row in payments:
+        values = {"revenue": row["revenue"], "payments": row["payments"]}
+        if row["method"] in METHOD_FIELDS:
+            values[METHOD_FIELDS[row["method"]]] = row["revenue"]
+        add(row, APPOINTMENT_DIMENSIONS, prefix="appointment__", **values)
+
+    patients = _scope(Patient.objects.all(), clinic_ids, "created_at", start, end).values(
+        "clinic_id", "day", *PATIENT_DIMENSIONS.values()
+    ).annotate(new_patients=Count("id"))
+    for row in patients:
+        add(row, PATIENT_DIMENSIONS, new_patients=row["new_patients"])
+
+    return [
+        DailyMetrics(clinic_id=clinic_id, date=day, dimension=dimension, key=key, **values)
+        for (clinic_id, day, dimension, key), values in totals.items()
+    ]
+
+
+def with_age_band(records, date_field="visit_date"):
+    """Медкарты (или архивные записи, date_field="occurred_at") + band — возрастная группа пациента
+    на дату визита, выражением в SQL.
+
+    Полных лет: разница лет минус 1, если день рождения в году визита ещё не наступил.
+    """
+    birthday_ahead = Q(visit_month__lt=F("birth_month")) | Q(visit_month=F("birth_month"), visit_day__lt=F("birth_day"))
+    return records.annotate(
+        visit_year=ExtractYear(date_field), visit_month=ExtractMonth(date_field), visit_day=ExtractDay(date_field),
+        birth_year=ExtractYear("patient__birth_date"), birth_month=ExtractMonth("patient__birth_date"),
+        birth_day=ExtractDay("patient__birth_date"),
+    ).annotate(
+        age=F("visit_year") - F("birth_year") - Case(When(birthday_ahead, then=Value(1)), default=Value(0)),
+    ).annotate(
+        band=Case(
+            When(patient__birth_date__isnull=True, then=Value(NOT_SPECIFIED)),
+            *[When(age__lte=upper, then=Value(name)) for name, upper in AGE_BANDS if upper is not None],
+            default=Value(AGE_BANDS[-1][0]),
+        ),
+    )
+
+
+def diagnosis_code(value):
+    # Коды вводятся вручную: «j45.0 » и «J45.0» — один код
+    return value.strip().upper()
+
+
+def compute_diagnoses(clinic_ids, date_from, date_to):
+    """Строки DiagnosisMetrics за дни [date_from, date_to]: один GROUP BY по медкартам с диагнозом"""
+    start, end = day_range(date_from, date_to)
+    records = MedicalRecord.objects.filter(visit_date__gte=start, visit_date__lt=end).exclude(diagnosis_icd10="")
+    if clinic_ids is not None:
+        records = records.filter(patient__clinic_id__in=clinic_ids)
+    grouped = with_age_band(records).annotate(day=TruncDate("visit_date")).values(
+        "patient__clinic_id", "day", "diagnosis_icd10", "patient__gender", "band"
+    ).annotate(records=Count("id")).order_by()
+
+    totals = defaultdict(int)
+    for row in grouped:
+        code = diagnosis_code(row["diagnosis_icd10"])
+        if code:
+            totals[(row["patient__clinic_id"], row["day"], code, row["patient__gender"] or "", row["band"])] += row["records"]
+    return [
+        DiagnosisMetrics(clinic_id=clinic_id, date=day, code=code, gender=gender, age_band=band, records=records)
+        for (clinic_id, day, code, gender, band), records in totals.items()
+    ]
+
+
+# Сводка → подсчёт её строк
+ROLLUPS = {DailyMetrics: compute, DiagnosisMetrics: compute_diagnoses}
+
+
+def frozen(clinic_ids, lock=False):
+    """{клиника: первый день, который ещё можно пересчитать} — для клиник с архивом.
+
+    lock=True — строки клиник блокируются до конца транзакции: пересчёты одной клиники идут по очереди,
+    и более ранний подсчёт не запишет свои строки поверх свежих. FOR NO KEY UPDATE (PostgreSQL) не
+    конфликтует с FOR KEY SHARE проверки внешних ключей — запись приёмов и оплат клиники пересчёт не ждёт.
+    """
+    clinics = Clinic.objects.order_by("pk")
+    if clinic_ids is not None:
+        clinics = clinics.filter(id__in=clinic_ids)
+    if lock:
+        clinics = clinics.select_for_update(no_key=True)
+    return {
+        clinic_id: local_date(before)
+        for clinic_id, before in clinics.values_list("id", "archived_before")
+        if before is not None
+    }
+
+
+def rollup(clinic_ids, date_from, date_to=None, models=None):
+    """Пересчитать сводки models (по умолчанию обе) за дни [date_from, date_to]: строки этих дней заменяются целиком.
+
+    Подсчёт и замена — в одной транзакции под блокировкой клиник. Дни до границы архива клиники
+    не трогаются. Возвращает число записанных строк.
+    """
+    date_to = date_to or date_from
+    written = 0
+    for model in models or ROLLUPS:
+        with transaction.atomic():
+            first_days = frozen(clinic_ids, lock=True)
+            rows = ROLLUPS[model](clinic_ids, date_from, date_to)
+            stale = model.objects.filter(date__gte=date_from, date__lte=date_to)
+            if clinic_ids is not None:
+                stale = stale.filter(clinic_id__in=clinic_ids)
+            if first_days:
+                rows = [row for row in rows if row.date >= first_days.get(row.clinic_id, row.date)]
+                for clinic_id, first_day in first_days.items():
+                    if first_day > date_from:
+                        stale = stale.exclude(clinic_id=clinic_id, date__lt=first_day)
+            changed = {row.clinic_id for row in rows} | set(stale.values_list("clinic_id", flat=True).distinct())
+            stale.delete()
+            model.objects.bulk_create(rows, batch_size=1000)
+        # bulk_create сигналов не шлёт — кэш отчётов по сводке сбрасываем сами
+        for clinic_id in changed:
+            bump(model, clinic_id)
+        written += len(rows)
+    return written
+
+
+# --- Инкрементальное обновление по сигналам ---
+
+# Массовый перенос в архив: сигналы сводки не пересчитывают (дни до границы архива всё равно заморожены)
+_paused = contextvars.ContextVar("rollups_paused", default=False)
+
+
+@contextlib.contextmanager
+def paused():
+    token = _paused.set(True)
+    try:
+        yield
+    finally:
+        _paused.reset(token)
+
+
+# Сводка ↔ вид строки очереди
+KINDS = {DailyMetrics: PendingRollup.Kind.DAILY, DiagnosisMetrics: PendingRollup.Kind.DIAGNOSIS}
+MODELS = {kind: model for model, kind in KINDS.items()}
+
+# Разбор очереди уже поставлен в фоновый пул процесса и ещё не начался — второй не нужен
+_scheduled = False
+_schedule_lock = threading.Lock()
+
+# Соединение → (колбэк on_commit, {(клиника, вид сводки): дни}): дни транзакции копятся в памяти и после
+# коммита пишутся в очередь одним INSERT. Колбэк отменённой транзакции пропадает из run_on_commit —
+# тогда регистрируем заново
+_pending = weakref.WeakKeyDictionary()
+
+
+def mark(clinic_id, days, model=DailyMetrics):
+    """Поставить дни клиники в очередь пересчёта сводки model (PendingRollup) после коммита текущей транзакции.
+
+    Очередь пересчитывает drain() — в фоновом пуле (API_ROLLUP_WORKERS) или командой
+    rollup_daily_metrics --pending; запрос пересчёта не ждёт. Отметки процесса, упавшего между
+    коммитом и записью очереди, теряются — такие дни исправит ночной rollup_daily_metrics.
+    """
+    days = {day for day in days if day is not None}
+    if clinic_id is None or not days:
+        return
+    connection = transaction.get_connection()
+    callback, marked = _pending.get(connection, (None, None))
+    if callback is not None and any(func is callback for _, func, _ in connection.run_on_commit):
+        marked[(clinic_id, KINDS[model])] |= days
+        return
+    # update_wrapper: лог robust-колбэка берёт __qualname__, которого у partial нет
+    callback = update_wrapper(partial(_committed, connection), _committed)
+    _pending[connection] = (callback, defaultdict(set, {(clinic_id, KINDS[model]): days}))
+    # robust: сбой записи очереди не превращает уже закоммиченное изменение в ошибку запроса.
+    # Вне транзакции колбэк выполняется сразу — дни уже должны лежать в _pending
+    transaction.on_commit(callback, robust=True)
+
+
+def _committed(connection):
+    _, marked = _pending.pop(connection, (None, {}))
+    PendingRollup.objects.bulk_create(
+        [PendingRollup(clinic_id=clinic_id, kind=kind, date=day) for (clinic_id, kind), days in marked.items() for day in days],
+        ignore_conflicts=True,
+    )
+    schedule()
+
+
+def schedule():
+    """Разобрать очередь в фоновом пуле (API_ROLLUP_WORKERS; 0 — сразу, в этом потоке)"""
+    global _scheduled
+    workers = getattr(settings, "API_ROLLUP_WORKERS", 1)
+    if workers >= 1:
+        with _schedule_lock:
+            if _scheduled:
+                return
+            _scheduled = True
+    run_in_background(_drain, pool="rollups", workers=workers)
+
+
+def _drain():
+    global _scheduled
+    # Флаг снимаем до чтения очереди: дни, отмеченные с этого момента, этот разбор ещё увидит
+    with _schedule_lock:
+        _scheduled = False
+    try:
+        drain()
+    except Exception:
+        # Строки очереди остались — их разберёт следующий запуск или cron
+        logger.exception("Очередь пересчёта сводок не разобрана")
+
+
+def drain():
+    """Пересчитать дни из очереди: по группе (клиника, сводка) за раз — одним диапазоном от первого до последнего дня.
+
+    Строки группы блокируются (skip_locked) и удаляются в одной транзакции с пересчётом: параллельные
+    разборщики берут разные группы, изменение, закоммиченное после подсчёта, ставит свой день в очередь
+    заново, а сбой пересчёта оставляет группу в очереди. Возвращает число пересчитанных групп.
+    """
+    groups = 0
+    while True:
+        with transaction.atomic():
+            queue = PendingRollup.objects.select_for_update(skip_locked=True)
+            head = queue.order_by("date").values_list("clinic_id", "kind").first()
+            if head is None:
+                return groups
+            clinic_id, kind = head
+            claimed = list(queue.filter(clinic_id=clinic_id, kind=kind).values_list("id", "date"))
+            PendingRollup.objects.filter(id__in=[pk for pk, _ in claimed]).delete()
+            days = [day for _, day in claimed]
+            rollup([clinic_id], min(days), max(days), models=[MODELS[kind]])
+        groups += 1
+
+
+def _remember(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Прежние значения полей сводки — одним запросом перед сохранением уже существующей строки.
+
+    Не post_init: загрузка списков этих моделей не платит за отслеживание изменений.
+    save(update_fields=...) без полей сводки их не меняет — запроса нет.
+    """
+    watched = WATCHED[sender]
+    if raw or instance._state.adding or instance.pk is None:
+        instance._rollup_original = {}
+    elif update_fields is not None and not {field.removesuffix("_id") for field in update_fields} & {
+        field.removesuffix("_id") for field in watched
+    }:
+        instance._rollup_original = {field: instance.__dict__.get(field) for field in watched}
+    else:
+        instance._rollup_original = sender.objects.filter(pk=instance.pk).values(*watched).first() or {}
+
+
+def _record_clinic(record, patient_id):
+    """Клиника медкарты — клиника пациента (без запроса, если пациент уже загружен)"""
+    if patient_id is None:
+        return None
+    if MedicalRecord.patient.is_cached(record) and record.patient.pk == patient_id:
+        return record.patient.clinic_id
+    return Patient.objects.filter(pk=patient_id).values_list("clinic_id", flat=True).first()
+
+
+def _affected(sender, instance):
+    """(клиника, день) до и после изменения: день мог смениться вместе со временем"""
+    field = {Appointment: "start_time", Payment: "paid_at", Patient: "created_at", MedicalRecord: "visit_date"}[sender]
+    original = getattr(instance, "_rollup_original", {})
+    if sender is MedicalRecord:
+        clinic_id = _record_clinic(instance, instance.patient_id)
+        before_id = clinic_id if original.get("patient_id") == instance.patient_id else _record_clinic(instance, original.get("patient_id"))
+    else:
+        clinic_id, before_id = instance.clinic_id, original.get("clinic_id")
+    current = (clinic_id, local_date(getattr(instance, field)))
+    before = (before_id, local_date(original.get(field)))
+    return {current, before}
+
+
+def _mark_payments(appointment):
+    # Оплаты группируются по филиалу/врачу/услуге своего приёма
+    paid = Payment.objects.filter(appointment_id=appointment.pk).values_list("paid_at", flat=True)
+    mark(appointment.clinic_id, [local_date(paid_at) for paid_at in paid])
+
+
+def _mark_records(patient):
+    # Пол и возраст пациента входят только в сводку диагнозов — всех его визитов, одним диапазоном
+    visits = MedicalRecord.objects.filter(patient_id=patient.pk).values_list("visit_date", flat=True)
+    mark(patient.clinic_id, [local_date(visit_date) for visit_date in visits], DiagnosisMetrics)
+
+
+# Поля пациента, от которых зависят его строки DailyMetrics (new_patients)
+PATIENT_DAILY_FIELDS = ("clinic_id", "created_at", "primary_branch_id")
+
+
+def _changed(instance, original, fields):
+    # Отложенные (only/defer) поля не сравниваем — getattr подгрузил бы их запросом
+    return any(field in instance.__dict__ and original.get(field) != instance.__dict__[field] for field in fields)
+
+
+def _on_change(sender, instance, created=False, **kwargs):
+    if _paused.get():
+        return
+    original = getattr(instance, "_rollup_original", {})
+    saved = kwargs.get("signal") is post_save and not created
+
+    # Медкарты входят только в сводку диагнозов, остальные модели — только в DailyMetrics;
+    # пациент — только новыми пациентами: правка карты без смены клиники, даты или филиала сводку не меняет
+    model = DiagnosisMetrics if sender is MedicalRecord else DailyMetrics
+    if not (sender is Patient and saved and not _changed(instance, original, PATIENT_DAILY_FIELDS)):
+        days = defaultdict(set)
+        for clinic_id, day in _affected(sender, instance):
+            days[clinic_id].add(day)
+        for clinic_id, marked in days.items():
+            mark(clinic_id, marked, model)
+
+    if sender is Appointment and saved:
+        if any(original.get(field) != getattr(instance, field) for field in ("branch_id", "doctor_id", "service_id")):
+            _mark_payments(instance)
+    if sender is Patient and saved and _changed(instance, original, ("birth_date", "gender")):
+        _mark_records(instance)
+
+
+def _before_delete(sender, instance, **kwargs):
+    if _paused.get():
+        return
+    # После удаления приёма его оплаты уже отвязаны (SET_NULL) — дни оплат собираем заранее
+    _mark_payments(instance)
+
+
+def connect():
+    """Подписка на изменения (CoreConfig.ready)"""
+    for model in WATCHED:
+        uid = f"daily-metrics:{model._meta.label_lower}"
+        pre_save.connect(_remember, sender=model, dispatch_uid=uid)
+        post_save.connect(_on_change, sender=model, dispatch_uid=uid)
+        post_delete.connect(_on_change, sender=model, dispatch_uid=uid)
+    pre_delete.connect(_before_delete, sender=Appointment, dispatch_uid="daily-metrics:payments")
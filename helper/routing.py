@@ -0,0 +1,107 @@
+import hashlib
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+
+REPLICA = "replica"
+
+# Вызов внутри @reporting: чтения идут на реплику
+_reporting = ContextVar("texelmed_reporting", default=False)
+# Сессия текущего запроса API: {"key": хэш токена или None, "wrote": была ли запись}
+_session = ContextVar("texelmed_db_session", default=None)
+
+
+def _sticky_key(key):
+    return f"api:sticky:{key}"
+
+
+def _cache():
+    # Общий для воркеров кэш: с репликой src.db.cache_config требует Redis
+    return caches[getattr(settings, "API_CACHE_ALIAS", "default")]
+
+
+def replica_enabled():
+    return REPLICA in connections.settings
+
+
+class session:
+    """Контекст запроса API (MainView): запись в нём на API_REPLICA_STICKY_SECONDS
+    отправляет чтения этого токена на основную БД — реплика могла не догнать"""
+
+    def __init__(self, request):
+        header = request.headers.get("Authorization", "")
+        self.state = {"key": hashlib.sha1(header.encode()).hexdigest() if header else None, "wrote": False}
+
+    def __enter__(self):
+        self.token = _session.set(self.state)
+        return self.state
+
+    def __exit__(self, *exc):
+        _session.reset(self.token)
+
+
+def mark_write():
+    state = _session.get()
+    if state is None or state["wrote"]:
+        return
+    state["wrote"] = True
+    if state["key"]:
+        _cache().set(_sticky_key(state["key"]), True, getattr(settings, "API_REPLICA_STICKY_SECONDS", 10))
+
+
+def sticky():
+    """Читать с основной БД: в этом запросе или недавно этим токеном была запись"""
+    state = _session.get()
+    if state is None:
+        return False
+    return state["wrote"] or bool(state["key"] and _cache().get(_sticky_key(state["key"])))
+
+
+def reporting(func):
+    """Метод-отчёт (тяжёлые агрегаты): чтения — с реплики, если она настроена и нет недавней записи.
+
+    Пользователь по токену загружается до переключения — с основной БД.
+    """
+    @wraps(func)
+    def wrapper(request, params):
+        # v1.services сам импортирует helper — импорт при вызове
+        from v1.services.auth import get_user_from_token
+
+        if not replica_enabled():
+            return func(request, params)
+        get_user_from_token(request)
+        if sticky():
+            return func(request, params)
+        token = _reporting.set(True)
+        try:
+            return func(request, params)
+        finally:
+            _reporting.reset(token)
+
+    return wrapper
+
+
+class ReplicaRouter:
+    """DATABASE_ROUTERS: чтения методов @reporting — на реплику, всё остальное — на default"""
+
+    def db_for_read(self, model, **hints):
+        # Недавнюю запись проверил @reporting; здесь — только запись внутри самого отчёта
+        state = _session.get()
+        if _reporting.get() and not (state and state["wrote"]):
+            return REPLICA
+        return None
+
+    def db_for_write(self, model, **hints):
+        mark_write()
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплика — копия default: объекты из обеих баз связываются
+        return {obj1._state.db, obj2._state.db} <= {"default", REPLICA, None} or None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Схема реплики приходит репликацией
+        return False if db == REPLICA else None
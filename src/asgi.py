@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'src.settings')
+# Под ASGI /api/v1/ обслуживает async-диспетчер (API_ASYNC_DISPATCH=0 — прежний синхронный view)
+os.environ.setdefault('API_ASYNC_DISPATCH', '1')
 
 application = get_asgi_application()
@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from src.db import cache_config, database_config, replica_config
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
@@ -53,10 +56,86 @@ INSTALLED_APPS = [
 APP_NAME = 'TexelMed'
 
 
+# Метрики и профилирование диспетчера /api/v1/
+# Метрики: GET /metrics/ (Prometheus). Без токена доступны только при DEBUG.
+API_METRICS_TOKEN = None
+# Вызовы дольше порога пишутся в лог с уровнем WARNING, остальные — DEBUG (видны при API_LOG_LEVEL=DEBUG)
+API_SLOW_THRESHOLD_MS = 500
+# Структурированная строка api_call на каждый вызов — INFO (API_LOG_CALLS=1), чтобы собирать её в проде
+# без DEBUG-уровня логгера texelmed.api
+API_LOG_CALLS = os.environ.get("API_LOG_CALLS") == "1"
+# cProfile для выбранных методов (имена функций, "*" — все) и доля профилируемых вызовов
+API_PROFILE_METHODS = []
+API_PROFILE_SAMPLE_RATE = 1.0
+API_PROFILE_TOP = 30
+# Каталог для .prof файлов (None — только лог)
+API_PROFILE_DIR = None
+
+# Пагинация списков (helper/listing.py): размер страницы по умолчанию и максимум
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 500
+
+# Независимые запросы внутри метода — параллельно в пуле потоков (helper/concurrency.py); < 2 — последовательно
+API_PARALLEL_WORKERS = int(os.environ.get("API_PARALLEL_WORKERS", 4))
+# ASGI: /api/v1/ обслуживает async-view (включается в src/asgi.py), сервисы — в пуле из API_ASYNC_WORKERS потоков
+API_ASYNC_DISPATCH = os.environ.get("API_ASYNC_DISPATCH") == "1"
+API_ASYNC_WORKERS = int(os.environ.get("API_ASYNC_WORKERS", 16))
+# Максимум вызовов в одном batch-запросе (MainView.batch)
+API_BATCH_MAX_CALLS = 20
+
+# Кэш ответов методов чтения (helper/cache.py): Redis по API_CACHE_REDIS_URL, на сервере обязателен;
+# в памяти процесса — только при разработке (см. src/db.py). API_CACHE_TIMEOUT = 0 — кэш выключен
+CACHES = {"default": cache_config(os.environ)}
+API_CACHE_ALIAS = "default"
+API_CACHE_TIMEOUT = int(os.environ.get("API_CACHE_TIMEOUT", 300))
+
+# Ответы API — через orjson (helper/renderers.py); UUID, Decimal и даты сервисы отдают как есть
+REST_FRAMEWORK = {
+    "DEFAULT_RENDERER_CLASSES": [
+        "helper.renderers.FastJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+}
+
+# Сжатие ответов API (helper/compression.py): brotli или gzip, от API_COMPRESS_MIN_BYTES; XLSX, zip и картинки — как есть
+API_COMPRESS_PATHS = ["/api/"]
+API_COMPRESS_MIN_BYTES = 1024
+API_BROTLI_QUALITY = 5
+
+# Загрузка файлов пациентов (patient_file_upload): максимум размера; содержимое больше
+# FILE_UPLOAD_MAX_MEMORY_SIZE Django складывает во временный файл, а не в память
+API_UPLOAD_MAX_BYTES = int(os.environ.get("API_UPLOAD_MAX_BYTES", 512 * 1024 * 1024))
+# Уменьшенные копии снимков, фото и логотипов (helper/images.py): WebP в фоновом пуле из
+# API_IMAGE_WORKERS потоков (0 — сразу после коммита, в том же потоке)
+API_IMAGE_WORKERS = int(os.environ.get("API_IMAGE_WORKERS", 2))
+# Пересчёт суточных сводок после изменений (helper/rollups.py): очередь PendingRollup разбирает фоновый пул
+# из API_ROLLUP_WORKERS потоков (0 — сразу после коммита, в том же потоке); то, что не успел процесс, —
+# cron: rollup_daily_metrics --pending раз в минуту, ночной rollup_daily_metrics сверяет последние дни
+API_ROLLUP_WORKERS = int(os.environ.get("API_ROLLUP_WORKERS", 1))
+# Отдача файлов пациентов (/files/<id>/, core/views.py): "django" — FileResponse (sendfile WSGI-сервера),
+# "x-accel" — nginx по X-Accel-Redirect (internal location с префиксом API_FILE_ACCEL_PREFIX на MEDIA_ROOT),
+# "x-sendfile" — Apache mod_xsendfile по пути файла
+API_FILE_DELIVERY = os.environ.get("API_FILE_DELIVERY", "django")
+API_FILE_ACCEL_PREFIX = "/protected-media/"
+
+# Архив (helper/archive.py, команда archive_records): закрытые приёмы, оплаты и записи медкарты
+# старше стольких дней переносятся из рабочих таблиц в ArchivedRecord. Сводки за дни до горизонта
+# замораживаются целиком — горизонт берите больше срока, за который закрываются приёмы и приходят оплаты
+API_ARCHIVE_AFTER_DAYS = int(os.environ.get("API_ARCHIVE_AFTER_DAYS", 730))
+API_ARCHIVE_BATCH_SIZE = 500
+
+# Справочник МКБ-10 (helper/icd10.py): TSV-источник и mmap-индекс подсказок diagnosis_search.
+# Индекс собирается при деплое — командой build_icd10_index или migrate (если устарел); без него
+# diagnosis_search отвечает 503, а отчёты подписывают диагнозы голыми кодами
+ICD10_SOURCE = os.environ.get("ICD10_SOURCE") or BASE_DIR / "core" / "data" / "icd10.tsv"
+ICD10_INDEX = os.environ.get("ICD10_INDEX") or BASE_DIR / "var" / "icd10.idx"
+
+
 AUTH_USER_MODEL = 'core.CustomUser'
 
 
 MIDDLEWARE = [
+    'helper.compression.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -89,13 +168,19 @@ WSGI_APPLICATION = 'src.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# SQLite по умолчанию, DATABASE_URL — PostgreSQL (см. src/db.py)
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    'default': database_config(os.environ, BASE_DIR),
 }
 
+# Реплика: чтения методов @reporting (helper/routing.py); после записи токен
+# API_REPLICA_STICKY_SECONDS читает с основной БД — отметка о записи в общем кэше (нужен API_CACHE_REDIS_URL)
+REPLICA_DATABASE = replica_config(os.environ, BASE_DIR)
+if REPLICA_DATABASE:
+    DATABASES['replica'] = REPLICA_DATABASE
+DATABASE_ROUTERS = ['helper.routing.ReplicaRouter']
+API_REPLICA_STICKY_SECONDS = 10
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -137,3 +222,24 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Logging
+# https://docs.djangoproject.com/en/5.2/topics/logging/
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'texelmed.api': {
+            'handlers': ['console'],
+            'level': os.environ.get('API_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
@@ -14,13 +14,14 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
 from django.urls import include, path
 
-from v1.view import MainView
+from v1.view import async_main_view, main_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('api/v1/', MainView.as_view(), name='methodism'),
+    path('api/v1/', async_main_view if settings.API_ASYNC_DISPATCH else main_view, name='methodism'),
     path('', include('core.urls'))
 ]
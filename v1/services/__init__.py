@@ -12,8 +12,10 @@ from .director import (
     patient_delete, 
     patient_detail, 
     patient_documents, 
+    patient_file_upload,
     patient_finance,
     patient_history,
+    medical_record_detail,
     branch_list, 
     branch_create, 
     branch_update, 
@@ -30,6 +32,7 @@ from .director import (
     doctor_update, 
     doctor_update_schedule, 
     doctor_transfer,
+    doctor_leaderboard,
     # Categories
     category_list,
     category_create,
@@ -44,7 +47,22 @@ from .director import (
     package_create,
     marketing_list,
     discount_create,
-    promotion_create
+    promotion_create,
+    # Exports
+    export_patients,
+    export_appointments,
+    export_payments,
+    # Import
+    patient_import,
+    # Duplicates
+    patient_duplicates,
+    patient_merge,
+    # Reports
+    clinic_dashboard,
+    finance_report,
+    # Diagnoses
+    diagnosis_search,
+    diagnosis_report
 )
 from .sysadmin import (
     sys_create_director,
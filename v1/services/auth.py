@@ -8,7 +8,7 @@ from django.utils import timezone as dj_timezone  # ← Для dj_timezone.now()
 from core.models import (
     Branch, Clinic, ClinicDirectorProfile, CustomUser, PasswordResetOTP, Plan, Subscription
 )
-from helper.auth import generate_otp, send_password_reset_email
+from helper.auth import generate_otp, send_password_reset_email, token_user_per_request
 
 
 # === КОНСТАНТЫ ===
@@ -25,6 +25,7 @@ def decode_token(token: str):
         return None
 
 
+@token_user_per_request
 def get_user_from_token(request):
     """Извлекает пользователя из access токена (с select_related)"""
     auth_header = request.headers.get("Authorization", "")
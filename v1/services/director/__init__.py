@@ -4,3 +4,9 @@ from .branches import *
 from .users import *
 from .doctors import *
 from .services import *
+from .exports import *
+from .imports import *
+from .dedupe import *
+from .dashboard import *
+from .finance import *
+from .diagnoses import *
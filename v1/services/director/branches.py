@@ -1,8 +1,44 @@
 from django.utils import timezone
 from django.db.models import Q
 from core.models import CustomUser, Clinic, Branch, ClinicDirectorProfile, Patient, Appointment
+from helper.cache import cached_method
+from helper.listing import Field, ListingError, ListSpec, paginate
+from helper.queries import count_subquery
 from .utils import get_user_from_token
 
+def _appointments_month():
+    month_start = timezone.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    return count_subquery(Appointment.objects.filter(start_time__gte=month_start), 'branch')
+
+
+# Статистика (сотрудники, пациенты, приёмы в месяц) — подзапросами, только для запрошенных полей
+BRANCH_LIST = ListSpec(
+    fields={
+        "id": Field(lambda b: str(b.id)),
+        "name": Field(lambda b: b.name, only=("name",)),
+        "address": Field(lambda b: b.address, only=("address",)),
+        "phone": Field(lambda b: str(b.phone), only=("phone",)),
+        "email": Field(lambda b: b.email, only=("email",)),
+        "working_hours": Field(lambda b: b.working_hours, only=("working_hours",)),
+        "employees_count": Field(
+            lambda b: b.employees_count,
+            annotate={"employees_count": count_subquery(CustomUser.objects.filter(is_active=True), 'branch')},
+        ),
+        "patients_count": Field(
+            lambda b: b.patients_count, annotate={"patients_count": count_subquery(Patient.objects.all(), 'primary_branch')}
+        ),
+        "appointments_month": Field(lambda b: b.appointments_month, annotate={"appointments_month": _appointments_month}),
+        "status": Field(lambda b: "Активен" if b.is_active else "Неактивен", only=("is_active",)),
+        "is_active": Field(lambda b: b.is_active, only=("is_active",)),
+        "clinic_name": Field(lambda b: b.clinic.name, only=("clinic__name",), related=("clinic",)),
+    },
+    ordering={"name": "name", "address": "address", "clinic_name": "clinic__name"},
+    default_order=("name",),
+)
+
+# Счётчики (сотрудники, пациенты, приёмы за месяц) кэш не сбрасывают — обновляются по таймауту,
+# иначе каждая запись на приём обнуляла бы кэш списка
+@cached_method(Branch, Clinic, timeout=60)
 def branch_list(request, params):
     user = get_user_from_token(request)
     if not user: return {"response": {"error": "401"}, "status": 401}
@@ -14,8 +50,7 @@ def branch_list(request, params):
         clinics = Clinic.objects.filter(director_profile_link__user=user)
         if not clinics.exists():
              return {"response": {"branches": [], "count": 0}, "status": 200}
-    
-    # Ветки
+
     branches = Branch.objects.filter(clinic__in=clinics)
 
     # Фильтры
@@ -34,34 +69,12 @@ def branch_list(request, params):
     elif status_filter == "inactive":
         branches = branches.filter(is_active=False)
 
-    # Данные
-    data = []
-    now = timezone.now()
-    current_month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    
-    for b in branches:
-        # Статистика
-        employees_count = CustomUser.objects.filter(branch=b, is_active=True).count()
-        patients_count = Patient.objects.filter(primary_branch=b).count()
-        # Приемов в месяц
-        appointments_month = Appointment.objects.filter(branch=b, start_time__gte=current_month_start).count()
-
-        data.append({
-            "id": str(b.id),
-            "name": b.name,
-            "address": b.address,
-            "phone": str(b.phone),
-            "email": b.email,
-            "working_hours": b.working_hours,
-            "employees_count": employees_count,
-            "patients_count": patients_count,
-            "appointments_month": appointments_month,
-            "status": "Активен" if b.is_active else "Неактивен",
-            "is_active": b.is_active,
-            "clinic_name": b.clinic.name
-        })
-
-    return {"response": {"branches": data, "count": len(data)}, "status": 200}
+    try:
+        page = paginate(branches, params, BRANCH_LIST)
+    except ListingError as e:
+        return {"response": {"error": str(e)}, "status": 400}
+
+    return {"response": {"branches": page.rows(), "count": page.total(), **page.meta()}, "status": 200}
 
 
 def branch_create(request, params):
@@ -1,6 +1,8 @@
 from datetime import timedelta
 from django.utils import timezone
-from core.models import CustomUser, Clinic, Branch, Plan, Subscription, ClinicDirectorProfile
+from core.models import CustomUser, Clinic, Branch, Plan, Subscription, ClinicDirectorProfile, Patient
+from helper.concurrency import run_parallel
+from helper.queries import count_subquery
 from v1.services.auth import generate_tokens
 from .utils import get_user_from_token
 
@@ -123,6 +125,13 @@ def clinic_list(request, params):
     else:
         clinics = Clinic.objects.filter(director_profile_link__user=user)
 
+    clinics = clinics.select_related('subscription__plan').annotate(
+        active_users=count_subquery(CustomUser.objects.filter(is_active=True), 'clinic'),
+        active_branches=count_subquery(Branch.objects.filter(is_active=True), 'clinic'),
+        patients_count=count_subquery(Patient.objects.all(), 'clinic'),
+    )
+    clinics_used = Clinic.objects.filter(director_profile_link__user=user).count()
+
     data = []
     for c in clinics:
         # Безопасное получение подписки
@@ -143,11 +152,11 @@ def clinic_list(request, params):
             "name": c.name,
             "status": c.status,
             "plan": plan.name if plan else "Нет",
-            "clinics_used": Clinic.objects.filter(director_profile_link__user=user).count(),
+            "clinics_used": clinics_used,
             "clinics_limit": limit_clinics,
-            "users": f"{c.users.filter(is_active=True).count()}/{limit_users}",
-            "branches": f"{c.branches.filter(is_active=True).count()}/{limit_branches}",
-            "patients": f"{c.patients.count()}/{limit_patients}",
+            "users": f"{c.active_users}/{limit_users}",
+            "branches": f"{c.active_branches}/{limit_branches}",
+            "patients": f"{c.patients_count}/{limit_patients}",
         })
 
     return {"response": data, "status": 200}
@@ -180,6 +189,14 @@ def clinic_detail(request, params):
     profile = getattr(clinic, 'director_profile_link', None)
     director = profile.user if profile else None
 
+    # Счётчики лимитов независимы — одновременно
+    clinics_used, users_count, branches_count, patients_count = run_parallel(
+        lambda: Clinic.objects.filter(director_profile_link__user=user).count(),
+        lambda: clinic.users.filter(is_active=True).count(),
+        lambda: clinic.branches.filter(is_active=True).count(),
+        lambda: clinic.patients.count(),
+    )
+
     return {
         "response": {
             "id": str(clinic.id),
@@ -193,12 +210,12 @@ def clinic_detail(request, params):
                 "email": director.email
             },
             "plan": plan.name if plan else None,
-            "clinics_used": Clinic.objects.filter(director_profile_link__user=user).count(),
+            "clinics_used": clinics_used,
             "clinics_limit": plan.limit_clinics if plan else 1,
             "limits": {
-                "users": f"{clinic.users.filter(is_active=True).count()}/{plan.limit_users if plan else '∞'}",
-                "branches": f"{clinic.branches.filter(is_active=True).count()}/{plan.limit_branches if plan else '∞'}",
-                "patients": f"{clinic.patients.count()}/{plan.limit_patients if plan else '∞'}"
+                "users": f"{users_count}/{plan.limit_users if plan else '∞'}",
+                "branches": f"{branches_count}/{plan.limit_branches if plan else '∞'}",
+                "patients": f"{patients_count}/{plan.limit_patients if plan else '∞'}"
             }
         },
         "status": 200
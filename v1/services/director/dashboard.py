@@ -0,0 +1,140 @@
+import datetime
+
+from django.core.exceptions import ValidationError
+from django.db.models import Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from core.models import CustomUser, Clinic, Branch, Service, ServiceCategory, DailyMetrics
+from helper.rollups import COUNTERS, METRICS
+from helper.routing import reporting
+from .utils import get_user_from_token
+
+# Период по умолчанию — последние 30 дней, включая сегодня; больше MAX_DAYS — ошибка
+DASHBOARD_DEFAULT_DAYS = 30
+DASHBOARD_MAX_DAYS = 3660
+
+# Разрез → (модель, поле имени) для подписей в breakdown
+DASHBOARD_NAMES = {
+    DailyMetrics.Dimension.BRANCH: (Branch, "name"),
+    DailyMetrics.Dimension.DOCTOR: (CustomUser, "full_name"),
+    DailyMetrics.Dimension.SERVICE: (Service, "name"),
+    DailyMetrics.Dimension.CATEGORY: (ServiceCategory, "name"),
+}
+
+
+def _empty():
+    return dict.fromkeys(COUNTERS, 0) | {"revenue": 0}
+
+
+def _add(total, row):
+    for name in METRICS:
+        total[name] += row[name] or 0
+    return total
+
+
+def _report_clinic(user, clinic_id):
+    """Клиника отчёта → (clinic, ошибка): сисадмин — любая по clinic_id, директор — своя (по умолчанию первая)"""
+    if user.role == CustomUser.Roles.SYSTEM_ADMIN:
+        if not clinic_id:
+            return None, {"response": {"error": "clinic_id required"}, "status": 400}
+        clinics = Clinic.objects.filter(id=clinic_id)
+    elif user.role == CustomUser.Roles.CLINIC_DIRECTOR:
+        clinics = Clinic.objects.filter(director_profile_link__user=user)
+        if clinic_id:
+            clinics = clinics.filter(id=clinic_id)
+    else:
+        return None, {"response": {"error": "Только для директоров"}, "status": 403}
+
+    try:
+        clinic = clinics.only("id", "name").order_by("created_at").first()
+    except ValidationError:
+        clinic = None
+    if clinic is None:
+        return None, {"response": {"error": "Клиника не найдена или нет доступа"}, "status": 404}
+    return clinic, None
+
+
+def _report_period(params):
+    """date_from / date_to (YYYY-MM-DD, включительно) → ((date_from, date_to), ошибка); по умолчанию — последние 30 дней"""
+    dates = {}
+    for key in ("date_from", "date_to"):
+        value = params.get(key)
+        if value:
+            try:
+                dates[key] = parse_date(value)
+            except (TypeError, ValueError):
+                dates[key] = None
+            if dates[key] is None:
+                return (None, None), {"response": {"error": f"{key}: ожидается дата YYYY-MM-DD"}, "status": 400}
+    date_to = dates.get("date_to") or timezone.localdate()
+    date_from = dates.get("date_from") or date_to - datetime.timedelta(days=DASHBOARD_DEFAULT_DAYS - 1)
+    if date_from > date_to:
+        return (None, None), {"response": {"error": "date_from позже date_to"}, "status": 400}
+    if (date_to - date_from).days >= DASHBOARD_MAX_DAYS:
+        return (None, None), {"response": {"error": f"Период больше {DASHBOARD_MAX_DAYS} дней"}, "status": 400}
+    return (date_from, date_to), None
+
+
+@reporting
+def clinic_dashboard(request, params):
+    """Показатели клиники за период из суточных сводок DailyMetrics.
+
+    params: clinic_id, date_from / date_to (YYYY-MM-DD), dimension (clinic | branch | doctor | service | category),
+    interval (day | month). Ответ: totals, series по дням/месяцам и breakdown по разрезу.
+    """
+    user = get_user_from_token(request)
+    if not user: return {"response": {"error": "401"}, "status": 401}
+
+    clinic, error = _report_clinic(user, params.get("clinic_id"))
+    if error:
+        return error
+
+    (date_from, date_to), error = _report_period(params)
+    if error:
+        return error
+
+    dimension = params.get("dimension", DailyMetrics.Dimension.CLINIC)
+    if dimension not in DailyMetrics.Dimension.values:
+        return {"response": {"error": f"dimension: {', '.join(DailyMetrics.Dimension.values)}"}, "status": 400}
+    interval = params.get("interval", "day")
+    if interval not in ("day", "month"):
+        return {"response": {"error": "interval: day или month"}, "status": 400}
+
+    rows = DailyMetrics.objects.filter(clinic=clinic, date__gte=date_from, date__lte=date_to)
+
+    # Ряд и итоги — строки разреза «клиника»: не больше одной на день
+    buckets = {}
+    day = date_from
+    while day <= date_to:
+        buckets.setdefault(day if interval == "day" else day.replace(day=1), _empty())
+        day += datetime.timedelta(days=1)
+    totals = _empty()
+    for row in rows.filter(dimension=DailyMetrics.Dimension.CLINIC, key=clinic.id).values("date", *METRICS):
+        _add(buckets[row["date"] if interval == "day" else row["date"].replace(day=1)], row)
+        _add(totals, row)
+
+    data = {
+        "clinic": {"id": str(clinic.id), "name": clinic.name},
+        "date_from": date_from,
+        "date_to": date_to,
+        "interval": interval,
+        "totals": totals,
+        "series": [{"date": date, **values} for date, values in buckets.items()],
+    }
+
+    if dimension != DailyMetrics.Dimension.CLINIC:
+        # Суммы по ключам разреза считает БД; подписи — одним запросом
+        breakdown = list(
+            rows.filter(dimension=dimension).values("key")
+            .annotate(**{f"total_{name}": Sum(name) for name in METRICS})
+            .order_by("-total_revenue", "-total_appointments")
+        )
+        model, field = DASHBOARD_NAMES[dimension]
+        names = dict(model.objects.filter(id__in=[row["key"] for row in breakdown]).values_list("id", field))
+        data["dimension"] = dimension
+        data["breakdown"] = [
+            {"id": str(row["key"]), "name": names.get(row["key"], ""), **{name: row[f"total_{name}"] for name in METRICS}}
+            for row in breakdown
+        ]
+
+    return {"response": data, "status": 200}
@@ -0,0 +1,238 @@
+import re
+from collections import defaultdict
+from decimal import Decimal
+from difflib import SequenceMatcher
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import CharField, Count, DecimalField, IntegerField, Max, OuterRef, Subquery, Sum
+from django.db.models.functions import Cast, Coalesce
+from core.models import CustomUser, Clinic, Patient, Appointment, Payment, MedicalRecord, PatientFile, ArchivedRecord
+from .utils import get_user_from_token
+
+# Блоки больше этого (общий «заглушечный» телефон, 01.01.1900) не сравниваются попарно
+MAX_BLOCK_SIZE = 50
+DEFAULT_MIN_SIMILARITY = 0.8
+
+# Поля, которые при слиянии переносятся с дубля, если у основной карты они пустые
+MERGE_FILL_FIELDS = (
+    "email", "birth_date", "gender", "address", "blood_type", "allergies", "chronic_diseases",
+    "card_number", "user_id", "primary_branch_id",
+)
+
+NAME_RE = re.compile(r"[^\w]+")
+
+
+def normalize_name(name):
+    """«Ким  Ольга-Ли» и «ольга ли ким» → одна строка: регистр, ё→е, пунктуация, порядок слов"""
+    words = NAME_RE.sub(" ", (name or "").lower().replace("ё", "е")).split()
+    return " ".join(sorted(words))
+
+
+def name_similarity(a, b, threshold=0.0):
+    """difflib ratio нормализованных имён; 0, если заведомо ниже threshold"""
+    if a == b:
+        return 1.0
+    matcher = SequenceMatcher(None, a, b)
+    # real_quick_ratio / quick_ratio — дешёвые верхние границы ratio
+    if matcher.real_quick_ratio() < threshold or matcher.quick_ratio() < threshold:
+        return 0.0
+    return matcher.ratio()
+
+
+def find_duplicates(patients, min_similarity=DEFAULT_MIN_SIMILARITY):
+    """Пары вероятных дублей → (пары, число пропущенных больших блоков).
+
+    Кандидаты — только пациенты с общим телефоном или общей датой рождения (блоки),
+    внутри блока имена сравниваются попарно: O(сумма k²) по маленьким блокам вместо O(n²).
+    """
+    rows = {}
+    blocks = defaultdict(list)
+    # Cast: телефон строкой, без разбора PhoneNumberField для каждой строки
+    values = patients.values_list("id", "full_name", Cast("phone", output_field=CharField()), "birth_date")
+    for patient_id, full_name, phone, birth_date in values.iterator(chunk_size=5000):
+        rows[patient_id] = (normalize_name(full_name), phone, birth_date)
+        if phone:
+            blocks[("phone", phone)].append(patient_id)
+        if birth_date:
+            blocks[("birth_date", birth_date)].append(patient_id)
+
+    pairs, oversized = {}, 0
+    for members in blocks.values():
+        if len(members) < 2:
+            continue
+        if len(members) > MAX_BLOCK_SIZE:
+            oversized += 1
+            continue
+        for i, first in enumerate(members):
+            for second in members[i + 1:]:
+                key = (first, second) if str(first) < str(second) else (second, first)
+                if key in pairs:
+                    continue
+                (name_a, phone_a, birth_a), (name_b, phone_b, birth_b) = rows[key[0]], rows[key[1]]
+                score = name_similarity(name_a, name_b, min_similarity)
+                if score < min_similarity:
+                    continue
+                matched = []
+                if phone_a and phone_a == phone_b:
+                    matched.append("phone")
+                if birth_a and birth_a == birth_b:
+                    matched.append("birth_date")
+                pairs[key] = {"score": round(score, 3), "matched_on": matched}
+
+    ranked = sorted(pairs.items(), key=lambda item: (len(item[1]["matched_on"]), item[1]["score"]), reverse=True)
+    return ranked, oversized
+
+
+def recompute_patient_counters(patients):
+    """Set-based UPDATE счётчиков: визиты, последний визит, сумма успешных оплат (рабочие таблицы + архив)"""
+    money = DecimalField(max_digits=12, decimal_places=2)
+    done = Appointment.objects.filter(patient=OuterRef("pk"), status=Appointment.Status.COMPLETED).order_by().values("patient")
+    spent = Payment.objects.filter(patient=OuterRef("pk"), status="success").order_by().values("patient")
+    archived = ArchivedRecord.objects.filter(patient=OuterRef("pk")).order_by()
+    archived_done = archived.filter(kind=ArchivedRecord.Kind.APPOINTMENT, status=Appointment.Status.COMPLETED).values("patient")
+    archived_spent = archived.filter(kind=ArchivedRecord.Kind.PAYMENT, status="success").values("patient")
+    return patients.update(
+        total_visits=(
+            Coalesce(Subquery(done.annotate(c=Count("id")).values("c"), output_field=IntegerField()), 0)
+            + Coalesce(Subquery(archived_done.annotate(c=Count("id")).values("c"), output_field=IntegerField()), 0)
+        ),
+        # Архив старше рабочих таблиц: последний визит — из него, только если других нет
+        last_visit=Coalesce(
+            Subquery(done.annotate(m=Max("start_time")).values("m")),
+            Subquery(archived_done.annotate(m=Max("occurred_at")).values("m")),
+        ),
+        total_spent=(
+            Coalesce(Subquery(spent.annotate(s=Sum("amount")).values("s"), output_field=money), Decimal(0))
+            + Coalesce(Subquery(archived_spent.annotate(s=Sum("amount")).values("s"), output_field=money), Decimal(0))
+        ),
+    )
+
+
+def _director_clinics(user):
+    if user.role == CustomUser.Roles.SYSTEM_ADMIN:
+        return Clinic.objects.all()
+    return Clinic.objects.filter(director_profile_link__user=user)
+
+
+def _brief(patient):
+    return {
+        "id": str(patient.id),
+        "full_name": patient.full_name,
+        "phone": str(patient.phone) if patient.phone else "",
+        "birth_date": patient.birth_date,
+        "card_number": patient.card_number,
+        "total_visits": patient.total_visits,
+        "created_at": patient.created_at,
+    }
+
+
+def patient_duplicates(request, params):
+    user = get_user_from_token(request)
+    if not user:
+        return {"response": {"error": "Токен обязателен"}, "status": 401}
+    if user.role not in [CustomUser.Roles.CLINIC_DIRECTOR, CustomUser.Roles.SYSTEM_ADMIN]:
+        return {"response": {"error": "Нет прав"}, "status": 403}
+
+    clinics = _director_clinics(user)
+    clinic_id = params.get("clinic_id")
+    clinic = clinics.filter(id=clinic_id).first() if clinic_id else clinics.first()
+    if not clinic:
+        return {"response": {"error": "Клиника не найдена"}, "status": 404}
+
+    try:
+        min_similarity = float(params.get("min_similarity", DEFAULT_MIN_SIMILARITY))
+        limit = int(params.get("limit", 100))
+    except (TypeError, ValueError):
+        return {"response": {"error": "min_similarity и limit должны быть числами"}, "status": 400}
+    if not 0 < min_similarity <= 1 or limit < 1:
+        return {"response": {"error": "min_similarity: (0, 1], limit > 0"}, "status": 400}
+
+    pairs, oversized = find_duplicates(Patient.objects.filter(clinic=clinic), min_similarity)
+    top = pairs[:limit]
+
+    ids = {patient_id for key, _ in top for patient_id in key}
+    patients = Patient.objects.only(
+        "id", "full_name", "phone", "birth_date", "card_number", "total_visits", "created_at",
+    ).in_bulk(ids)
+
+    return {
+        "response": {
+            "pairs": [
+                {"patients": [_brief(patients[a]), _brief(patients[b])], **match}
+                for (a, b), match in top
+            ],
+            "total": len(pairs),
+            "blocks_skipped": oversized,
+        },
+        "status": 200,
+    }
+
+
+def patient_merge(request, params):
+    """Слияние дублей в основную карту: связи переносятся UPDATE-ами, счётчики пересчитываются"""
+    user = get_user_from_token(request)
+    if not user:
+        return {"response": {"error": "Токен обязателен"}, "status": 401}
+    if user.role not in [CustomUser.Roles.CLINIC_DIRECTOR, CustomUser.Roles.SYSTEM_ADMIN]:
+        return {"response": {"error": "Нет прав"}, "status": 403}
+
+    primary_id = params.get("primary_id")
+    duplicate_ids = params.get("duplicate_ids") or ([params["duplicate_id"]] if params.get("duplicate_id") else [])
+    if not primary_id or not isinstance(duplicate_ids, list) or not duplicate_ids:
+        return {"response": {"error": "primary_id и duplicate_ids обязательны"}, "status": 400}
+    duplicate_ids = [str(pk) for pk in duplicate_ids if str(pk) != str(primary_id)]
+
+    try:
+        with transaction.atomic():
+            clinics = _director_clinics(user)
+            # Клиника — тем же запросом (без блокировки): граница архива решает, трогать ли ArchivedRecord
+            primary = Patient.objects.select_for_update(of=("self",)).select_related("clinic").filter(
+                id=primary_id, clinic__in=clinics,
+            ).first()
+            if not primary:
+                return {"response": {"error": "Пациент не найден"}, "status": 404}
+            duplicates = list(Patient.objects.select_for_update().filter(id__in=duplicate_ids, clinic=primary.clinic))
+            if len(duplicates) != len(set(duplicate_ids)) or not duplicates:
+                return {"response": {"error": "Дубли должны быть пациентами той же клиники"}, "status": 400}
+
+            Appointment.objects.filter(patient__in=duplicates).update(patient=primary)
+            Payment.objects.filter(patient__in=duplicates).update(patient=primary)
+            MedicalRecord.objects.filter(patient__in=duplicates).update(patient=primary)
+            PatientFile.objects.filter(patient__in=duplicates).update(patient=primary)
+            if primary.clinic.archived_before:
+                ArchivedRecord.objects.filter(patient__in=duplicates).update(patient=primary)
+
+            # Пустые поля основной карты — из дублей (старые дубли первыми)
+            changed = set()
+            for duplicate in sorted(duplicates, key=lambda p: p.created_at):
+                for field in MERGE_FILL_FIELDS:
+                    if not getattr(primary, field) and getattr(duplicate, field):
+                        setattr(primary, field, getattr(duplicate, field))
+                        changed.add(field)
+                if duplicate.notes and duplicate.notes not in primary.notes:
+                    primary.notes = "\n".join(filter(None, [primary.notes, duplicate.notes]))
+                    changed.add("notes")
+            primary.debt += sum((d.debt for d in duplicates), Decimal(0))
+            changed.add("debt")
+
+            # Удаляем дубли до сохранения: номер карты уникален
+            Patient.objects.filter(id__in=[d.id for d in duplicates]).delete()
+            primary.save(update_fields=sorted(changed))
+            recompute_patient_counters(Patient.objects.filter(id=primary.id))
+    except ValidationError:
+        # Некорректный UUID в primary_id / duplicate_ids
+        return {"response": {"error": "Неверный идентификатор пациента"}, "status": 400}
+    except IntegrityError:
+        return {"response": {"error": "Конфликт при слиянии, изменения отменены"}, "status": 400}
+
+    primary.refresh_from_db()
+    return {
+        "response": {
+            "success": True,
+            "patient": _brief(primary),
+            "merged": len(duplicates),
+            "message": "Пациенты объединены",
+        },
+        "status": 200,
+    }
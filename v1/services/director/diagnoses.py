@@ -0,0 +1,261 @@
+import datetime
+import uuid
+from collections import Counter
+
+from django.db.models import Count, DateField, Sum
+from django.db.models.functions import TruncMonth
+from core.models import ArchivedRecord, Branch, DiagnosisMetrics, MedicalRecord, Patient
+from helper import archive, icd10
+from helper.cache import cached_method
+from helper.rollups import AGE_BANDS, NOT_SPECIFIED, day_range, diagnosis_code, with_age_band
+from helper.routing import reporting
+from .dashboard import _report_clinic, _report_period
+from .exports import _csv_response, _xlsx_response
+from .utils import get_user_from_token
+
+# Подсказок на один запрос: по умолчанию и максимум
+DIAGNOSIS_SEARCH_LIMIT = 10
+DIAGNOSIS_SEARCH_MAX = 50
+DIAGNOSIS_LANGUAGES = ("ru", "uz")
+
+GENDERS = dict(Patient._meta.get_field("gender").choices)
+
+DIAGNOSIS_SECTIONS = ("chapter", "code", "age", "gender", "month")
+# Кодов в by_code по умолчанию (самые частые); в экспорте — все
+DIAGNOSIS_TOP_CODES = 50
+
+
+def diagnosis_search(request, params):
+    """Автодополнение диагноза по справочнику МКБ-10 (mmap-индекс, без запросов к БД).
+
+    params: query — начало кода («J45.0», «j45») или слов названия («остр бронх»), limit, lang (ru | uz).
+    """
+    user = get_user_from_token(request)
+    if not user: return {"response": {"error": "401"}, "status": 401}
+
+    query = str(params.get("query") or "").strip()
+    try:
+        limit = int(params.get("limit") or DIAGNOSIS_SEARCH_LIMIT)
+    except (TypeError, ValueError):
+        return {"response": {"error": "limit должен быть числом"}, "status": 400}
+    lang = params.get("lang") or "ru"
+    if lang not in DIAGNOSIS_LANGUAGES:
+        return {"response": {"error": f"lang: {', '.join(DIAGNOSIS_LANGUAGES)}"}, "status": 400}
+
+    try:
+        results = icd10.search(query, limit=max(1, min(limit, DIAGNOSIS_SEARCH_MAX)), lang=lang)
+    except icd10.IndexUnavailable:
+        return {"response": {"error": "Справочник МКБ-10 временно недоступен"}, "status": 503}
+    return {"response": {"query": query, "results": results}, "status": 200}
+
+
+def _filters_error(clinic, params):
+    """branch_id / doctor_id: корректный UUID, филиал — только своей клиники"""
+    for key in ("branch_id", "doctor_id"):
+        if params.get(key):
+            try:
+                uuid.UUID(str(params[key]))
+            except ValueError:
+                return {"response": {"error": f"{key}: неверный идентификатор"}, "status": 400}
+    if params.get("branch_id") and not Branch.objects.filter(id=params["branch_id"], clinic=clinic).exists():
+        return {"response": {"error": "Филиал не найден"}, "status": 404}
+    return None
+
+
+def _cells(clinic, date_from, date_to, params):
+    """{(код, пол, возрастная группа, месяц): записей} — из суточной сводки DiagnosisMetrics.
+
+    С фильтром по филиалу или врачу (их нет в сводке) — тот же GROUP BY прямо по медкартам,
+    а за дни до границы архива клиники — ещё один по ArchivedRecord (колонки branch_id, doctor_id, code).
+    """
+    if params.get("branch_id") or params.get("doctor_id"):
+        start, end = day_range(date_from, date_to)
+        records = MedicalRecord.objects.filter(patient__clinic=clinic, visit_date__gte=start, visit_date__lt=end).exclude(diagnosis_icd10="")
+        sources = [(records, "appointment__branch_id", "diagnosis_icd10", "visit_date")]
+        archived = archive.records(clinic, start, end)
+        if archived is not None:
+            sources.append((archived, "branch_id", "code", "occurred_at"))
+
+        rows = []
+        for records, branch_field, code_field, date_field in sources:
+            if params.get("branch_id"):
+                records = records.filter(**{branch_field: params["branch_id"]})
+            if params.get("doctor_id"):
+                records = records.filter(doctor_id=params["doctor_id"])
+            if params.get("code"):
+                records = records.filter(**{f"{code_field}__istartswith": str(params["code"]).strip()})
+            grouped = with_age_band(records, date_field).annotate(
+                month=TruncMonth(date_field, output_field=DateField())
+            ).values(code_field, "patient__gender", "band", "month").annotate(count=Count("id")).order_by()
+            rows += [(row[code_field], row["patient__gender"], row["band"], row["month"], row["count"]) for row in grouped]
+    else:
+        metrics = DiagnosisMetrics.objects.filter(clinic=clinic, date__gte=date_from, date__lte=date_to)
+        if params.get("code"):
+            metrics = metrics.filter(code__startswith=diagnosis_code(str(params["code"])))
+        rows = metrics.annotate(month=TruncMonth("date")).values("code", "gender", "age_band", "month").annotate(
+            count=Sum("records")
+        ).values_list("code", "gender", "age_band", "month", "count").order_by()
+
+    cells = Counter()
+    for code, gender, band, month, count in rows:
+        code = diagnosis_code(code)
+        if code:
+            cells[(code, gender or "", band, month)] += count
+    return cells
+
+
+def _key(dimension, cell):
+    code, gender, band, month = cell
+    if dimension == "chapter":
+        chapter = icd10.chapter(code)
+        return chapter[0] if chapter else None
+    return {"code": code, "gender": gender, "age": band, "month": month}[dimension]
+
+
+def _labels(dimension, keys, lang):
+    if dimension == "chapter":
+        chapters = {number: f"{number}. {first}-{last} {name}" for number, first, last, name in icd10.CHAPTERS}
+        return {key: chapters.get(key, "Вне классификации") for key in keys}
+    if dimension == "code":
+        names = icd10.titles(keys, lang)
+        return {key: f"{key} {names[key]}" if key in names else key for key in keys}
+    if dimension == "gender":
+        return {key: GENDERS.get(key, NOT_SPECIFIED) for key in keys}
+    if dimension == "month":
+        return {key: key.strftime("%Y-%m") for key in keys}
+    return {key: key for key in keys}
+
+
+def _order(dimension, totals):
+    """Месяцы и возрастные группы — по порядку, остальное — по убыванию числа записей"""
+    if dimension == "month":
+        return sorted(totals)
+    if dimension == "age":
+        order = [name for name, _ in AGE_BANDS] + [NOT_SPECIFIED]
+        return sorted(totals, key=order.index)
+    return sorted(totals, key=lambda key: (-totals[key], key is None, str(key)))
+
+
+def _section(cells, dimension, total, lang, limit=None):
+    totals = Counter()
+    for cell, count in cells.items():
+        totals[_key(dimension, cell)] += count
+    keys = _order(dimension, totals)[:limit]
+    labels = _labels(dimension, keys, lang)
+    return [
+        {"key": key, "name": labels[key], "count": totals[key], "share": round(totals[key] / total * 100, 2) if total else 0}
+        for key in keys
+    ]
+
+
+def _pivot(cells, rows_dimension, columns_dimension, lang):
+    matrix_cells = Counter()
+    for cell, count in cells.items():
+        matrix_cells[(_key(rows_dimension, cell), _key(columns_dimension, cell))] += count
+    row_totals, column_totals = Counter(), Counter()
+    for (row, column), count in matrix_cells.items():
+        row_totals[row] += count
+        column_totals[column] += count
+    row_keys, column_keys = _order(rows_dimension, row_totals), _order(columns_dimension, column_totals)
+    row_labels, column_labels = _labels(rows_dimension, row_keys, lang), _labels(columns_dimension, column_keys, lang)
+    return {
+        "rows_dimension": rows_dimension,
+        "columns_dimension": columns_dimension,
+        "rows": [{"key": key, "name": row_labels[key]} for key in row_keys],
+        "columns": [{"key": key, "name": column_labels[key]} for key in column_keys],
+        "values": [[matrix_cells.get((row, column), 0) for column in column_keys] for row in row_keys],
+        "row_totals": [row_totals[key] for key in row_keys],
+        "column_totals": [column_totals[key] for key in column_keys],
+    }
+
+
+def _export_rows(cells, lang):
+    names = icd10.titles({code for code, _, _, _ in cells}, lang)
+    for cell in sorted(cells, key=lambda cell: (cell[3], cell[0], cell[1], cell[2])):
+        code, gender, band, month = cell
+        chapter = icd10.chapter(code)
+        yield [
+            month.strftime("%Y-%m"), chapter[0] if chapter else "", code, names.get(code, ""),
+            GENDERS.get(gender, NOT_SPECIFIED), band, cells[cell],
+        ]
+
+
+@cached_method(DiagnosisMetrics, MedicalRecord, Patient, ArchivedRecord)
+@reporting
+def diagnosis_report(request, params):
+    """Статистика диагнозов клиники за период: по классам и кодам МКБ-10, возрастным группам, полу и месяцам.
+
+    Строки — из суточной сводки DiagnosisMetrics (возрастная группа на дату визита считается в SQL при пересчёте),
+    разрезы и перекрёстная таблица — сложением этих строк.
+    params: clinic_id, date_from / date_to (YYYY-MM-DD), branch_id, doctor_id, code (начало кода: «J», «J45»),
+    sections (по умолчанию все: chapter, code, age, gender, month), limit (кодов в by_code), lang (ru | uz),
+    pivot — {"rows": разрез, "columns": разрез}, format (csv | xlsx — выгрузка строк группировки).
+    """
+    user = get_user_from_token(request)
+    if not user: return {"response": {"error": "401"}, "status": 401}
+
+    clinic, error = _report_clinic(user, params.get("clinic_id"))
+    if error:
+        return error
+    (date_from, date_to), error = _report_period(params)
+    if error:
+        return error
+
+    sections = params.get("sections") or DIAGNOSIS_SECTIONS
+    if isinstance(sections, str):
+        sections = [name.strip() for name in sections.split(",") if name.strip()]
+    unknown = [name for name in sections if name not in DIAGNOSIS_SECTIONS]
+    if unknown:
+        return {"response": {"error": f"sections: неизвестно {', '.join(unknown)}; доступно {', '.join(DIAGNOSIS_SECTIONS)}"}, "status": 400}
+    pivot = params.get("pivot")
+    if pivot and (
+        not isinstance(pivot, dict) or pivot.get("rows") not in DIAGNOSIS_SECTIONS
+        or pivot.get("columns") not in DIAGNOSIS_SECTIONS or pivot["rows"] == pivot["columns"]
+    ):
+        return {"response": {"error": f"pivot: rows и columns — разные из {', '.join(DIAGNOSIS_SECTIONS)}"}, "status": 400}
+    try:
+        limit = int(params.get("limit") or DIAGNOSIS_TOP_CODES)
+    except (TypeError, ValueError):
+        return {"response": {"error": "limit должен быть числом"}, "status": 400}
+    lang = params.get("lang") or "ru"
+    if lang not in DIAGNOSIS_LANGUAGES:
+        return {"response": {"error": f"lang: {', '.join(DIAGNOSIS_LANGUAGES)}"}, "status": 400}
+    export_format = params.get("format")
+    if export_format not in (None, "csv", "xlsx"):
+        return {"response": {"error": "format: csv или xlsx"}, "status": 400}
+
+    error = _filters_error(clinic, params)
+    if error:
+        return error
+
+    cells = _cells(clinic, date_from, date_to, params)
+
+    if export_format:
+        header = ["Месяц", "Класс", "Код", "Диагноз", "Пол", "Возраст", "Записей"]
+        rows = _export_rows(cells, lang)
+        filename = f"diagnoses-{date_from.isoformat()}-{date_to.isoformat()}"
+        if export_format == "xlsx":
+            return _xlsx_response(header, rows, f"{filename}.xlsx", "diagnoses")
+        return _csv_response(header, rows, f"{filename}.csv")
+
+    total = sum(cells.values())
+    data = {
+        "clinic": {"id": clinic.id, "name": clinic.name},
+        "date_from": date_from,
+        "date_to": date_to,
+        "totals": {"records": total, "codes": len({cell[0] for cell in cells})},
+    }
+    for name in sections:
+        data[f"by_{name}"] = _section(cells, name, total, lang, limit=max(limit, 1) if name == "code" else None)
+    if "month" in sections:
+        # Месяцы без записей — нулями, чтобы ряд был непрерывным
+        counts = {row["key"]: row for row in data["by_month"]}
+        months, month = [], date_from.replace(day=1)
+        while month <= date_to:
+            months.append(counts.get(month) or {"key": month, "name": month.strftime("%Y-%m"), "count": 0, "share": 0})
+            month = (month + datetime.timedelta(days=32)).replace(day=1)
+        data["by_month"] = months
+    if pivot:
+        data["pivot"] = _pivot(cells, pivot["rows"], pivot["columns"], lang)
+
+    return {"response": data, "status": 200}
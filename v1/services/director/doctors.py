@@ -1,8 +1,16 @@
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
 from django.db import transaction
-from django.db.models import Q, Sum, Count, Avg
+from django.db.models import Q, Sum, Count, F, DurationField, ExpressionWrapper
 from django.utils import timezone
 from datetime import timedelta, datetime
-from core.models import CustomUser, Clinic, Branch, DoctorProfile, Appointment, Payment, ClinicDirectorProfile
+from core.models import CustomUser, Clinic, Branch, DoctorProfile, Appointment, ClinicDirectorProfile, DailyMetrics
+from helper import images
+from helper.cache import cached_method
+from helper.listing import Field, ListingError, ListSpec, paginate
+from helper.routing import reporting
+from .dashboard import _report_clinic, _report_period
 from .utils import get_user_from_token
 import random
 import string
@@ -16,47 +24,112 @@ def get_current_month_range():
         end = start.replace(month=start.month + 1)
     return start, end
 
-def calculate_doctor_stats(doctor_user, start_date, end_date):
-    appts = Appointment.objects.filter(doctor=doctor_user, start_time__range=(start_date, end_date))
-    
-    total_appts = appts.exclude(status=Appointment.Status.CANCELLED).count()
-    cancelled_appts = appts.filter(status=Appointment.Status.CANCELLED).count()
-    
-    # Среднее время приема (в минутах)
-    completed_appts = appts.filter(status=Appointment.Status.COMPLETED)
-    avg_minutes = 0
-    if completed_appts.exists():
-        durations = [(a.end_time - a.start_time).total_seconds() / 60 for a in completed_appts]
-        avg_minutes = sum(durations) / len(durations)
-    
-    # Доход
-    income = appts.aggregate(total=Sum('price_paid'))['total'] or 0.0
-    
-    # Загрузка
-    # Допустим, считаем за текущую неделю для простоты или за день. 
-    # В идеале нужно парсить profile.schedule.
-    # Для демонстрации вернем статические или полу-динамические данные, 
-    # так как полноценный расчет сетки времени - это тяжелая логика.
-    profile = getattr(doctor_user, 'doctor_profile', None)
-    load_percent = 0
-    free_slots = 0
-    if profile and profile.schedule:
+def calculate_doctors_stats(doctors, start_date, end_date):
+    """Статистика врачей за период одним сгруппированным запросом: {doctor_id: stats}"""
+    doctors = list(doctors)
+    duration = ExpressionWrapper(F('end_time') - F('start_time'), output_field=DurationField())
+    not_cancelled = ~Q(status=Appointment.Status.CANCELLED)
+    completed = Q(status=Appointment.Status.COMPLETED)
+
+    rows = Appointment.objects.filter(
+        doctor_id__in=[d.id for d in doctors], start_time__range=(start_date, end_date)
+    ).values('doctor_id').annotate(
+        total=Count('id', filter=not_cancelled),
+        cancelled=Count('id', filter=Q(status=Appointment.Status.CANCELLED)),
+        completed=Count('id', filter=completed),
+        completed_time=Sum(duration, filter=completed),
+        worked_time=Sum(duration, filter=not_cancelled),
+        income=Sum('price_paid'),
+    ).order_by()
+    by_doctor = {row['doctor_id']: row for row in rows}
+
+    stats = {}
+    for doctor in doctors:
+        row = by_doctor.get(doctor.id, {})
+        total_appts = row.get('total', 0)
+
+        # Среднее время приема (в минутах)
+        avg_minutes = 0
+        if row.get('completed'):
+            avg_minutes = row['completed_time'].total_seconds() / 60 / row['completed']
+
+        # Загрузка
         # Упрощенный расчет: допустим 8 часов в день * 22 рабочих дня = 176 часов
-        # Считаем сколько часов занято в приёмах
-        total_worked_seconds = sum([(a.end_time - a.start_time).total_seconds() for a in appts.exclude(status=Appointment.Status.CANCELLED)])
-        total_available_seconds = 176 * 3600 # Заглушка
-        load_percent = min(int((total_worked_seconds / total_available_seconds) * 100), 100) if total_available_seconds > 0 else 0
-        free_slots = max(0, 20 - total_appts) # Заглушка
-        
-    return {
-        "appointments_count": total_appts,
-        "avg_time": int(avg_minutes),
-        "income": float(income),
-        "cancelled": cancelled_appts,
-        "load_percent": load_percent,
-        "free_slots": free_slots
-    }
+        # (полноценный расчет сетки по profile.schedule — тяжелая логика)
+        profile = getattr(doctor, 'doctor_profile', None)
+        load_percent = 0
+        free_slots = 0
+        if profile and profile.schedule:
+            worked = row.get('worked_time')
+            total_worked_seconds = worked.total_seconds() if worked else 0
+            total_available_seconds = 176 * 3600 # Заглушка
+            load_percent = min(int((total_worked_seconds / total_available_seconds) * 100), 100)
+            free_slots = max(0, 20 - total_appts) # Заглушка
+
+        stats[doctor.id] = {
+            "appointments_count": total_appts,
+            "avg_time": int(avg_minutes),
+            "income": float(row.get('income') or 0.0),
+            "cancelled": row.get('cancelled', 0),
+            "load_percent": load_percent,
+            "free_slots": free_slots
+        }
+    return stats
+
+def calculate_doctor_stats(doctor_user, start_date, end_date):
+    return calculate_doctors_stats([doctor_user], start_date, end_date)[doctor_user.id]
+
+def _profile(d):
+    return getattr(d, 'doctor_profile', None)
+
+def _profile_field(name, value, default):
+    """Поле из DoctorProfile (профиль подтягивается JOIN-ом только если поле запрошено)"""
+    return Field(
+        lambda d: value(_profile(d)) if _profile(d) else default,
+        only=(f"doctor_profile__{name}",), related=("doctor_profile",),
+    )
+
+DOCTOR_LIST = ListSpec(
+    fields={
+        "id": Field(lambda d: d.id),
+        "full_name": Field(lambda d: d.full_name, only=("full_name",)),
+        "specialization": _profile_field("specialization", lambda p: p.specialization, "Не указана"),
+        "branch": Field(lambda d: d.branch.name if d.branch else "Не назначен", only=("branch__name",), related=("branch",)),
+        "branch_id": Field(lambda d: d.branch_id, only=("branch",)),
+        "cabinet": _profile_field("cabinet", lambda p: p.cabinet, "-"),
+        "contacts": Field(lambda d: {"phone": str(d.phone) if d.phone else "", "email": d.email}, only=("phone", "email")),
+        "experience_years": _profile_field("experience_years", lambda p: p.experience_years, 0),
+        "rating": _profile_field("rating", lambda p: p.rating, 0.0),
+        "education": _profile_field("education", lambda p: p.education, ""),
+        "work_history": _profile_field("work_history", lambda p: p.work_history, ""),
+        "biography": _profile_field("biography", lambda p: p.biography, ""),
+        # Статистика за месяц считается одним запросом на страницу (см. doctor_list)
+        "stats_month": Field(lambda d: {
+            "appointments": d.stats["appointments_count"],
+            "avg_time_min": d.stats["avg_time"],
+            "income": d.stats["income"],
+            "cancelled": d.stats["cancelled"]
+        }, only=("doctor_profile__schedule",), related=("doctor_profile",)),
+        "load": Field(
+            lambda d: {"percent": d.stats["load_percent"], "free_slots": d.stats["free_slots"]},
+            only=("doctor_profile__schedule",), related=("doctor_profile",),
+        ),
+        "status": Field(lambda d: "Активен" if d.is_active else "Неактивен", only=("is_active",)),
+        "is_active": Field(lambda d: d.is_active, only=("is_active",)),
+        # Миниатюра (WebP), пока её нет — оригинал
+        "photo": Field(lambda d: images.url(d.photo, d.photo_sha256), only=("photo", "photo_sha256")),
+    },
+    ordering={
+        "full_name": "full_name",
+        "date_joined": "date_joined",
+        "specialization": "doctor_profile__specialization",
+        "rating": "doctor_profile__rating",
+        "experience_years": "doctor_profile__experience_years",
+    },
+    default_order=("full_name",),
+)
 
+@reporting
 def doctor_list(request, params):
     user = get_user_from_token(request)
     if not user: return {"response": {"error": "401"}, "status": 401}
@@ -73,7 +146,7 @@ def doctor_list(request, params):
     doctors = CustomUser.objects.filter(
         clinic__in=clinics, 
         role=CustomUser.Roles.DOCTOR
-    ).select_related('doctor_profile', 'branch', 'clinic')
+    )
 
     # Фильтры
     search = params.get("search", "").strip()
@@ -93,46 +166,19 @@ def doctor_list(request, params):
     if spec_filter:
         doctors = doctors.filter(doctor_profile__specialization__icontains=spec_filter)
 
-    # Статистика за месяц
-    start, end = get_current_month_range()
-    
-    data = []
-    for d in doctors:
-        profile = getattr(d, 'doctor_profile', None)
-        stats = calculate_doctor_stats(d, start, end)
-        
-        data.append({
-            "id": str(d.id),
-            "full_name": d.full_name,
-            "specialization": profile.specialization if profile else "Не указана",
-            "branch": d.branch.name if d.branch else "Не назначен",
-            "branch_id": str(d.branch.id) if d.branch else None,
-            "cabinet": profile.cabinet if profile else "-",
-            "contacts": {
-                "phone": str(d.phone) if d.phone else "",
-                "email": d.email
-            },
-            "experience_years": profile.experience_years if profile else 0,
-            "rating": float(profile.rating) if profile else 0.0,
-            "education": profile.education if profile else "",
-            "work_history": profile.work_history if profile else "",
-            "biography": profile.biography if profile else "",
-            "stats_month": {
-                "appointments": stats["appointments_count"],
-                "avg_time_min": stats["avg_time"],
-                "income": stats["income"],
-                "cancelled": stats["cancelled"]
-            },
-            "load": {
-                "percent": stats["load_percent"],
-                "free_slots": stats["free_slots"]
-            },
-            "status": "Активен" if d.is_active else "Неактивен",
-            "is_active": d.is_active,
-            "photo": d.photo.url if d.photo else None
-        })
+    try:
+        page = paginate(doctors, params, DOCTOR_LIST)
+    except ListingError as e:
+        return {"response": {"error": str(e)}, "status": 400}
 
-    return {"response": {"doctors": data, "count": len(data)}, "status": 200}
+    # Статистика за месяц — только для врачей страницы и только если запрошена
+    if page.wants("stats_month", "load"):
+        start, end = get_current_month_range()
+        doctors_stats = calculate_doctors_stats(page.objects, start, end)
+        for d in page:
+            d.stats = doctors_stats[d.id]
+
+    return {"response": {"doctors": page.rows(), "count": page.total(), **page.meta()}, "status": 200}
 
 def doctor_create(request, params):
     user = get_user_from_token(request)
@@ -147,7 +193,7 @@ def doctor_create(request, params):
     specialization = params.get("specialization")
     branch_id = params.get("branch_id")
     clinic_id = params.get("clinic_id")
-    cabinet = params.get("cabinet")
+    cabinet = params.get("cabinet") or ""
     experience_years = params.get("experience_years", 0)
     education = params.get("education", "")
     work_history = params.get("work_history", "") # Можем сохранить в notes или расширить модель
@@ -259,7 +305,8 @@ def doctor_detail(request, params):
             "biography": profile.biography,
             "certificates": profile.certificates,
             "schedule": profile.schedule,
-            "photo": doctor.photo.url if doctor.photo else None
+            "photo": doctor.photo.url if doctor.photo else None,
+            "photo_preview": images.url(doctor.photo, doctor.photo_sha256, "preview"),
         }
         return {"response": data, "status": 200}
         
@@ -370,3 +417,153 @@ def doctor_transfer(request, params):
         return {"response": {"error": "Врач не найден"}, "status": 404}
     except Branch.DoesNotExist:
         return {"response": {"error": "Целевой филиал не найден в этой клинике"}, "status": 404}
+
+
+# Метрика → True, если больше — лучше (no_show_rate: чем меньше, тем выше место)
+LEADERBOARD_METRICS = {
+    "income": True,
+    "visits": True,
+    "avg_visit_minutes": True,
+    "no_show_rate": False,
+    "utilization": True,
+}
+LEADERBOARD_DEFAULT_LIMIT = 10
+WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+
+def _scheduled_seconds(schedule, date_from, date_to):
+    """Часы приёма по графику {"mon": {"start": "09:00", "end": "18:00"}, …} за дни периода, в секундах"""
+    per_weekday = {}
+    for index, day in enumerate(WEEKDAYS):
+        hours = (schedule or {}).get(day)
+        try:
+            start = datetime.strptime(hours["start"], "%H:%M")
+            end = datetime.strptime(hours["end"], "%H:%M")
+        except (TypeError, KeyError, ValueError):
+            continue
+        per_weekday[index] = max((end - start).total_seconds(), 0)
+
+    days = (date_to - date_from).days + 1
+    weeks, rest = divmod(days, 7)
+    total = weeks * sum(per_weekday.values())
+    for offset in range(rest):
+        total += per_weekday.get((date_from + timedelta(days=weeks * 7 + offset)).weekday(), 0)
+    return total
+
+
+def _rank_rows(rows, metric, descending=True):
+    """Места с общими местами при равенстве («1, 2, 2, 4»); строки без значения метрики — без места"""
+    ranked = sorted((row for row in rows if row[metric] is not None), key=lambda row: row[metric], reverse=descending)
+    previous, rank = None, 0
+    for position, row in enumerate(ranked, 1):
+        if row[metric] != previous:
+            rank, previous = position, row[metric]
+        row["rank"] = rank
+    unranked = [row for row in rows if row[metric] is None]
+    for row in unranked:
+        row["rank"] = None
+    return ranked + unranked
+
+
+@cached_method(DailyMetrics, CustomUser, DoctorProfile)
+@reporting
+def doctor_leaderboard(request, params):
+    """Рейтинг врачей клиники (или врачей филиала) за период.
+
+    Метрики — одним агрегирующим запросом по суточным сводкам врачей (DailyMetrics: не больше строки
+    на врача и день), места — в памяти: загрузка зависит от графика врача.
+    Доход — успешные оплаты приёмов врача, загрузка — время неотменённых приёмов к часам по графику.
+    params: clinic_id, branch_id, date_from / date_to (YYYY-MM-DD, по умолчанию последние 30 дней),
+    metric (income | visits | avg_visit_minutes | no_show_rate | utilization), order (desc | asc),
+    limit — топ-N мест: врачи с равным значением делят место, поэтому строк может быть больше N (0 — все).
+    branch_id выбирает врачей, закреплённых за филиалом, но их метрики — по всей клинике: сводка врача
+    (DailyMetrics.Dimension.DOCTOR) по филиалам не делится, приёмы врача в других филиалах тоже считаются.
+    В ответе это указано полем metrics_scope.
+    """
+    user = get_user_from_token(request)
+    if not user: return {"response": {"error": "401"}, "status": 401}
+
+    clinic, error = _report_clinic(user, params.get("clinic_id"))
+    if error:
+        return error
+    (date_from, date_to), error = _report_period(params)
+    if error:
+        return error
+
+    metric = params.get("metric", "income")
+    if metric not in LEADERBOARD_METRICS:
+        return {"response": {"error": f"metric: {', '.join(LEADERBOARD_METRICS)}"}, "status": 400}
+    order = params.get("order") or ("desc" if LEADERBOARD_METRICS[metric] else "asc")
+    if order not in ("desc", "asc"):
+        return {"response": {"error": "order: desc или asc"}, "status": 400}
+    try:
+        limit = int(params.get("limit", LEADERBOARD_DEFAULT_LIMIT))
+    except (TypeError, ValueError):
+        return {"response": {"error": "limit: ожидается число"}, "status": 400}
+
+    doctors = CustomUser.objects.filter(clinic=clinic, role=CustomUser.Roles.DOCTOR, is_active=True)
+    branch_id = params.get("branch_id")
+    if branch_id:
+        try:
+            doctors = doctors.filter(branch=Branch.objects.only("id").get(id=branch_id, clinic=clinic))
+        except (Branch.DoesNotExist, ValidationError):
+            return {"response": {"error": "Филиал не найден в этой клинике"}, "status": 404}
+    doctors = list(doctors.select_related("doctor_profile").only(
+        "id", "full_name", "branch_id", "doctor_profile__specialization", "doctor_profile__schedule",
+    ))
+
+    totals = DailyMetrics.objects.filter(
+        clinic=clinic, dimension=DailyMetrics.Dimension.DOCTOR, date__gte=date_from, date__lte=date_to,
+        key__in=[doctor.id for doctor in doctors],
+    ).values("key").annotate(
+        total_appointments=Sum("appointments"),
+        total_cancellations=Sum("cancellations"),
+        total_visits=Sum("visits"),
+        total_no_shows=Sum("no_shows"),
+        total_revenue=Sum("revenue"),
+        total_visit_seconds=Sum("visit_seconds"),
+        total_booked_seconds=Sum("booked_seconds"),
+    ).order_by()
+    by_doctor = {row["key"]: row for row in totals}
+
+    rows = []
+    for doctor in doctors:
+        row = by_doctor.get(doctor.id, {})
+        profile = getattr(doctor, "doctor_profile", None)
+        booked = (row.get("total_appointments") or 0) - (row.get("total_cancellations") or 0)
+        visits = row.get("total_visits") or 0
+        no_shows = row.get("total_no_shows") or 0
+        scheduled = _scheduled_seconds(profile.schedule if profile else None, date_from, date_to)
+        rows.append({
+            "id": doctor.id,
+            "full_name": doctor.full_name,
+            "specialization": profile.specialization if profile else "",
+            "branch_id": doctor.branch_id,
+            "appointments": booked,
+            "no_shows": no_shows,
+            "income": row.get("total_revenue") or Decimal(0),
+            "visits": visits,
+            "avg_visit_minutes": round(row["total_visit_seconds"] / 60 / visits, 1) if visits else None,
+            "no_show_rate": round(no_shows * 100 / booked, 2) if booked else None,
+            "utilization": round((row.get("total_booked_seconds") or 0) * 100 / scheduled, 2) if scheduled else None,
+        })
+
+    ranked = _rank_rows(rows, metric, descending=order == "desc")
+    top = [row for row in ranked if row["rank"] is not None and row["rank"] <= limit] if limit > 0 else ranked
+
+    return {
+        "response": {
+            "clinic": {"id": clinic.id, "name": clinic.name},
+            "branch_id": branch_id,
+            # branch_id фильтрует список врачей, метрики врача — по всем филиалам клиники
+            "metrics_scope": "clinic",
+            "date_from": date_from,
+            "date_to": date_to,
+            "metric": metric,
+            "order": order,
+            "doctors": top,
+            "count": len(top),
+            "total": len(rows),
+        },
+        "status": 200,
+    }
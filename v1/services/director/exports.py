@@ -0,0 +1,283 @@
+import csv
+import datetime
+import heapq
+import re
+import tempfile
+from decimal import Decimal
+
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from openpyxl import Workbook
+from core.models import ArchivedRecord, CustomUser, Clinic, Patient, Appointment, Payment
+from helper import archive
+from .utils import get_user_from_token
+
+# Строк за один fetch из БД и строк CSV в одном отдаваемом куске
+EXPORT_CHUNK_SIZE = 2000
+CSV_ROWS_PER_CHUNK = 500
+
+XLSX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+class Echo:
+    """Псевдо-файл для csv.writer: writerow() возвращает готовую строку"""
+
+    def write(self, value):
+        return value
+
+
+# Строка с таким началом в Excel/LibreOffice — формула (CSV/formula injection)
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+# Телефон или число («+998 90 123-45-67», «-150») формулой не выполнится — такие строки не трогаем
+PLAIN_NUMBER = re.compile(r"[+-]?[\d\s().-]+")
+
+
+def _text(value):
+    if value.startswith(FORMULA_PREFIXES) and not PLAIN_NUMBER.fullmatch(value):
+        return "'" + value
+    return value
+
+
+def _cell(value):
+    """Значение колонки → CSV/XLSX (даты в локальном времени без tz и долей секунды, телефон строкой, текст без формул)"""
+    if value is None:
+        return ""
+    if isinstance(value, datetime.datetime):
+        # Доли секунды таблице не нужны, а архив (JSON) хранит их только до миллисекунд
+        value = value.replace(microsecond=0)
+        return timezone.localtime(value).replace(tzinfo=None) if timezone.is_aware(value) else value
+    if isinstance(value, str):
+        return _text(value)
+    if isinstance(value, (datetime.date, Decimal, int, float)):
+        return value
+    return _text(str(value))
+
+
+def _export_scope(request, params):
+    """Клиники пользователя + фильтры clinic_id / branch_id / date_from / date_to → (scope, ошибка)"""
+    user = get_user_from_token(request)
+    if not user:
+        return None, {"response": {"error": "Токен обязателен"}, "status": 401}
+
+    if user.role == CustomUser.Roles.SYSTEM_ADMIN:
+        clinics = Clinic.objects.all()
+    elif user.role == CustomUser.Roles.CLINIC_DIRECTOR:
+        clinics = Clinic.objects.filter(director_profile_link__user=user)
+    else:
+        return None, {"response": {"error": "Только для директоров"}, "status": 403}
+
+    clinic_id = params.get("clinic_id")
+    if clinic_id:
+        clinics = clinics.filter(id=clinic_id)
+
+    dates = {}
+    for key in ("date_from", "date_to"):
+        value = params.get(key)
+        if value:
+            try:
+                dates[key] = parse_date(value)
+            except (TypeError, ValueError):
+                dates[key] = None
+            if dates[key] is None:
+                return None, {"response": {"error": f"{key}: ожидается дата YYYY-MM-DD"}, "status": 400}
+
+    export_format = params.get("format", "csv")
+    if export_format not in ("csv", "xlsx"):
+        return None, {"response": {"error": "format: csv или xlsx"}, "status": 400}
+
+    return {
+        "clinics": clinics,
+        "branch_id": params.get("branch_id"),
+        "date_from": dates.get("date_from"),
+        "date_to": dates.get("date_to"),
+        "format": export_format,
+    }, None
+
+
+def _date_range(queryset, field, scope):
+    """Фильтр по дате (date_to включительно) в часовом поясе проекта"""
+    if scope["date_from"]:
+        start = timezone.make_aware(datetime.datetime.combine(scope["date_from"], datetime.time.min))
+        queryset = queryset.filter(**{f"{field}__gte": start})
+    if scope["date_to"]:
+        end = timezone.make_aware(datetime.datetime.combine(scope["date_to"] + datetime.timedelta(days=1), datetime.time.min))
+        queryset = queryset.filter(**{f"{field}__lt": end})
+    return queryset
+
+
+def _export(queryset, columns, filename, export_format, archived=None):
+    """Потоковый экспорт: columns — [(заголовок, путь values_list)]; строки идут из .iterator().
+
+    archived — строки архива в том же порядке по первой колонке (дате); сливаются с рабочими на лету.
+    """
+    header = [title for title, _ in columns]
+    rows = queryset.values_list(*[path for _, path in columns]).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    if archived is not None:
+        rows = heapq.merge(archived, rows, key=lambda row: row[0])
+    stamp = timezone.localdate().isoformat()
+
+    if export_format == "xlsx":
+        return _xlsx_response(header, rows, f"{filename}-{stamp}.xlsx", filename)
+    return _csv_response(header, rows, f"{filename}-{stamp}.csv")
+
+
+def _csv_response(header, rows, filename):
+    writer = csv.writer(Echo())
+
+    def content():
+        # BOM — чтобы Excel открыл UTF-8 с кириллицей
+        yield "\ufeff" + writer.writerow(header)
+        chunk = []
+        for row in rows:
+            chunk.append(writer.writerow([_cell(value) for value in row]))
+            if len(chunk) >= CSV_ROWS_PER_CHUNK:
+                yield "".join(chunk)
+                chunk = []
+        if chunk:
+            yield "".join(chunk)
+
+    response = StreamingHttpResponse(content(), content_type="text/csv; charset=utf-8")
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
+
+
+def _xlsx_response(header, rows, filename, title):
+    # write_only: строки сразу уходят во временный файл, в памяти только текущая
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title=title)
+    sheet.append(header)
+    for row in rows:
+        sheet.append([_cell(value) for value in row])
+
+    output = tempfile.TemporaryFile()
+    workbook.save(output)
+    output.seek(0)
+    return FileResponse(output, as_attachment=True, filename=filename, content_type=XLSX_CONTENT_TYPE)
+
+
+# Колонки архива для выгрузок; остальное — из payload (подписи на момент переноса)
+ARCHIVED_COLUMNS = ("occurred_at", "status", "amount", "method", "clinic__name", "patient__full_name", "patient__card_number", "payload")
+
+
+def _archived(scope, kind, branch_id=None, status=None):
+    """Строки архива для выгрузки по дате или None, если период архив не задевает"""
+    records = archive.exported(scope["clinics"], kind, scope["date_from"])
+    if records is None:
+        return None
+    if branch_id:
+        records = records.filter(branch_id=branch_id)
+    if status:
+        records = records.filter(status=status)
+    records = _date_range(records, "occurred_at", scope).order_by("occurred_at")
+    return records.values_list(*ARCHIVED_COLUMNS).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+def _datetime(value):
+    return parse_datetime(value) if value else None
+
+
+def _archived_appointments(rows):
+    for start, status, amount, _, clinic, patient, card, payload in rows:
+        data = archive.unpack(payload)
+        yield (
+            start, _datetime(data.get("end_time")), status, clinic, data.get("branch_name"), data.get("doctor_name"),
+            patient, card, data.get("service_name"), amount,
+        )
+
+
+def _archived_payments(rows):
+    for paid_at, status, amount, method, clinic, patient, card, payload in rows:
+        data = archive.unpack(payload)
+        yield (
+            paid_at, amount, method, status, data.get("transaction_id"), clinic, patient, card,
+            _datetime(data.get("appointment_start")), data.get("branch_name"),
+        )
+
+
+def export_patients(request, params):
+    scope, error = _export_scope(request, params)
+    if error:
+        return error
+
+    patients = Patient.objects.filter(clinic__in=scope["clinics"])
+    if scope["branch_id"]:
+        patients = patients.filter(primary_branch_id=scope["branch_id"])
+    patients = _date_range(patients, "created_at", scope).order_by("created_at")
+
+    columns = [
+        ("Номер карты", "card_number"),
+        ("ФИО", "full_name"),
+        ("Телефон", "phone"),
+        ("Email", "email"),
+        ("Дата рождения", "birth_date"),
+        ("Пол", "gender"),
+        ("Клиника", "clinic__name"),
+        ("Филиал", "primary_branch__name"),
+        ("Статус", "status"),
+        ("Визитов", "total_visits"),
+        ("Оплачено", "total_spent"),
+        ("Долг", "debt"),
+        ("Зарегистрирован", "created_at"),
+        ("Последний визит", "last_visit"),
+    ]
+    return _export(patients, columns, "patients", scope["format"])
+
+
+def export_appointments(request, params):
+    scope, error = _export_scope(request, params)
+    if error:
+        return error
+
+    appointments = Appointment.objects.filter(clinic__in=scope["clinics"])
+    if scope["branch_id"]:
+        appointments = appointments.filter(branch_id=scope["branch_id"])
+    status = params.get("status")
+    if status:
+        appointments = appointments.filter(status=status)
+    appointments = _date_range(appointments, "start_time", scope).order_by("start_time")
+
+    columns = [
+        ("Начало", "start_time"),
+        ("Конец", "end_time"),
+        ("Статус", "status"),
+        ("Клиника", "clinic__name"),
+        ("Филиал", "branch__name"),
+        ("Врач", "doctor__full_name"),
+        ("Пациент", "patient__full_name"),
+        ("Номер карты", "patient__card_number"),
+        ("Услуга", "service__name"),
+        ("Оплачено", "price_paid"),
+    ]
+    archived = _archived(scope, ArchivedRecord.Kind.APPOINTMENT, scope["branch_id"], status)
+    if archived is not None:
+        archived = _archived_appointments(archived)
+    return _export(appointments, columns, "appointments", scope["format"], archived)
+
+
+def export_payments(request, params):
+    scope, error = _export_scope(request, params)
+    if error:
+        return error
+
+    payments = Payment.objects.filter(clinic__in=scope["clinics"])
+    if scope["branch_id"]:
+        payments = payments.filter(appointment__branch_id=scope["branch_id"])
+    payments = _date_range(payments, "paid_at", scope).order_by("paid_at")
+
+    columns = [
+        ("Дата оплаты", "paid_at"),
+        ("Сумма", "amount"),
+        ("Способ", "method"),
+        ("Статус", "status"),
+        ("Транзакция", "transaction_id"),
+        ("Клиника", "clinic__name"),
+        ("Пациент", "patient__full_name"),
+        ("Номер карты", "patient__card_number"),
+        ("Приём", "appointment__start_time"),
+        ("Филиал", "appointment__branch__name"),
+    ]
+    archived = _archived(scope, ArchivedRecord.Kind.PAYMENT, scope["branch_id"])
+    if archived is not None:
+        archived = _archived_payments(archived)
+    return _export(payments, columns, "payments", scope["format"], archived)
@@ -0,0 +1,231 @@
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from core.models import CustomUser, Branch, ServiceCategory, Patient, Payment, DailyMetrics, ArchivedRecord
+from helper import archive
+from helper.cache import cached_method
+from helper.rollups import METHOD_FIELDS, day_range
+from helper.routing import reporting
+from .dashboard import _report_clinic, _report_period
+from .utils import get_user_from_token
+
+# Разрезы-сущности: (dimension строк DailyMetrics, модель и поле подписи, поле оплаты для живого запроса)
+FINANCE_ENTITIES = {
+    "branch": (DailyMetrics.Dimension.BRANCH, Branch, "name", "appointment__branch_id"),
+    "doctor": (DailyMetrics.Dimension.DOCTOR, CustomUser, "full_name", "appointment__doctor_id"),
+    "category": (DailyMetrics.Dimension.CATEGORY, ServiceCategory, "name", "appointment__service__category_id"),
+}
+FINANCE_DIMENSIONS = ("method", "day", *FINANCE_ENTITIES)
+FINANCE_SECTIONS = (*FINANCE_DIMENSIONS, "aging")
+
+PAYMENT_METHODS = dict(Payment._meta.get_field("method").choices)
+
+# Возраст долга — дни с последнего визита (нет визитов — с регистрации): (подпись, верхняя граница в днях)
+AGING_BUCKETS = (("0-30", 30), ("31-60", 60), ("61-90", 90), ("90+", None))
+
+
+def _clinic_cells(clinic_rows, first, second=None):
+    """{(ключ first, ключ second): выручка} по строкам клиники; разрезы — method, day или None"""
+    fields = METHOD_FIELDS.items() if "method" in (first, second) else [(None, "revenue")]
+    cells = defaultdict(Decimal)
+    for row in clinic_rows:
+        for method, field in fields:
+            keys = {"method": method, "day": row["date"], None: None}
+            cells[(keys[first], keys[second])] += row[field]
+    return cells
+
+
+def _entity_cells(rows, clinic_rows, entity, other=None):
+    """{(ключ сущности, ключ other): выручка} из строк разреза сущности; other — method, day или None.
+
+    Оплаты без приёма в разрезы сущностей не попадают — их сумма (ключ None) — разница с итогами клиники.
+    """
+    queryset = rows.filter(dimension=FINANCE_ENTITIES[entity][0])
+    cells = defaultdict(Decimal)
+    if other == "day":
+        for key, date, revenue in queryset.values_list("key", "date", "revenue"):
+            cells[(key, date)] += revenue
+    else:
+        fields = METHOD_FIELDS if other == "method" else {None: "revenue"}
+        grouped = queryset.values("key").annotate(**{f"total_{field}": Sum(field) for field in fields.values()}).order_by()
+        for row in grouped:
+            for other_key, field in fields.items():
+                cells[(row["key"], other_key)] += row[f"total_{field}"] or 0
+
+    assigned = defaultdict(Decimal)
+    for (_, other_key), total in cells.items():
+        assigned[other_key] += total
+    for (other_key, _), total in _clinic_cells(clinic_rows, other).items():
+        if total != assigned[other_key]:
+            cells[(None, other_key)] += total - assigned[other_key]
+    return cells
+
+
+def _live_cells(payments, archived, first, second):
+    """Две сущности (филиал × категория…) в сводке не пересекаются — один GROUP BY по оплатам.
+
+    Оплаты периода, перенесённые в архив, — вторым GROUP BY по ArchivedRecord (колонки branch_id, doctor_id, category_id).
+    """
+    first_field, second_field = FINANCE_ENTITIES[first][3], FINANCE_ENTITIES[second][3]
+    grouped = payments.values(first_field, second_field).annotate(total=Sum("amount")).order_by()
+    cells = defaultdict(Decimal, {(row[first_field], row[second_field]): row["total"] for row in grouped})
+    if archived is not None:
+        first_field, second_field = f"{first}_id", f"{second}_id"
+        for row in archived.values(first_field, second_field).annotate(total=Sum("amount")).order_by():
+            cells[(row[first_field], row[second_field])] += row["total"]
+    return cells
+
+
+def _cells(rows, clinic_rows, payments, first, second=None, archived=None):
+    if first not in FINANCE_ENTITIES and second not in FINANCE_ENTITIES:
+        return _clinic_cells(clinic_rows, first, second)
+    if second in FINANCE_ENTITIES and first in FINANCE_ENTITIES:
+        return _live_cells(payments, archived, first, second)
+    if first in FINANCE_ENTITIES:
+        return _entity_cells(rows, clinic_rows, first, second)
+    return {(b, a): total for (a, b), total in _entity_cells(rows, clinic_rows, second, first).items()}
+
+
+def _labels(dimension, keys):
+    """Подписи ключей разреза: имена — одним запросом, оплаты без приёма — «Без приёма»"""
+    if dimension == "method":
+        labels = {key: PAYMENT_METHODS.get(key, key) for key in keys}
+    elif dimension == "day":
+        labels = {key: key.isoformat() for key in keys if key is not None}
+    else:
+        _, model, field, _ = FINANCE_ENTITIES[dimension]
+        labels = dict(model.objects.filter(id__in=[key for key in keys if key is not None]).values_list("id", field))
+    labels.setdefault(None, "Без приёма")
+    return labels
+
+
+def _item(key, labels):
+    return {"id": key, "name": labels.get(key, "")}
+
+
+def _section(cells, dimension, revenue):
+    totals = {key: total for (key, _), total in cells.items() if total}
+    keys = sorted(totals, key=lambda key: (key is None, key)) if dimension == "day" else sorted(totals, key=totals.get, reverse=True)
+    labels = _labels(dimension, keys)
+    return [
+        {**_item(key, labels), "total": totals[key], "share": round(float(totals[key] / revenue * 100), 2) if revenue else 0}
+        for key in keys
+    ]
+
+
+def _pivot(cells, rows_dimension, columns_dimension):
+    """Перекрёстная таблица: суммы ячеек уже сгруппированы, раскладка в матрицу — в памяти"""
+    cells = {key: total for key, total in cells.items() if total}
+    order = lambda key: (key is None, str(key))
+    row_keys = sorted({row for row, _ in cells}, key=order)
+    column_keys = sorted({column for _, column in cells}, key=order)
+    matrix = [[cells.get((row, column), Decimal(0)) for column in column_keys] for row in row_keys]
+
+    row_labels = _labels(rows_dimension, row_keys)
+    column_labels = _labels(columns_dimension, column_keys)
+    return {
+        "rows_dimension": rows_dimension,
+        "columns_dimension": columns_dimension,
+        "rows": [_item(key, row_labels) for key in row_keys],
+        "columns": [_item(key, column_labels) for key in column_keys],
+        "values": matrix,
+        "row_totals": [sum(row, Decimal(0)) for row in matrix],
+        "column_totals": [sum(column, Decimal(0)) for column in zip(*matrix)],
+    }
+
+
+def _aging(clinic):
+    """Долги пациентов по возрасту — один агрегирующий запрос с фильтрами по корзинам"""
+    now = timezone.now()
+    debtors = Patient.objects.filter(clinic=clinic, debt__gt=0).annotate(since=Coalesce("last_visit", "created_at"))
+
+    aggregates, lower = {}, None
+    for i, (_, upper) in enumerate(AGING_BUCKETS):
+        condition = Q()
+        if lower is not None:
+            condition &= Q(since__lte=now - datetime.timedelta(days=lower + 1))
+        if upper is not None:
+            condition &= Q(since__gt=now - datetime.timedelta(days=upper + 1))
+        aggregates[f"count_{i}"] = Count("id", filter=condition)
+        aggregates[f"debt_{i}"] = Sum("debt", filter=condition)
+        lower = upper
+    totals = debtors.aggregate(**aggregates)
+
+    buckets = [
+        {"name": name, "patients": totals[f"count_{i}"], "debt": totals[f"debt_{i}"] or Decimal(0)}
+        for i, (name, _) in enumerate(AGING_BUCKETS)
+    ]
+    return {
+        "as_of": now,
+        "patients": sum(bucket["patients"] for bucket in buckets),
+        "debt": sum((bucket["debt"] for bucket in buckets), Decimal(0)),
+        "buckets": buckets,
+    }
+
+
+@cached_method(DailyMetrics, Patient, Branch, ServiceCategory, CustomUser, ArchivedRecord)
+@reporting
+def finance_report(request, params):
+    """Финансовый отчёт клиники за период: выручка по способу оплаты, филиалу, врачу, категории услуг и дням,
+    возраст долгов пациентов и перекрёстная таблица двух разрезов.
+
+    Выручка — из суточных сводок DailyMetrics (не больше строки на день и ключ разреза); только таблица
+    двух сущностей (например, филиал × категория) считается по оплатам.
+    params: clinic_id, date_from / date_to (YYYY-MM-DD), sections (по умолчанию все: method, day, branch,
+    doctor, category, aging), pivot — {"rows": разрез, "columns": разрез}.
+    """
+    user = get_user_from_token(request)
+    if not user: return {"response": {"error": "401"}, "status": 401}
+
+    clinic, error = _report_clinic(user, params.get("clinic_id"))
+    if error:
+        return error
+    (date_from, date_to), error = _report_period(params)
+    if error:
+        return error
+
+    sections = params.get("sections") or FINANCE_SECTIONS
+    if isinstance(sections, str):
+        sections = [name.strip() for name in sections.split(",") if name.strip()]
+    unknown = [name for name in sections if name not in FINANCE_SECTIONS]
+    if unknown:
+        return {"response": {"error": f"sections: неизвестно {', '.join(unknown)}; доступно {', '.join(FINANCE_SECTIONS)}"}, "status": 400}
+
+    pivot = params.get("pivot")
+    if pivot and (
+        not isinstance(pivot, dict) or pivot.get("rows") not in FINANCE_DIMENSIONS
+        or pivot.get("columns") not in FINANCE_DIMENSIONS or pivot["rows"] == pivot["columns"]
+    ):
+        return {"response": {"error": f"pivot: rows и columns — разные из {', '.join(FINANCE_DIMENSIONS)}"}, "status": 400}
+
+    rows = DailyMetrics.objects.filter(clinic=clinic, date__gte=date_from, date__lte=date_to)
+    clinic_rows = list(
+        rows.filter(dimension=DailyMetrics.Dimension.CLINIC, key=clinic.id)
+        .values("date", "revenue", "payments", *METHOD_FIELDS.values())
+    )
+    start, end = day_range(date_from, date_to)
+    payments = Payment.objects.filter(clinic=clinic, status="success", paid_at__gte=start, paid_at__lt=end)
+    archived = archive.successful_payments(clinic, start, end)
+
+    revenue = sum((row["revenue"] for row in clinic_rows), Decimal(0))
+    count = sum(row["payments"] for row in clinic_rows)
+    data = {
+        "clinic": {"id": clinic.id, "name": clinic.name},
+        "date_from": date_from,
+        "date_to": date_to,
+        "totals": {"revenue": revenue, "payments": count, "average": round(revenue / count, 2) if count else Decimal(0)},
+    }
+    for name in sections:
+        if name in FINANCE_DIMENSIONS:
+            data[f"by_{name}"] = _section(_cells(rows, clinic_rows, payments, name), name, revenue)
+    if "aging" in sections:
+        data["aging"] = _aging(clinic)
+    if pivot:
+        cells = _cells(rows, clinic_rows, payments, pivot["rows"], pivot["columns"], archived)
+        data["pivot"] = _pivot(cells, pivot["rows"], pivot["columns"])
+
+    return {"response": data, "status": 200}
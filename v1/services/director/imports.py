@@ -0,0 +1,331 @@
+import csv
+import io
+import json
+from datetime import datetime
+
+import phonenumbers
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import IntegrityError, transaction
+from django.db.models import CharField
+from django.db.models.functions import Cast
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from phonenumber_field.phonenumber import PhoneNumber
+from core.models import CustomUser, Clinic, Patient
+from helper.cache import bump
+from helper.rollups import mark
+from .utils import get_user_from_token
+
+# Строк в одном bulk_create и значений в одном запросе проверки дублей
+IMPORT_CHUNK_SIZE = 2000
+DEDUPE_CHUNK_SIZE = 500
+
+# Сколько строк с ошибками вернуть в ответе API (команда пишет все)
+IMPORT_MAX_ERRORS = 1000
+
+# Значения флага dry_run в params (JSON или multipart-строка)
+DRY_RUN_VALUES = {
+    True: True, False: False, None: False, 1: True, 0: False,
+    "true": True, "True": True, "1": True, "false": False, "False": False, "0": False, "": False,
+}
+
+IMPORT_FIELDS = (
+    "full_name", "phone", "email", "birth_date", "gender", "address", "card_number",
+    "blood_type", "allergies", "chronic_diseases", "notes", "status", "branch",
+)
+
+# Заголовки export.patients и распространённые варианты → поля пациента
+COLUMN_ALIASES = {
+    "номер карты": "card_number",
+    "фио": "full_name",
+    "телефон": "phone",
+    "дата рождения": "birth_date",
+    "пол": "gender",
+    "адрес": "address",
+    "статус": "status",
+    "филиал": "branch",
+    "branch_id": "branch",
+    "примечания": "notes",
+}
+
+GENDERS = {
+    "male": "male", "m": "male", "м": "male", "муж": "male", "мужской": "male",
+    "female": "female", "f": "female", "ж": "female", "жен": "female", "женский": "female",
+}
+
+DATE_FORMATS = ("%d.%m.%Y", "%d/%m/%Y")
+
+
+class PatientImportError(ValueError):
+    """Импорт целиком невозможен: формат файла, лимиты тарифа, конфликт при вставке"""
+
+
+def read_rows(lines, file_format):
+    """Строки CSV/JSONL → [(номер строки, dict или None, ошибка)]"""
+    rows = []
+    if file_format == "csv":
+        reader = csv.DictReader(lines)
+        if not reader.fieldnames:
+            raise PatientImportError("Пустой файл")
+        for row in reader:
+            rows.append((reader.line_num, row, None))
+    elif file_format == "jsonl":
+        for number, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                rows.append((number, None, "Некорректный JSON"))
+                continue
+            rows.append((number, row, None) if isinstance(row, dict) else (number, None, "Ожидается JSON-объект"))
+    else:
+        raise PatientImportError("format: csv или jsonl")
+    return rows
+
+
+def _clean(row):
+    """Ключи → поля пациента (регистр, BOM, алиасы), значения → строки без пробелов по краям"""
+    cleaned = {}
+    for key, value in row.items():
+        if key is None:
+            continue
+        key = key.lstrip("\ufeff").strip().lower()
+        key = COLUMN_ALIASES.get(key, key)
+        if key in IMPORT_FIELDS:
+            cleaned[key] = "" if value is None else str(value).strip()
+    return cleaned
+
+
+def normalize_phones(values, region):
+    """Один проход по колонке: каждый уникальный номер разбирается один раз → PhoneNumber или None.
+
+    Дальше в модель и в фильтры идут готовые PhoneNumber — PhoneNumberField не разбирает их повторно.
+    """
+    parsed = {}
+    for raw in set(values):
+        try:
+            number = PhoneNumber.from_string(raw, region)
+        except phonenumbers.NumberParseException:
+            number = None
+        parsed[raw] = number if number is not None and number.is_valid() else None
+    return [parsed[raw] for raw in values]
+
+
+def _birth_date(value):
+    try:
+        date = parse_date(value)
+    except ValueError:
+        date = None
+    if date:
+        return date
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format).date()
+        except ValueError:
+            pass
+    return None
+
+
+def _existing(queryset, field, values):
+    """Какие из values уже есть в БД (строками, как хранятся): по запросу на DEDUPE_CHUNK_SIZE значений"""
+    values = list(values)
+    # Cast — чтобы PhoneNumberField не разбирал каждое найденное значение заново
+    stored = Cast(field, output_field=CharField())
+    found = set()
+    for start in range(0, len(values), DEDUPE_CHUNK_SIZE):
+        chunk = values[start:start + DEDUPE_CHUNK_SIZE]
+        found.update(queryset.filter(**{f"{field}__in": chunk}).values_list(stored, flat=True))
+    return found
+
+
+def import_patients(clinic, rows, branch_id=None, dry_run=False, chunk_size=IMPORT_CHUNK_SIZE):
+    """Импорт пациентов в клинику.
+
+    rows — результат read_rows. Сначала проверяются все строки (телефоны — одним проходом,
+    дубли — пачками запросов), затем одна проверка лимитов и bulk_create чанками в одной транзакции.
+    Уже существующие в БД пациенты (номер карты или телефон в этой клинике) пропускаются,
+    поэтому повторный импорт того же файла безопасен.
+    """
+    branches = {}
+    for branch in clinic.branches.only("id", "name"):
+        branches[str(branch.id)] = branch.id
+        branches.setdefault(branch.name.strip().lower(), branch.id)
+    if branch_id and str(branch_id) not in branches:
+        raise PatientImportError("Филиал не найден в этой клинике")
+
+    errors, skipped = [], []
+    parsed = []
+    for number, row, error in rows:
+        if error:
+            errors.append({"row": number, "errors": [error]})
+        else:
+            parsed.append((number, _clean(row)))
+
+    region = getattr(settings, "PHONENUMBER_DEFAULT_REGION", None) or "UZ"
+    phones = normalize_phones([row.get("phone", "") for _, row in parsed], region)
+
+    statuses = set(Patient.Status.values)
+    valid = []
+    seen_cards, seen_phones = {}, {}
+    for (number, row), phone in zip(parsed, phones):
+        problems = []
+        if not row.get("full_name"):
+            problems.append("ФИО обязательно")
+        if not row.get("phone"):
+            problems.append("Телефон обязателен")
+        elif phone is None:
+            problems.append(f"Некорректный телефон: {row['phone']}")
+
+        birth_date = None
+        if row.get("birth_date"):
+            birth_date = _birth_date(row["birth_date"])
+            if birth_date is None:
+                problems.append(f"Некорректная дата рождения: {row['birth_date']}")
+
+        gender = ""
+        if row.get("gender"):
+            gender = GENDERS.get(row["gender"].lower())
+            if gender is None:
+                problems.append(f"Пол: male или female, получено {row['gender']}")
+
+        email = row.get("email", "")
+        if email:
+            try:
+                validate_email(email)
+            except ValidationError:
+                problems.append(f"Некорректный email: {email}")
+
+        status = row.get("status") or Patient.Status.ACTIVE
+        if status not in statuses:
+            problems.append(f"Статус: {', '.join(sorted(statuses))}")
+
+        row_branch = branch_id
+        if row.get("branch"):
+            row_branch = branches.get(row["branch"].lower())
+            if row_branch is None:
+                problems.append(f"Филиал не найден: {row['branch']}")
+
+        card_number = row.get("card_number") or None
+        if card_number and card_number in seen_cards:
+            problems.append(f"Номер карты повторяется (строка {seen_cards[card_number]})")
+        phone_key = phone.as_e164 if phone else None
+        if phone_key and phone_key in seen_phones:
+            problems.append(f"Телефон повторяется (строка {seen_phones[phone_key]})")
+
+        if problems:
+            errors.append({"row": number, "errors": problems})
+            continue
+        if card_number:
+            seen_cards[card_number] = number
+        seen_phones[phone_key] = number
+
+        valid.append((number, Patient(
+            clinic=clinic,
+            primary_branch_id=row_branch,
+            full_name=row["full_name"],
+            phone=phone,
+            email=email,
+            birth_date=birth_date,
+            gender=gender,
+            address=row.get("address", ""),
+            card_number=card_number,
+            blood_type=row.get("blood_type", ""),
+            allergies=row.get("allergies", ""),
+            chronic_diseases=row.get("chronic_diseases", ""),
+            notes=row.get("notes", ""),
+            status=status,
+        )))
+
+    # Дубли с БД: номер карты уникален глобально, телефон — в пределах клиники
+    taken_cards = _existing(Patient.objects.all(), "card_number", seen_cards)
+    taken_phones = _existing(Patient.objects.filter(clinic=clinic), "phone", [p.phone for _, p in valid])
+    patients = []
+    for number, patient in valid:
+        if patient.card_number in taken_cards:
+            skipped.append({"row": number, "reason": f"Номер карты уже есть: {patient.card_number}"})
+        elif patient.phone.as_e164 in taken_phones:
+            skipped.append({"row": number, "reason": f"Пациент с телефоном уже есть: {patient.phone}"})
+        else:
+            patients.append(patient)
+
+    limits = clinic.check_limits(patients=clinic.patients.count() + len(patients))
+    if not limits["ok"]:
+        raise PatientImportError(limits["error"])
+
+    if not dry_run and patients:
+        try:
+            with transaction.atomic():
+                for start in range(0, len(patients), chunk_size):
+                    Patient.objects.bulk_create(patients[start:start + chunk_size], batch_size=chunk_size)
+        except IntegrityError as e:
+            # Параллельная вставка того же номера карты — импорт откатывается целиком
+            raise PatientImportError(f"Конфликт при сохранении, импорт отменён: {e}")
+        # bulk_create не шлёт post_save — кэш списков (счётчики пациентов) и сводку дня обновляем сами
+        bump(Patient, clinic.id)
+        mark(clinic.id, [timezone.localdate()])
+
+    return {
+        "total": len(rows),
+        "created": 0 if dry_run else len(patients),
+        "valid": len(patients),
+        "skipped": len(skipped),
+        "failed": len(errors),
+        "dry_run": dry_run,
+        "errors": sorted(errors, key=lambda item: item["row"]),
+        "skipped_rows": skipped,
+    }
+
+
+def patient_import(request, params):
+    """Массовый импорт: content (CSV/JSONL-текст) + format или rows (список объектов)"""
+    user = get_user_from_token(request)
+    if not user:
+        return {"response": {"error": "Токен обязателен"}, "status": 401}
+
+    if user.role not in [CustomUser.Roles.CLINIC_DIRECTOR, CustomUser.Roles.SYSTEM_ADMIN]:
+        return {"response": {"error": "Нет прав"}, "status": 403}
+
+    clinic_id = params.get("clinic_id")
+    if user.role == CustomUser.Roles.CLINIC_DIRECTOR:
+        clinics = Clinic.objects.filter(director_profile_link__user=user)
+        clinic = clinics.filter(id=clinic_id).first() if clinic_id else clinics.first()
+    else:
+        if not clinic_id:
+            return {"response": {"error": "Админ должен указать clinic_id"}, "status": 400}
+        clinic = Clinic.objects.filter(id=clinic_id).first()
+    if not clinic:
+        return {"response": {"error": "Клиника не найдена"}, "status": 404}
+
+    # bool("false") — True: флаг разбираем явно
+    dry_run = params.get("dry_run", False)
+    if dry_run in DRY_RUN_VALUES:
+        dry_run = DRY_RUN_VALUES[dry_run]
+    else:
+        return {"response": {"error": "dry_run: true или false"}, "status": 400}
+
+    try:
+        if params.get("rows") is not None:
+            if not isinstance(params["rows"], list):
+                return {"response": {"error": "rows: ожидается список объектов"}, "status": 400}
+            rows = [
+                (number, row, None) if isinstance(row, dict) else (number, None, "Ожидается объект")
+                for number, row in enumerate(params["rows"], start=1)
+            ]
+        else:
+            content = params.get("content")
+            if not isinstance(content, str) or not content.strip():
+                return {"response": {"error": "Передайте content или rows"}, "status": 400}
+            # Файлом, а не splitlines(): в CSV поле в кавычках может занимать несколько строк
+            rows = read_rows(io.StringIO(content.lstrip("\ufeff"), newline=""), params.get("format", "csv"))
+
+        report = import_patients(clinic, rows, branch_id=params.get("branch_id"), dry_run=dry_run)
+    except PatientImportError as e:
+        return {"response": {"error": str(e)}, "status": 400}
+
+    report["errors_truncated"] = len(report["errors"]) > IMPORT_MAX_ERRORS
+    report["errors"] = report["errors"][:IMPORT_MAX_ERRORS]
+    report["skipped_rows"] = report["skipped_rows"][:IMPORT_MAX_ERRORS]
+    return {"response": report, "status": 201 if report["created"] else 200}
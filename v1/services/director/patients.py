@@ -1,10 +1,60 @@
-from datetime import timedelta
+import json
+from decimal import Decimal
+from django.conf import settings
+from django.urls import reverse
 from django.utils import timezone
 from django.db import transaction
-from django.db.models import Q
-from core.models import CustomUser, Clinic, ClinicDirectorProfile, Patient, MedicalRecord, PatientFile, Payment, Appointment, Branch
+from django.core.exceptions import ValidationError
+from django.db.models import Count, DateTimeField, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce, Substr
+from core.models import CustomUser, Clinic, ClinicDirectorProfile, Patient, MedicalRecord, PatientFile, Payment, Appointment
+from helper import archive, images
+from helper.files import content_name, digest
+from helper.listing import Field, ListingError, ListSpec, decode_cursor, encode_cursor, paginate, resolve_order
 from .utils import get_user_from_token
 
+def _last_doctor_name():
+    past_appts = Appointment.objects.filter(patient=OuterRef('pk'), start_time__lte=timezone.now()).order_by('-start_time')
+    return Subquery(past_appts.values('doctor__full_name')[:1])
+
+
+def _next_visit_date():
+    next_appts = Appointment.objects.filter(patient=OuterRef('pk'), start_time__gt=timezone.now()).order_by('start_time')
+    return Subquery(next_appts.values('start_time')[:1], output_field=DateTimeField())
+
+
+# Поля списка пациентов: последний (врач) и следующий визит — коррелированными подзапросами,
+# только если эти поля запрошены
+PATIENT_LIST = ListSpec(
+    fields={
+        "id": Field(lambda p: p.id),
+        "full_name": Field(lambda p: p.full_name, only=("full_name",)),
+        "contacts": Field(
+            lambda p: {"phone": str(p.phone) if p.phone else "", "email": p.email}, only=("phone", "email")
+        ),
+        "last_visit": Field(
+            lambda p: {"date": p.last_visit, "doctor": p.last_doctor_name},
+            only=("last_visit",), annotate={"last_doctor_name": _last_doctor_name},
+        ),
+        "next_visit": Field(lambda p: p.next_visit_date, annotate={"next_visit_date": _next_visit_date}),
+        "visits_count": Field(lambda p: p.total_visits, only=("total_visits",)),
+        "total_paid": Field(lambda p: p.total_spent, only=("total_spent",)),
+        "debt": Field(lambda p: p.debt, only=("debt",)),
+        "status": Field(lambda p: p.get_status_display(), only=("status",)),
+        "clinic_name": Field(lambda p: p.clinic.name, only=("clinic__name",), related=("clinic",)),
+    },
+    ordering={
+        "last_visit": "last_visit",
+        "created_at": "created_at",
+        "full_name": "full_name",
+        "visits_count": "total_visits",
+        "total_paid": "total_spent",
+        "debt": "debt",
+    },
+    default_order=("-last_visit", "-created_at"),
+)
+
+
 def patient_list(request, params):
     user = get_user_from_token(request)
     if not user:
@@ -23,7 +73,7 @@ def patient_list(request, params):
         clinics = Clinic.objects.filter(director_profile_link__user=user)
 
     # Базовый QuerySet
-    patients = Patient.objects.filter(clinic__in=clinics).select_related('clinic').prefetch_related('appointments__doctor')
+    patients = Patient.objects.filter(clinic__in=clinics)
 
     # === Фильтры ===
     
@@ -49,42 +99,13 @@ def patient_list(request, params):
     elif debt_filter == "no_debt":
         patients = patients.filter(debt=0)
 
-    # Сортировка
-    patients = patients.order_by('-last_visit', '-created_at')
-
-    # Формирование ответа
-    data = []
-    now = timezone.now()
-
-    for p in patients:
-        # Последний визит (Врач)
-        last_appt = p.appointments.filter(start_time__lte=now).order_by('-start_time').first()
-        last_doctor = last_appt.doctor.full_name if last_appt and last_appt.doctor else None
-        
-        # Следующий визит
-        next_appt = p.appointments.filter(start_time__gt=now).order_by('start_time').first()
-        next_visit_date = next_appt.start_time if next_appt else None
+    # Страница (cursor / page_size / order_by / fields)
+    try:
+        page = paginate(patients, params, PATIENT_LIST)
+    except ListingError as e:
+        return {"response": {"error": str(e)}, "status": 400}
 
-        data.append({
-            "id": str(p.id),
-            "full_name": p.full_name,
-            "contacts": {
-                "phone": str(p.phone) if p.phone else "",
-                "email": p.email
-            },
-            "last_visit": {
-                "date": p.last_visit,
-                "doctor": last_doctor
-            },
-            "next_visit": next_visit_date,
-            "visits_count": p.total_visits,
-            "total_paid": float(p.total_spent),
-            "debt": float(p.debt),
-            "status": p.get_status_display(),
-            "clinic_name": p.clinic.name
-        })
-
-    return {"response": {"patients": data, "count": len(data)}, "status": 200}
+    return {"response": {"patients": page.rows(), "count": page.total(), **page.meta()}, "status": 200}
 
 
 def patient_create(request, params):
@@ -287,7 +308,62 @@ def patient_update(request, params):
         return {"response": {"error": "Not found"}, "status": 404}
 
 
+# Символов текста записи в ленте истории; полный текст — medical_record_detail
+HISTORY_PREVIEW_CHARS = 160
+
+
+def _text_preview(name):
+    return Substr(name, 1, HISTORY_PREVIEW_CHARS + 1)
+
+
+def _preview(text):
+    """Начало текста для ленты: Substr отдаёт на символ больше лимита — так видно, что текст обрезан"""
+    if not text or len(text) <= HISTORY_PREVIEW_CHARS:
+        return text or ""
+    return text[:HISTORY_PREVIEW_CHARS].rstrip() + "…"
+
+
+# Лента истории: проекция записи без длинных текстов (.only) — из них только начало (Substr в SQL)
+PATIENT_HISTORY = ListSpec(
+    fields={
+        "id": Field(lambda r: str(r.id)),
+        "date": Field(lambda r: r.visit_date.strftime("%d.%m.%Y"), only=("visit_date",)),
+        "doctor_name": Field(
+            lambda r: r.doctor.full_name if r.doctor else "Неизвестно", only=("doctor__full_name",), related=("doctor",),
+        ),
+        "branch": Field(
+            lambda r: r.appointment.branch.name if r.appointment and r.appointment.branch else "Центральный",
+            only=("appointment__branch__name",), related=("appointment__branch",),
+        ),
+        "services": Field(
+            lambda r: r.appointment.service.name if r.appointment and r.appointment.service else "Консультация",
+            only=("appointment__service__name",), related=("appointment__service",),
+        ),
+        "diagnosis_code": Field(lambda r: r.diagnosis_icd10, only=("diagnosis_icd10",)),
+        "diagnosis": Field(
+            lambda r: _preview(r.diagnosis_preview) or r.diagnosis_icd10,
+            only=("diagnosis_icd10",), annotate={"diagnosis_preview": _text_preview("diagnosis_text")},
+        ),
+        "complaints": Field(lambda r: _preview(r.complaints_preview), annotate={"complaints_preview": _text_preview("complaints")}),
+        "prescriptions": Field(
+            lambda r: _preview(r.prescriptions_preview), annotate={"prescriptions_preview": _text_preview("prescriptions")},
+        ),
+        "cost": Field(
+            lambda r: float(r.appointment.price_paid) if r.appointment and r.appointment.price_paid else 0.0,
+            only=("appointment__price_paid",), related=("appointment",),
+        ),
+        "status": Field(
+            lambda r: "Оплачено" if r.appointment and r.appointment.price_paid else "Не оплачено",
+            only=("appointment__price_paid",), related=("appointment",),
+        ),
+    },
+    ordering={"date": "visit_date"},
+    default_order=("-date",),
+)
+
+
 def patient_history(request, params):
+    """Лента визитов пациента постранично (cursor + page_size, fields=); полная запись — medical_record_detail"""
     user = get_user_from_token(request)
     if not user: return {"response": {"error": "401"}, "status": 401}
     
@@ -299,24 +375,141 @@ def patient_history(request, params):
     except Patient.DoesNotExist:
         return {"response": {"error": "Not found"}, "status": 404}
 
-    records = MedicalRecord.objects.filter(patient=patient).select_related('doctor', 'appointment', 'appointment__branch', 'appointment__service').order_by('-visit_date')
-    
-    history = []
-    for r in records:
-        appt = r.appointment
-        history.append({
-            "id": str(r.id),
-            "date": r.visit_date.strftime("%d.%m.%Y"),
-            "doctor_name": r.doctor.full_name if r.doctor else "Неизвестно",
-            "branch": appt.branch.name if appt and appt.branch else "Центральный",
-            "services": appt.service.name if appt and appt.service else "Консультация",
-            "diagnosis": r.diagnosis_text or r.diagnosis_icd10,
-            "prescriptions": r.prescriptions,
-            "cost": float(appt.price_paid) if appt and appt.price_paid else 0.0,
-            "status": "Оплачено" if appt and appt.price_paid else "Не оплачено"
-        })
-        
-    return {"response": {"history": history}, "status": 200}
+    try:
+        page = paginate(MedicalRecord.objects.filter(patient=patient), params, PATIENT_HISTORY)
+        rows, meta = _with_archive(patient, page, params)
+    except ListingError as e:
+        return {"response": {"error": str(e)}, "status": 400}
+
+    return {"response": {"history": rows, "count": len(rows), **meta}, "status": 200}
+
+
+def _archived_history(record):
+    """Строка ленты из архивной записи — те же поля, что PATIENT_HISTORY"""
+    data = archive.unpack(record.payload)
+    paid = data["price_paid"] and float(data["price_paid"])
+    return {
+        "id": str(record.id),
+        "date": record.occurred_at.strftime("%d.%m.%Y"),
+        "doctor_name": data["doctor_name"] or "Неизвестно",
+        "branch": data["branch_name"] or "Центральный",
+        "services": data["service_name"] or "Консультация",
+        "diagnosis_code": data["diagnosis_icd10"],
+        "diagnosis": _preview(data["diagnosis_text"][:HISTORY_PREVIEW_CHARS + 1]) or data["diagnosis_icd10"],
+        "complaints": _preview(data["complaints"][:HISTORY_PREVIEW_CHARS + 1]),
+        "prescriptions": _preview(data["prescriptions"][:HISTORY_PREVIEW_CHARS + 1]),
+        "cost": paid or 0.0,
+        "status": "Оплачено" if paid else "Не оплачено",
+    }
+
+
+def _with_archive(patient, page, params):
+    """Страница ленты вместе с архивом: обе части упорядочены по (дате, id), страница — слияние.
+
+    Архив читается, только если у клиники он есть и страница может дойти до его границы:
+    в архиве только записи старше Clinic.archived_before.
+    """
+    horizon = patient.clinic.archived_before
+    keys = resolve_order(PATIENT_HISTORY, params)
+    desc = keys[0][2]
+    cursor = decode_cursor(params["cursor"], keys, MedicalRecord.objects.all()) if params.get("cursor") else None
+    if (
+        horizon is None
+        or (desc and page.has_more and page.objects[-1].visit_date >= horizon)
+        or (not desc and cursor and cursor[0] >= horizon)
+    ):
+        return page.rows(), page.meta()
+
+    merged = [((r.visit_date, r.pk), row) for r, row in zip(page.objects, page.rows())]
+    for record in archive.history(patient, desc, cursor, page.page_size + 1):
+        row = _archived_history(record)
+        merged.append(((record.occurred_at, record.pk), {name: row[name] for name in page.fields}))
+    # id — всегда по возрастанию, дата — по направлению сортировки
+    merged.sort(key=lambda item: item[0][1])
+    merged.sort(key=lambda item: item[0][0], reverse=desc)
+
+    has_more = page.has_more or len(merged) > page.page_size
+    merged = merged[:page.page_size]
+    next_cursor = encode_cursor(keys, list(merged[-1][0])) if has_more else None
+    return [row for _, row in merged], {"next_cursor": next_cursor, "has_more": has_more, "page_size": page.page_size}
+
+
+def medical_record_detail(request, params):
+    """Запись медкарты целиком: жалобы, анамнез, диагноз, назначения, рекомендации и файлы записи"""
+    user = get_user_from_token(request)
+    if not user: return {"response": {"error": "401"}, "status": 401}
+
+    record_id = params.get("record_id")
+    if not record_id: return {"response": {"error": "record_id обязателен"}, "status": 400}
+    try:
+        record = MedicalRecord.objects.select_related(
+            'patient', 'doctor', 'appointment', 'appointment__branch', 'appointment__service'
+        ).get(id=record_id)
+    except ValidationError:
+        return {"response": {"error": "Запись не найдена"}, "status": 404}
+    except MedicalRecord.DoesNotExist:
+        return _archived_record_detail(user, record_id)
+    if user.role != CustomUser.Roles.SYSTEM_ADMIN and not ClinicDirectorProfile.objects.filter(user=user, clinic_id=record.patient.clinic_id).exists():
+        return {"response": {"error": "Нет прав"}, "status": 403}
+
+    appt = record.appointment
+    files = PatientFile.objects.filter(medical_record=record).only(
+        'id', 'file', 'file_type', 'description', 'uploaded_at', 'size', 'content_type', 'sha256', 'has_preview'
+    ).order_by('-uploaded_at')
+    data = {
+        "id": str(record.id),
+        "patient_id": str(record.patient_id),
+        "patient_name": record.patient.full_name,
+        "date": record.visit_date.strftime("%d.%m.%Y"),
+        "visit_date": record.visit_date,
+        "doctor_name": record.doctor.full_name if record.doctor else "Неизвестно",
+        "branch": appt.branch.name if appt and appt.branch else "Центральный",
+        "services": appt.service.name if appt and appt.service else "Консультация",
+        "diagnosis_code": record.diagnosis_icd10,
+        "diagnosis": record.diagnosis_text,
+        "complaints": record.complaints,
+        "anamnesis": record.anamnesis,
+        "prescriptions": record.prescriptions,
+        "recommendations": record.recommendations,
+        "next_visit": record.next_visit,
+        "cost": float(appt.price_paid) if appt and appt.price_paid else 0.0,
+        "files": [_document(f) for f in files],
+    }
+    return {"response": data, "status": 200}
+
+
+def _archived_record_detail(user, record_id):
+    """medical_record_detail для записи, перенесённой в архив"""
+    record = archive.record(record_id)
+    if not record or not record.patient:
+        return {"response": {"error": "Запись не найдена"}, "status": 404}
+    if user.role != CustomUser.Roles.SYSTEM_ADMIN and not ClinicDirectorProfile.objects.filter(user=user, clinic_id=record.clinic_id).exists():
+        return {"response": {"error": "Нет прав"}, "status": 403}
+
+    data = archive.unpack(record.payload)
+    files = PatientFile.objects.filter(id__in=data["file_ids"], patient=record.patient).only(
+        'id', 'file', 'file_type', 'description', 'uploaded_at', 'size', 'content_type', 'sha256', 'has_preview'
+    ).order_by('-uploaded_at')
+    return {"response": {
+        "id": str(record.id),
+        "patient_id": str(record.patient_id),
+        "patient_name": record.patient.full_name,
+        "date": record.occurred_at.strftime("%d.%m.%Y"),
+        "visit_date": record.occurred_at,
+        "doctor_name": data["doctor_name"] or "Неизвестно",
+        "branch": data["branch_name"] or "Центральный",
+        "services": data["service_name"] or "Консультация",
+        "diagnosis_code": data["diagnosis_icd10"],
+        "diagnosis": data["diagnosis_text"],
+        "complaints": data["complaints"],
+        "anamnesis": data["anamnesis"],
+        "prescriptions": data["prescriptions"],
+        "recommendations": data["recommendations"],
+        "next_visit": data["next_visit"],
+        "cost": float(data["price_paid"]) if data["price_paid"] else 0.0,
+        "files": [_document(f) for f in files],
+        "archived": True,
+    }, "status": 200}
 
 
 def patient_documents(request, params):
@@ -331,21 +524,100 @@ def patient_documents(request, params):
     except Patient.DoesNotExist:
         return {"response": {"error": "Not found"}, "status": 404}
 
-    files = PatientFile.objects.filter(patient=patient).order_by('-uploaded_at')
-    data = []
-    for f in files:
-        data.append({
-            "id": str(f.id),
-            "name": f.description or f.get_file_type_display(),
-            "type": f.get_file_type_display(),
-            "date": f.uploaded_at.strftime("%d.%m.%Y"),
-            "size": f"{f.file.size / 1024:.1f} KB",
-            "url": f.file.url
-        })
-        
+    # Размер и тип — из колонок: хранилище (stat / сетевой запрос на файл) не трогаем
+    files = PatientFile.objects.filter(patient=patient).only(
+        'id', 'file', 'file_type', 'description', 'uploaded_at', 'size', 'content_type', 'sha256', 'has_preview'
+    ).order_by('-uploaded_at')
+    data = [_document(f) for f in files]
+
     return {"response": {"documents": data}, "status": 200}
 
 
+def _document(f):
+    url = reverse('patient_file', args=[f.id])
+    return {
+        "id": str(f.id),
+        "name": f.description or f.get_file_type_display(),
+        "type": f.get_file_type_display(),
+        "date": f.uploaded_at.strftime("%d.%m.%Y"),
+        "size": f"{f.size / 1024:.1f} KB" if f.size is not None else None,
+        "size_bytes": f.size,
+        "content_type": f.content_type,
+        # Файл и его копии — только через view с проверкой доступа, Range и ETag (core/views.py)
+        "url": url,
+        "download_url": url,
+        "thumbnail": f"{url}?variant=thumb" if f.has_preview else None,
+        "preview": f"{url}?variant=preview" if f.has_preview else None,
+    }
+
+
+def patient_file_upload(request, params):
+    """Загрузка файла пациента (multipart/form-data: method, params — JSON-строка, file).
+
+    Содержимое читается кусками: размер, тип и SHA-256 считаются по локальной копии загрузки,
+    в хранилище файл пишется потоком под именем из хэша. Тот же файл того же пациента — существующая
+    запись (duplicate: true); то же содержимое у другого пациента — новая запись на тот же объект хранилища.
+    params: patient_id, file_type, description, medical_record_id.
+    """
+    user = get_user_from_token(request)
+    if not user: return {"response": {"error": "401"}, "status": 401}
+
+    if isinstance(params, str):
+        try:
+            params = json.loads(params or "{}")
+        except ValueError:
+            params = None
+    if not isinstance(params, dict):
+        return {"response": {"error": "params: ожидается JSON-объект"}, "status": 400}
+
+    try:
+        patient = Patient.objects.select_related('clinic').get(id=params.get("patient_id"))
+    except (Patient.DoesNotExist, ValidationError):
+        return {"response": {"error": "Not found"}, "status": 404}
+    if user.role != CustomUser.Roles.SYSTEM_ADMIN and not ClinicDirectorProfile.objects.filter(user=user, clinic=patient.clinic).exists():
+        return {"response": {"error": "Нет прав"}, "status": 403}
+
+    upload = request.FILES.get("file")
+    if upload is None:
+        return {"response": {"error": "Файл обязателен (поле file)"}, "status": 400}
+    limit = getattr(settings, "API_UPLOAD_MAX_BYTES", None)
+    if limit and upload.size > limit:
+        return {"response": {"error": f"Файл больше {limit // (1024 * 1024)} МБ"}, "status": 413}
+    file_type = params.get("file_type") or PatientFile.FileType.OTHER
+    if file_type not in PatientFile.FileType.values:
+        return {"response": {"error": f"file_type: {', '.join(PatientFile.FileType.values)}"}, "status": 400}
+    record = None
+    if params.get("medical_record_id"):
+        try:
+            record = MedicalRecord.objects.only('id').get(id=params["medical_record_id"], patient=patient)
+        except (MedicalRecord.DoesNotExist, ValidationError):
+            return {"response": {"error": "Запись медкарты не найдена"}, "status": 404}
+
+    sha256, size, content_type = digest(upload)
+    existing = PatientFile.objects.filter(patient=patient, sha256=sha256).first()
+    if existing:
+        return {"response": {**_document(existing), "sha256": sha256, "duplicate": True}, "status": 200}
+
+    # Такое содержимое уже в хранилище (у другого пациента) — второй раз не пишем
+    stored, has_preview = PatientFile.objects.filter(sha256=sha256).exclude(file="").values_list(
+        'file', 'has_preview'
+    ).first() or (None, False)
+    if not stored:
+        storage = PatientFile._meta.get_field('file').storage
+        stored = content_name(sha256, upload.name)
+        if not storage.exists(stored):
+            stored = storage.save(stored, upload, max_length=100)
+
+    document = PatientFile.objects.create(
+        patient=patient, medical_record=record, file=stored, file_type=file_type,
+        description=str(params.get("description") or "")[:500], uploaded_by=user,
+        size=size, content_type=content_type, sha256=sha256,
+        # Копии снимка по этому хэшу уже построены — общие для всех строк
+        has_preview=has_preview and file_type in images.PATIENT_IMAGE_TYPES,
+    )
+    return {"response": {**_document(document), "sha256": sha256, "duplicate": False}, "status": 201}
+
+
 def patient_finance(request, params):
     user = get_user_from_token(request)
     if not user: return {"response": {"error": "401"}, "status": 401}
@@ -362,21 +634,38 @@ def patient_finance(request, params):
     
     history = []
     for p in payments:
-        history.append({
+        history.append((p.paid_at, {
             "id": str(p.id),
             "date": p.paid_at.strftime("%d.%m.%Y"),
             "amount": float(p.amount),
             "method": p.get_method_display(),
             "status": "Оплачено" if p.status == 'success' else "Ошибка"
-        })
+        }))
+    summary = {
+        "total_paid": float(patient.total_spent),
+        "debt": float(patient.debt)
+    }
+    # Оплаты старше границы архива — из архива; у клиники без архива его не читаем.
+    # Итоги архива — одним агрегатом в SQL, в ленту — не больше API_MAX_PAGE_SIZE последних, без payload
+    if patient.clinic.archived_before:
+        archived = archive.payments(patient)
+        summary["archived"] = archived.aggregate(payments=Count('id'), total=Coalesce(Sum('amount'), Decimal(0)))
+        methods = dict(Payment._meta.get_field('method').choices)
+        rows = archived.values_list('id', 'occurred_at', 'amount', 'method', 'status')[:settings.API_MAX_PAGE_SIZE]
+        for pk, occurred_at, amount, method, status in rows:
+            history.append((occurred_at, {
+                "id": str(pk),
+                "date": occurred_at.strftime("%d.%m.%Y"),
+                "amount": float(amount),
+                "method": methods.get(method, method),
+                "status": "Оплачено" if status == 'success' else "Ошибка"
+            }))
+        history.sort(key=lambda item: item[0], reverse=True)
 
     return {
         "response": {
-            "summary": {
-                "total_paid": float(patient.total_spent),
-                "debt": float(patient.debt)
-            },
-            "history": history
+            "summary": summary,
+            "history": [row for _, row in history]
         }, 
         "status": 200
     }
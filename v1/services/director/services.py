@@ -1,37 +1,47 @@
 from django.db import transaction
-from django.db.models import Q, Sum, Count
+from django.db.models import Q, Sum, Prefetch
 from django.utils import timezone
 from datetime import date
+from decimal import Decimal
 import uuid
 from core.models import (
     CustomUser, Clinic, Service, ServiceCategory, 
     ServicePackage, DiscountCategory, Promotion, 
     ClinicDirectorProfile
 )
+from helper.cache import cached_method
+from helper.listing import Field, ListingError, ListSpec, paginate
+from helper.queries import count_subquery
 from .utils import get_user_from_token
 
 # === КАТЕГОРИИ УСЛУГ ===
 
+CATEGORY_LIST = ListSpec(
+    fields={
+        "id": Field(lambda c: str(c.id)),
+        "name": Field(lambda c: str(c.name), only=("name",)),
+        "order": Field(lambda c: c.order or 0, only=("order",)),
+        "services_count": Field(
+            lambda c: c.service_count or 0, annotate={"service_count": count_subquery(Service.objects.all(), 'category')}
+        ),
+    },
+    ordering={"order": "order", "name": "name"},
+    default_order=("order",),
+)
+
+@cached_method(ServiceCategory, Service)
 def category_list(request, params):
     user = get_user_from_token(request)
     if not user: return {"response": {"error": "401"}, "status": 401}
     clinic = Clinic.objects.filter(director_profile_link__user=user).first()
     if not clinic: return {"response": {"error": "Нет доступа"}, "status": 403}
 
-    # Используем 'services', так как добавили related_name='services' в модели Service
-    categories = ServiceCategory.objects.filter(clinic=clinic).annotate(
-        service_count=Count('services')
-    ).order_by('order')
-    
-    data = []
-    for c in categories:
-        data.append({
-            "id": str(c.id),
-            "name": str(c.name),
-            "order": c.order or 0,
-            "services_count": c.service_count or 0
-        })
-    return {"response": {"categories": data}, "status": 200}
+    try:
+        page = paginate(ServiceCategory.objects.filter(clinic=clinic), params, CATEGORY_LIST)
+    except ListingError as e:
+        return {"response": {"error": str(e)}, "status": 400}
+
+    return {"response": {"categories": page.rows(), **page.meta()}, "status": 200}
 
 def category_create(request, params):
     user = get_user_from_token(request)
@@ -82,6 +92,29 @@ def category_delete(request, params):
 
 # === УСЛУГИ ===
 
+def _final_price(s):
+    return float(s.price) * (1 - s.discount_percent / 100)
+
+SERVICE_LIST = ListSpec(
+    fields={
+        "id": Field(lambda s: str(s.id)),
+        "name": Field(lambda s: s.name, only=("name",)),
+        "description": Field(lambda s: s.description, only=("description",)),
+        "category": Field(lambda s: {
+            "id": str(s.category.id) if s.category else None,
+            "name": s.category.name if s.category else "Без категории"
+        }, only=("category__name",), related=("category",)),
+        "price": Field(lambda s: float(s.price), only=("price",)),
+        "discount_percent": Field(lambda s: s.discount_percent, only=("discount_percent",)),
+        "final_price": Field(_final_price, only=("price", "discount_percent")),
+        "duration": Field(lambda s: s.duration_minutes, only=("duration_minutes",)),
+        "status": Field(lambda s: "Активна" if s.is_active else "Неактивна", only=("is_active",)),
+    },
+    ordering={"name": "name", "price": "price", "duration": "duration_minutes", "category": "category__name"},
+    default_order=("name",),
+)
+
+@cached_method(Service, ServiceCategory)
 def service_list(request, params):
     user = get_user_from_token(request)
     if not user: return {"response": {"error": "401"}, "status": 401}
@@ -94,7 +127,7 @@ def service_list(request, params):
         
     if not clinic: return {"response": {"error": "Нет прав"}, "status": 403}
 
-    services = Service.objects.filter(clinic=clinic).select_related('category')
+    services = Service.objects.filter(clinic=clinic)
 
     search = params.get("search", "").strip()
     if search:
@@ -108,28 +141,12 @@ def service_list(request, params):
     if status == "active": services = services.filter(is_active=True)
     elif status == "inactive": services = services.filter(is_active=False)
 
-    data = []
-    for s in services:
-        price = float(s.price)
-        discount = s.discount_percent
-        final_price = price * (1 - discount / 100)
-        
-        data.append({
-            "id": str(s.id),
-            "name": s.name,
-            "description": s.description,
-            "category": {
-                "id": str(s.category.id) if s.category else None,
-                "name": s.category.name if s.category else "Без категории"
-            },
-            "price": price,
-            "discount_percent": discount,
-            "final_price": final_price,
-            "duration": s.duration_minutes,
-            "status": "Активна" if s.is_active else "Неактивна"
-        })
+    try:
+        page = paginate(services, params, SERVICE_LIST)
+    except ListingError as e:
+        return {"response": {"error": str(e)}, "status": 400}
         
-    return {"response": {"services": data}, "status": 200}
+    return {"response": {"services": page.rows(), **page.meta()}, "status": 200}
 
 def service_create(request, params):
     user = get_user_from_token(request)
@@ -202,25 +219,36 @@ def service_delete(request, params):
 
 # === ПАКЕТЫ УСЛУГ ===
 
+PACKAGE_LIST = ListSpec(
+    fields={
+        "id": Field(lambda p: str(p.id)),
+        "name": Field(lambda p: p.name, only=("name",)),
+        "services": Field(
+            lambda p: [s.name for s in p.services.all()],
+            prefetch=(Prefetch('services', queryset=Service.objects.only('id', 'name')),),
+        ),
+        "price_full": Field(lambda p: float(p.total_price), only=("total_price",)),
+        "price_discounted": Field(lambda p: float(p.price), only=("price",)),
+        "discount_percent": Field(lambda p: p.discount_percent, only=("discount_percent",)),
+        "is_active": Field(lambda p: p.is_active, only=("is_active",)),
+    },
+    ordering={"created_at": "created_at", "name": "name", "price": "price"},
+    default_order=("-created_at",),
+)
+
+@cached_method(ServicePackage, Service)
 def package_list(request, params):
     user = get_user_from_token(request)
     if not user: return {"response": {"error": "401"}, "status": 401}
     clinic = Clinic.objects.filter(director_profile_link__user=user).first()
     if not clinic: return {"response": {"error": "Клиника не найдена"}, "status": 404}
 
-    packages = ServicePackage.objects.filter(clinic=clinic).order_by('-created_at')
-    data = []
-    for p in packages:
-        data.append({
-            "id": str(p.id),
-            "name": p.name,
-            "services": [s.name for s in p.services.all()],
-            "price_full": float(p.total_price),
-            "price_discounted": float(p.price),
-            "discount_percent": p.discount_percent,
-            "is_active": p.is_active
-        })
-    return {"response": {"packages": data}, "status": 200}
+    try:
+        page = paginate(ServicePackage.objects.filter(clinic=clinic), params, PACKAGE_LIST)
+    except ListingError as e:
+        return {"response": {"error": str(e)}, "status": 400}
+
+    return {"response": {"packages": page.rows(), **page.meta()}, "status": 200}
 
 def package_create(request, params):
     user = get_user_from_token(request)
@@ -233,8 +261,8 @@ def package_create(request, params):
     discount_percent = params.get("discount_percent", 0)
 
     services = Service.objects.filter(id__in=service_ids, clinic=clinic)
-    total_price = sum(s.price for s in services)
-    price_discounted = params.get("price_discounted") or (total_price * (1 - int(discount_percent)/100))
+    total_price = sum((s.price for s in services), Decimal(0))
+    price_discounted = params.get("price_discounted") or (total_price * (1 - Decimal(int(discount_percent)) / 100))
     
     with transaction.atomic():
         pkg = ServicePackage.objects.create(
@@ -248,6 +276,7 @@ def package_create(request, params):
 
 # === МАРКЕТИНГ (СКИДКИ И АКЦИИ) ===
 
+@cached_method(DiscountCategory, Promotion)
 def marketing_list(request, params):
     user = get_user_from_token(request)
     if not user: return {"response": {"error": "401"}, "status": 401}
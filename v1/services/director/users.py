@@ -1,12 +1,100 @@
+import heapq
+import uuid
+from itertools import islice
 from django.db import transaction
 from django.db.models import Q, Count
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from datetime import timedelta
 from core.models import CustomUser, Clinic, Branch, ClinicAdminProfile, DoctorProfile, ReceptionistProfile, ClinicDirectorProfile, Patient
+from helper.concurrency import run_parallel
+from helper.listing import ListingError, dump_cursor, get_page_size, load_cursor
 from .utils import get_user_from_token
 import random
 import string
 
+def _staff_row(u):
+    return {
+        "id": str(u.id),
+        "type": "staff",
+        "full_name": u.full_name,
+        "email": u.email,
+        "phone": str(u.phone) if u.phone else "",
+        "role": u.role,
+        "role_display": u.get_role_display(),
+        "branch": u.branch.name if u.branch else "Без филиала",
+        "branch_id": str(u.branch.id) if u.branch else None,
+        "clinic_name": u.clinic.name if u.clinic else "",
+        "status": "Активен" if u.is_active else "Заблокирован",
+        "is_active": u.is_active,
+        "date_registered": u.date_joined.strftime("%Y-%m-%d"),
+        "last_login": u.last_login.strftime("%Y-%m-%d %H:%M") if u.last_login else "Никогда"
+    }
+
+def _patient_row(p):
+    return {
+        "id": str(p.id),
+        "type": "patient",
+        "full_name": p.full_name,
+        "email": p.email,
+        "phone": str(p.phone) if p.phone else "",
+        "role": "patient",
+        "role_display": "Пациент",
+        "branch": p.primary_branch.name if p.primary_branch else "Без филиала",
+        "branch_id": str(p.primary_branch.id) if p.primary_branch else None,
+        "clinic_name": p.clinic.name if p.clinic else "",
+        "status": p.get_status_display(),
+        "is_active": p.status == 'active',
+        "date_registered": p.created_at.strftime("%Y-%m-%d"),
+        "last_login": p.last_visit.strftime("%Y-%m-%d %H:%M") if p.last_visit else "Нет визитов"
+    }
+
+# Источники общего списка: имя в cursor → (поле даты регистрации, колонки, связи, строка ответа)
+USER_SOURCES = {
+    "staff": (
+        "date_joined",
+        ("full_name", "email", "phone", "role", "is_active", "date_joined", "last_login", "branch__name", "clinic__name"),
+        ("branch", "clinic"),
+        _staff_row,
+    ),
+    "patients": (
+        "created_at",
+        ("full_name", "email", "phone", "status", "created_at", "last_visit", "primary_branch__name", "clinic__name"),
+        ("primary_branch", "clinic"),
+        _patient_row,
+    ),
+}
+
+def _load_positions(cursor):
+    """cursor → {источник: (дата, id) последней выданной строки или None}"""
+    positions = dict.fromkeys(USER_SOURCES)
+    if not cursor:
+        return positions
+    payload = load_cursor(cursor)
+    if not isinstance(payload, dict) or set(payload) - set(USER_SOURCES):
+        raise ListingError("Некорректный cursor")
+    for name, position in payload.items():
+        if position is None:
+            continue
+        try:
+            date, pk = position
+            positions[name] = (parse_datetime(date), uuid.UUID(pk))
+        except (TypeError, ValueError, AttributeError):
+            raise ListingError("Некорректный cursor")
+        if positions[name][0] is None:
+            raise ListingError("Некорректный cursor")
+    return positions
+
+def _source_stream(name, queryset, position, size):
+    """Не больше size + 1 строк источника после position, по убыванию (дата, id)"""
+    date_field, columns, related, _ = USER_SOURCES[name]
+    if position is not None:
+        date, pk = position
+        queryset = queryset.filter(Q(**{f"{date_field}__lt": date}) | Q(**{date_field: date, "id__lt": pk}))
+    rows = queryset.select_related(*related).only(*columns).order_by(f"-{date_field}", "-id")[:size + 1]
+    for obj in rows:
+        yield getattr(obj, date_field), obj.id, name, obj
+
 def user_list(request, params):
     user = get_user_from_token(request)
     if not user: return {"response": {"error": "401"}, "status": 401}
@@ -19,116 +107,100 @@ def user_list(request, params):
         if not clinics.exists():
              return {"response": {"error": "Доступ разрешен только директорам клиник"}, "status": 403}
 
-    # Базовый QuerySet для сотрудников
-    staff_qs = CustomUser.objects.filter(clinic__in=clinics).exclude(id=user.id).select_related('branch', 'clinic')
-    
-    # Базовый QuerySet для пациентов
-    patients_qs = Patient.objects.filter(clinic__in=clinics).select_related('primary_branch', 'clinic')
+    try:
+        size = get_page_size(params)
+        positions = _load_positions(params.get("cursor"))
+    except ListingError as e:
+        return {"response": {"error": str(e)}, "status": 400}
 
-    # Фильтры для статистики (до поиска)
-    total_staff = staff_qs.count()
-    active_staff = staff_qs.filter(is_active=True).count()
-    blocked_staff = staff_qs.filter(is_active=False).count()
-    
-    total_patients = patients_qs.count()
-    active_patients = patients_qs.filter(status='active').count()
-    blocked_patients = patients_qs.filter(status='inactive').count()
+    # Базовые QuerySet-ы сотрудников и пациентов (статистика считается по ним, до фильтров)
+    staff_base = CustomUser.objects.filter(clinic__in=clinics).exclude(id=user.id)
+    patients_base = Patient.objects.filter(clinic__in=clinics)
+
+    # Фильтры — условиями Q, чтобы «онлайн» посчитать в том же агрегате, что и статистику
+    staff_filter, patients_filter = Q(), Q()
+    with_staff, with_patients = True, True
 
-    # Фильтры
     search = params.get("search", "").strip()
     if search:
-        staff_qs = staff_qs.filter(
-            Q(full_name__icontains=search) |
-            Q(email__icontains=search) |
-            Q(phone__icontains=search)
-        )
-        patients_qs = patients_qs.filter(
-            Q(full_name__icontains=search) |
-            Q(email__icontains=search) |
-            Q(phone__icontains=search)
-        )
+        search_q = Q(full_name__icontains=search) | Q(email__icontains=search) | Q(phone__icontains=search)
+        staff_filter &= search_q
+        patients_filter &= search_q
 
     role_filter = params.get("role")
     if role_filter:
         if role_filter == "patient":
-            staff_qs = staff_qs.none()
+            with_staff = False
         else:
-            staff_qs = staff_qs.filter(role=role_filter)
-            patients_qs = patients_qs.none()
+            staff_filter &= Q(role=role_filter)
+            with_patients = False
 
     status_filter = params.get("status") # active / blocked
     if status_filter == "active":
-        staff_qs = staff_qs.filter(is_active=True)
-        patients_qs = patients_qs.filter(status='active')
+        staff_filter &= Q(is_active=True)
+        patients_filter &= Q(status='active')
     elif status_filter == "blocked":
-        staff_qs = staff_qs.filter(is_active=False)
-        patients_qs = patients_qs.filter(status__in=['inactive', 'archived'])
+        staff_filter &= Q(is_active=False)
+        patients_filter &= Q(status__in=['inactive', 'archived'])
 
     branch_id = params.get("branch_id")
     if branch_id:
-        staff_qs = staff_qs.filter(branch_id=branch_id)
-        patients_qs = patients_qs.filter(primary_branch_id=branch_id)
+        staff_filter &= Q(branch_id=branch_id)
+        patients_filter &= Q(primary_branch_id=branch_id)
 
-    # Online (только для персонала)
+    # Статистика: один условный агрегат на источник
     one_hour_ago = timezone.now() - timedelta(hours=1)
-    online_users = staff_qs.filter(last_login__gte=one_hour_ago).count()
+
+    def count_staff():
+        return staff_base.aggregate(
+            total=Count('id'),
+            active=Count('id', filter=Q(is_active=True)),
+            blocked=Count('id', filter=Q(is_active=False)),
+            online=Count('id', filter=staff_filter & Q(last_login__gte=one_hour_ago)),
+        )
+
+    def count_patients():
+        return patients_base.aggregate(
+            total=Count('id'),
+            active=Count('id', filter=Q(status='active')),
+            blocked=Count('id', filter=Q(status='inactive')),
+        )
+
+    # k-way merge двух отсортированных потоков по дате регистрации: в памяти не больше 2 * (size + 1) строк
+    sources = []
+    if with_staff:
+        sources.append(lambda: list(_source_stream("staff", staff_base.filter(staff_filter), positions["staff"], size)))
+    if with_patients:
+        sources.append(lambda: list(_source_stream("patients", patients_base.filter(patients_filter), positions["patients"], size)))
+
+    # Статистика и страницы источников независимы — запросы идут одновременно
+    staff_stats, patient_stats, *streams = run_parallel(count_staff, count_patients, *sources)
+    merged = heapq.merge(*streams, key=lambda item: item[:2], reverse=True)
 
     data = []
-    
-    # Собираем сотрудников
-    for u in staff_qs.order_by('-date_joined'):
-        data.append({
-            "id": str(u.id),
-            "type": "staff",
-            "full_name": u.full_name,
-            "email": u.email,
-            "phone": str(u.phone) if u.phone else "",
-            "role": u.role,
-            "role_display": u.get_role_display(),
-            "branch": u.branch.name if u.branch else "Без филиала",
-            "branch_id": str(u.branch.id) if u.branch else None,
-            "clinic_name": u.clinic.name if u.clinic else "",
-            "status": "Активен" if u.is_active else "Заблокирован",
-            "is_active": u.is_active,
-            "date_registered": u.date_joined.strftime("%Y-%m-%d"),
-            "last_login": u.last_login.strftime("%Y-%m-%d %H:%M") if u.last_login else "Никогда"
-        })
-        
-    # Собираем пациентов
-    for p in patients_qs.order_by('-created_at'):
-        data.append({
-            "id": str(p.id),
-            "type": "patient",
-            "full_name": p.full_name,
-            "email": p.email,
-            "phone": str(p.phone) if p.phone else "",
-            "role": "patient",
-            "role_display": "Пациент",
-            "branch": p.primary_branch.name if p.primary_branch else "Без филиала",
-            "branch_id": str(p.primary_branch.id) if p.primary_branch else None,
-            "clinic_name": p.clinic.name if p.clinic else "",
-            "status": p.get_status_display(),
-            "is_active": p.status == 'active',
-            "date_registered": p.created_at.strftime("%Y-%m-%d"),
-            "last_login": p.last_visit.strftime("%Y-%m-%d %H:%M") if p.last_visit else "Нет визитов"
-        })
+    for date, pk, name, obj in islice(merged, size):
+        data.append(USER_SOURCES[name][3](obj))
+        positions[name] = (date, pk)
+    has_more = next(merged, None) is not None
 
     return {
         "response": {
             "users": data,
             "stats": {
-                "total": total_staff + total_patients,
-                "staff": total_staff,
-                "patients": total_patients,
-                "active": active_staff + active_patients,
-                "blocked": blocked_staff + blocked_patients,
-                "online": online_users
-            }
+                "total": staff_stats["total"] + patient_stats["total"],
+                "staff": staff_stats["total"],
+                "patients": patient_stats["total"],
+                "active": staff_stats["active"] + patient_stats["active"],
+                "blocked": staff_stats["blocked"] + patient_stats["blocked"],
+                "online": staff_stats["online"] if with_staff else 0
+            },
+            "next_cursor": dump_cursor(positions) if has_more else None,
+            "has_more": has_more,
+            "page_size": size,
         },
         "status": 200
     }
 
-
 def user_create(request, params):
     user = get_user_from_token(request)
     if not user: return {"response": {"error": "401"}, "status": 401}
@@ -1,7 +1,9 @@
 import jwt
 from django.conf import settings
 from core.models import CustomUser
+from helper.auth import token_user_per_request
 
+@token_user_per_request
 def get_user_from_token(request):
     auth_header = request.headers.get("Authorization", "")
     if not auth_header.startswith("Bearer "):
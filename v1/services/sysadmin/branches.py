@@ -1,9 +1,49 @@
 from django.db import transaction
 from django.core.exceptions import ObjectDoesNotExist
-from django.db.models import Q, Count
-from core.models import Branch, Clinic, CustomUser, ClinicAdminProfile
+from django.db.models import Q, OuterRef, Subquery
+from core.models import Branch, Clinic, CustomUser, ClinicAdminProfile, Patient
+from helper.listing import Field, ListingError, ListSpec, paginate
+from helper.queries import count_subquery
 from .utils import get_user_from_token
 
+def _city(branch):
+    return branch.address.split(',')[-1].strip() if ',' in branch.address else "Не указан"
+
+
+ADMIN_BRANCH_LIST = ListSpec(
+    fields={
+        "branch_id": Field(lambda b: str(b.id)),
+        "clinic": Field(
+            lambda b: {"id": str(b.clinic.id), "name": b.clinic.name}, only=("clinic__name",), related=("clinic",)
+        ),
+        "name": Field(lambda b: b.name, only=("name",)),
+        "address": Field(lambda b: b.address, only=("address",)),
+        "city": Field(_city, only=("address",)),
+        "phone": Field(lambda b: str(b.phone), only=("phone",)),
+        "email": Field(lambda b: b.email or None, only=("email",)),
+        "working_hours": Field(lambda b: b.working_hours or "Не указан", only=("working_hours",)),
+        "status": Field(lambda b: "active" if b.is_active else "inactive", only=("is_active",)),
+        "status_display": Field(lambda b: "Активен" if b.is_active else "Неактивен", only=("is_active",)),
+        "status_color": Field(lambda b: "green" if b.is_active else "red", only=("is_active",)),
+        # Администратор филиала — первый профиль по id
+        "admin": Field(lambda b: b.admin_name or "Не назначен", annotate={"admin_name": Subquery(
+            ClinicAdminProfile.objects.filter(branch=OuterRef('pk')).order_by('id').values('user__full_name')[:1]
+        )}),
+        "staff_count": Field(
+            lambda b: b.staff_count,
+            annotate={"staff_count": count_subquery(CustomUser.objects.filter(is_active=True), 'branch')},
+        ),
+        # Пациенты клиники филиала
+        "patients_count": Field(
+            lambda b: b.patients_count,
+            annotate={"patients_count": count_subquery(Patient.objects.all(), 'clinic', outer='clinic_id')},
+        ),
+    },
+    ordering={"clinic_name": "clinic__name", "name": "name", "address": "address"},
+    default_order=("clinic_name", "name"),
+    required=("branch_id",),
+)
+
 def list_all_branches_for_admin(request, params):
     user = get_user_from_token(request)
     if not user or user.role != CustomUser.Roles.SYSTEM_ADMIN:
@@ -14,7 +54,7 @@ def list_all_branches_for_admin(request, params):
     status_filter = params.get("status")
     city = params.get("city")
     
-    branches_qs = Branch.objects.select_related('clinic').order_by('clinic__name', 'name')
+    branches_qs = Branch.objects.all()
 
     if search:
         branches_qs = branches_qs.filter(
@@ -36,57 +76,16 @@ def list_all_branches_for_admin(request, params):
     if city:
         branches_qs = branches_qs.filter(address__icontains=city)
 
-    branch_ids = list(branches_qs.values_list('id', flat=True))
-
-    staff_counts = CustomUser.objects.filter(branch_id__in=branch_ids, is_active=True)\
-        .values('branch_id')\
-        .annotate(count=Count('id'))\
-        .values_list('branch_id', 'count')
-
-    staff_map = {str(bid): count for bid, count in staff_counts}
-
-    clinic_patient_counts = Clinic.objects.filter(branches__id__in=branch_ids)\
-        .annotate(patients_count=Count('patients'))\
-        .values_list('id', 'patients_count')
-
-    patients_map = {str(clinic_id): count for clinic_id, count in clinic_patient_counts}
-
-    data = []
-    for branch in branches_qs:
-        clinic = branch.clinic
-
-        admin_profile = ClinicAdminProfile.objects.filter(branch=branch).select_related('user').first()
-        admin_name = admin_profile.user.full_name if admin_profile else "Не назначен"
-
-        city_name = branch.address.split(',')[-1].strip() if ',' in branch.address else "Не указан"
-
-        status_display = "Активен" if branch.is_active else "Неактивен"
-        status_color = "green" if branch.is_active else "red"
-
-        data.append({
-            "branch_id": str(branch.id),
-            "clinic": {
-                "id": str(clinic.id),
-                "name": clinic.name
-            },
-            "name": branch.name,
-            "address": branch.address,
-            "city": city_name,
-            "phone": str(branch.phone),
-            "email": branch.email or None,
-            "working_hours": branch.working_hours or "Не указан",
-            "status": "active" if branch.is_active else "inactive",
-            "status_display": status_display,
-            "status_color": status_color,
-            "admin": admin_name,
-            "staff_count": staff_map.get(str(branch.id), 0),
-            "patients_count": patients_map.get(str(clinic.id), 0),
-        })
+    try:
+        page = paginate(branches_qs, params, ADMIN_BRANCH_LIST)
+    except ListingError as e:
+        return {"response": {"error": str(e)}, "status": 400}
 
     return {
         "response": {
-            "branches": data,
-            "total": len(data),
+            "branches": page.rows(),
+            "total": page.total(),
+            **page.meta(),
             "filters": {
                 "search": search or None,
                 "clinic_id": clinic_id,
@@ -97,7 +96,6 @@ def list_all_branches_for_admin(request, params):
         "status": 200
     }
 
-
 def create_branch_for_admin(request, params):
     user = get_user_from_token(request)
     if not user or user.role != CustomUser.Roles.SYSTEM_ADMIN:
@@ -1,8 +1,14 @@
-from django.db.models import Q, Max, Prefetch
+from django.db.models import Q, OuterRef, Subquery
 from datetime import date
-from core.models import CustomUser, Clinic, Branch, Subscription, Plan, ClinicDirectorProfile
+from core.models import CustomUser, Clinic, Branch, Subscription, Patient, Payment
+from helper import images
+from helper.concurrency import run_parallel
+from helper.listing import Field, ListingError, ListSpec, paginate
+from helper.queries import count_subquery
+from helper.routing import reporting
 from .utils import get_user_from_token
 
+@reporting
 def list_clinic_subscriptions(request, params):
     """
     Возвращает список всех клиник с данными по подписке для системного админа.
@@ -38,14 +44,13 @@ def list_clinic_subscriptions(request, params):
     if plan_slug:
         subscriptions = subscriptions.filter(plan__slug=plan_slug)
 
-    # Статистика сверху
-    total_clinics = subscriptions.count()
-    paid_count = subscriptions.filter(status__in=['active', 'trial']).count()
-    waiting_count = subscriptions.filter(status='overdue').count()
-    overdue_count = subscriptions.filter(
-        Q(status__in=['active', 'trial']) &
-        Q(period_end__lt=today)
-    ).count()
+    # Статистика сверху — независимые счётчики, одновременно
+    total_clinics, paid_count, waiting_count, overdue_count = run_parallel(
+        subscriptions.count,
+        subscriptions.filter(status__in=['active', 'trial']).count,
+        subscriptions.filter(status='overdue').count,
+        subscriptions.filter(Q(status__in=['active', 'trial']) & Q(period_end__lt=today)).count,
+    )
 
     total_amount = sum(
         sub.plan.price_monthly for sub in subscriptions 
@@ -129,6 +134,96 @@ def list_clinic_subscriptions(request, params):
     }
 
 
+STATUS_COLORS = {'active': 'green', 'suspended': 'yellow', 'blocked': 'red'}
+
+NO_DIRECTOR = {"full_name": "Нет директора", "email": None, "phone": None}
+
+
+def _director(clinic):
+    profile = getattr(clinic, 'director_profile_link', None)
+    if not profile:
+        return NO_DIRECTOR
+    director = profile.user
+    return {
+        "full_name": director.full_name,
+        "email": director.email,
+        "phone": str(director.phone) if director.phone else None
+    }
+
+
+def _plan(clinic):
+    sub = getattr(clinic, 'subscription', None)
+    return sub.plan if sub else None
+
+
+def _limits_ok(clinic):
+    if not _plan(clinic):
+        return True
+    limits_check = clinic.check_limits(
+        users=clinic.users_count, branches=clinic.branches_count, patients=clinic.patients_count
+    )
+    return limits_check.get("ok", False)
+
+
+USERS_COUNT = count_subquery(CustomUser.objects.filter(is_active=True), 'clinic')
+BRANCHES_COUNT = count_subquery(Branch.objects.filter(is_active=True), 'clinic')
+
+ADMIN_CLINIC_LIST = ListSpec(
+    fields={
+        "clinic_id": Field(lambda c: str(c.id)),
+        "name": Field(lambda c: c.name, only=("name",)),
+        "logo": Field(lambda c: images.url(c.logo, c.logo_sha256), only=("logo", "logo_sha256")),
+        "director": Field(_director, only=(
+            "director_profile_link__user__full_name",
+            "director_profile_link__user__email",
+            "director_profile_link__user__phone",
+        ), related=("director_profile_link__user",)),
+        "status": Field(lambda c: c.status, only=("status",)),
+        "status_display": Field(
+            lambda c: dict(Clinic.Status.choices).get(c.status, "Неизвестно"), only=("status",)
+        ),
+        "status_color": Field(lambda c: STATUS_COLORS.get(c.status, 'gray'), only=("status",)),
+        "plan": Field(
+            lambda c: _plan(c).name if _plan(c) else "Без тарифа",
+            only=("subscription__plan__name",), related=("subscription__plan",),
+        ),
+        "plan_slug": Field(
+            lambda c: _plan(c).slug if _plan(c) else None,
+            only=("subscription__plan__slug",), related=("subscription__plan",),
+        ),
+        "registration_date": Field(lambda c: c.created_at.strftime("%Y-%m-%d"), only=("created_at",)),
+        "users_count": Field(lambda c: c.users_count, annotate={"users_count": USERS_COUNT}),
+        "branches_count": Field(lambda c: c.branches_count, annotate={"branches_count": BRANCHES_COUNT}),
+        # Подзапрос, а не Max() через JOIN: JOIN с оплатами размножает строки,
+        # и счётчики считались бы для каждой оплаты
+        "last_payment": Field(
+            lambda c: c.last_payment_date.strftime("%Y-%m-%d") if c.last_payment_date else None,
+            annotate={"last_payment_date": Subquery(
+                Payment.objects.filter(clinic=OuterRef('pk')).order_by('-paid_at').values('paid_at')[:1]
+            )},
+        ),
+        "limits_ok": Field(_limits_ok, only=(
+            "subscription__plan__name",
+            "subscription__plan__limit_users",
+            "subscription__plan__limit_branches",
+            "subscription__plan__limit_patients",
+        ), related=("subscription__plan",), annotate={
+            "users_count": USERS_COUNT,
+            "branches_count": BRANCHES_COUNT,
+            "patients_count": count_subquery(Patient.objects.all(), 'clinic'),
+        }),
+        "subscription_status": Field(
+            lambda c: c.subscription.status if getattr(c, 'subscription', None) else None,
+            only=("subscription__status",), related=("subscription",),
+        ),
+    },
+    ordering={"registration_date": "created_at", "name": "name", "status": "status"},
+    default_order=("-registration_date",),
+    required=("clinic_id",),
+)
+
+
+@reporting
 def list_all_clinics_for_admin(request, params):
     """
     Список всех клиник для системного администратора.
@@ -146,10 +241,7 @@ def list_all_clinics_for_admin(request, params):
     plan_slug = params.get("plan_slug")
     registration_month = params.get("registration_month")
 
-    # Базовый queryset
-    clinics_qs = Clinic.objects.all().annotate(
-        last_payment_date=Max('payments__paid_at')
-    )
+    clinics_qs = Clinic.objects.all()
 
     if status_filter and status_filter in dict(Clinic.Status.choices):
         clinics_qs = clinics_qs.filter(status=status_filter)
@@ -162,114 +254,29 @@ def list_all_clinics_for_admin(request, params):
         except:
             pass
 
+    # Поиск по клинике и директору — в SQL, до пагинации
     if search:
         clinics_qs = clinics_qs.filter(
             Q(name__icontains=search) |
             Q(legal_name__icontains=search) |
-            Q(inn__icontains=search)
+            Q(inn__icontains=search) |
+            Q(director_profile_link__user__full_name__icontains=search) |
+            Q(director_profile_link__user__email__icontains=search)
         )
 
     if plan_slug:
         clinics_qs = clinics_qs.filter(subscription__plan__slug=plan_slug)
 
-    clinics_qs = clinics_qs.order_by('-created_at')
-
-    # ID всех клиник
-    clinic_ids = list(clinics_qs.values_list('id', flat=True))
-
-    if not clinic_ids:
-        return {"response": {"clinics": [], "total": 0, "filters": {}}, "status": 200}
-
-    # Пакетные запросы
-    director_profiles = ClinicDirectorProfile.objects.filter(clinic_id__in=clinic_ids)\
-        .select_related('user')\
-        .values('clinic_id', 'user__full_name', 'user__email', 'user__phone')
-
-    director_map = {}
-    for d in director_profiles:
-        director_map[d['clinic_id']] = {
-            "full_name": d['user__full_name'],
-            "email": d['user__email'],
-            "phone": str(d['user__phone']) if d['user__phone'] else None
-        }
-
-    subscriptions = Subscription.objects.filter(clinic_id__in=clinic_ids)\
-        .select_related('plan')\
-        .values('clinic_id', 'status', 'plan__name', 'plan__slug')
-
-    subscription_map = {}
-    for s in subscriptions:
-        subscription_map[s['clinic_id']] = {
-            "status": s['status'],
-            "plan_name": s['plan__name'],
-            "plan_slug": s['plan__slug']
-        }
-
-    data = []
-
-    for clinic in clinics_qs:
-        clinic_id = clinic.id
-
-        director_info = director_map.get(clinic_id, {
-            "full_name": "Нет директора",
-            "email": None,
-            "phone": None
-        })
-
-        sub_info = subscription_map.get(clinic_id, {})
-        plan_name = sub_info.get("plan_name", "Без тарифа")
-        plan_slug_out = sub_info.get("plan_slug")
-
-        if search:
-            if not (
-                search in clinic.name.lower() or
-                (clinic.legal_name and search in clinic.legal_name.lower()) or
-                (clinic.inn and search in clinic.inn) or
-                search in director_info["full_name"].lower() or
-                (director_info["email"] and search in director_info["email"].lower())
-            ):
-                continue
-
-        status_display = dict(Clinic.Status.choices).get(clinic.status, "Неизвестно")
-        status_color = {
-            'active': 'green',
-            'suspended': 'yellow',
-            'blocked': 'red'
-        }.get(clinic.status, 'gray')
-
-        reg_date = clinic.created_at.strftime("%Y-%m-%d")
-        last_payment = clinic.last_payment_date.strftime("%Y-%m-%d") if clinic.last_payment_date else None
-
-        users_count = CustomUser.objects.filter(clinic_id=clinic_id, is_active=True).count()
-        branches_count = Branch.objects.filter(clinic_id=clinic_id, is_active=True).count()
-
-        limits_ok = True
-        if clinic_id in subscription_map and subscription_map[clinic_id].get("plan_name"):
-            limits_check = clinic.check_limits()
-            limits_ok = limits_check.get("ok", False)
-
-        data.append({
-            "clinic_id": str(clinic_id),
-            "name": clinic.name,
-            "logo": clinic.logo.url if clinic.logo else None,
-            "director": director_info,
-            "status": clinic.status,
-            "status_display": status_display,
-            "status_color": status_color,
-            "plan": plan_name,
-            "plan_slug": plan_slug_out,
-            "registration_date": reg_date,
-            "users_count": users_count,
-            "branches_count": branches_count,
-            "last_payment": last_payment,
-            "limits_ok": limits_ok,
-            "subscription_status": sub_info.get("status"),
-        })
+    try:
+        page = paginate(clinics_qs, params, ADMIN_CLINIC_LIST)
+    except ListingError as e:
+        return {"response": {"error": str(e)}, "status": 400}
 
     return {
         "response": {
-            "clinics": data,
-            "total": len(data),
+            "clinics": page.rows(),
+            "total": page.total(),
+            **page.meta(),
             "filters": {
                 "search": params.get("search"),
                 "status": status_filter,
@@ -1,5 +1,9 @@
 from django.core.exceptions import ObjectDoesNotExist
-from core.models import CustomUser, Plan, Subscription
+from django.db.models import Count
+from core.models import Branch, CustomUser, Patient, Plan, Subscription
+from helper.cache import cached_method
+from helper.queries import count_subquery
+from helper.routing import reporting
 from .utils import get_user_from_token
 
 def create_plan(request, params):
@@ -161,6 +165,7 @@ def delete_plan(request, params):
     }
 
 
+@cached_method(Plan, Subscription, all_clinics=True)
 def list_plans(request, params):
     user = get_user_from_token(request)
     if not user:
@@ -169,11 +174,11 @@ def list_plans(request, params):
     if user.role not in [CustomUser.Roles.SYSTEM_ADMIN, CustomUser.Roles.CLINIC_DIRECTOR, CustomUser.Roles.PENDING_DIRECTOR]:
         return {"response": {"error": "Доступ запрещён"}, "status": 403}
 
-    plans = Plan.objects.filter().order_by('price_monthly')
+    plans = Plan.objects.annotate(active_count=Count('subscriptions')).order_by('price_monthly')
 
     data = []
     for p in plans:
-        active_count = Subscription.objects.filter(plan=p).count()
+        active_count = p.active_count
         data.append({
             "id": str(p.id),
             "name": p.name,
@@ -191,6 +196,7 @@ def list_plans(request, params):
     return {"response": data, "status": 200}
 
 
+@reporting
 def get_plan(request, params):
     user = get_user_from_token(request)
     if not user:
@@ -211,8 +217,12 @@ def get_plan(request, params):
     except ObjectDoesNotExist:
         return {"response": {"error": "План не найден"}, "status": 404}
 
-    # Получаем все подписки на этот план
-    subscriptions = Subscription.objects.filter(plan=plan).select_related('clinic')
+    # Получаем все подписки на этот план (текущая загрузка клиник — подзапросами)
+    subscriptions = Subscription.objects.filter(plan=plan).select_related('clinic', 'plan').annotate(
+        current_users=count_subquery(CustomUser.objects.filter(is_active=True), 'clinic', outer='clinic_id'),
+        current_branches=count_subquery(Branch.objects.filter(is_active=True), 'clinic', outer='clinic_id'),
+        current_patients=count_subquery(Patient.objects.all(), 'clinic', outer='clinic_id'),
+    )
 
     # Статистика
     total_subscriptions = subscriptions.count()
@@ -225,7 +235,9 @@ def get_plan(request, params):
             continue
 
         # Проверка лимитов
-        limits_check = sub.clinic.check_limits()
+        limits_check = sub.clinic.check_limits(
+            users=sub.current_users, branches=sub.current_branches, patients=sub.current_patients
+        )
         limits_ok = limits_check.get("ok", False)
 
         clinic_data = {
@@ -240,9 +252,9 @@ def get_plan(request, params):
             "created_at": sub.created_at.isoformat(),
             
             # Текущая загрузка
-            "current_users": sub.clinic.users.filter(is_active=True).count(),
-            "current_branches": sub.clinic.branches.filter(is_active=True).count(),
-            "current_patients": sub.clinic.patients.count(),
+            "current_users": sub.current_users,
+            "current_branches": sub.current_branches,
+            "current_patients": sub.current_patients,
             
             # Лимиты плана
             "limit_users": plan.limit_users,
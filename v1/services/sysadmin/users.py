@@ -5,10 +5,13 @@ from django.core.exceptions import ObjectDoesNotExist
 from django.db.models import Q
 from core.models import CustomUser, Clinic, Branch, ClinicDirectorProfile, ClinicAdminProfile, DoctorProfile, ReceptionistProfile
 from v1.services.auth import generate_tokens
+from helper import images
+from helper.listing import Field, ListingError, ListSpec, paginate
 from .utils import get_user_from_token
 
 def sys_create_director(request, params):
-    if not request.user or request.user.role != CustomUser.Roles.SYSTEM_ADMIN:
+    user = get_user_from_token(request)
+    if not user or user.role != CustomUser.Roles.SYSTEM_ADMIN:
         return {"response": {"error": "Только системный администратор"}, "status": 403}
 
     full_name = params.get("full_name")
@@ -62,6 +65,37 @@ def sys_create_director(request, params):
     }
 
 
+ADMIN_USER_LIST = ListSpec(
+    fields={
+        "user_id": Field(lambda u: str(u.id)),
+        "full_name": Field(lambda u: u.full_name, only=("full_name",)),
+        "email": Field(lambda u: u.email, only=("email",)),
+        "phone": Field(lambda u: u.phone.as_e164 if u.phone else None, only=("phone",)),
+        "photo": Field(lambda u: images.url(u.photo, u.photo_sha256), only=("photo", "photo_sha256")),
+        "role": Field(lambda u: u.role, only=("role",)),
+        "role_display": Field(lambda u: u.get_role_display(), only=("role",)),
+        "clinic": Field(
+            lambda u: {"id": str(u.clinic.id) if u.clinic else None, "name": u.clinic.name if u.clinic else "Без клиники"},
+            only=("clinic__name",), related=("clinic",),
+        ),
+        "branch": Field(
+            lambda u: {"id": str(u.branch.id) if u.branch else None, "name": u.branch.name if u.branch else "Без филиала"},
+            only=("branch__name",), related=("branch",),
+        ),
+        "status": Field(lambda u: "active" if u.is_active else "blocked", only=("is_active",)),
+        "status_display": Field(lambda u: "Активен" if u.is_active else "Заблокирован", only=("is_active",)),
+        "status_color": Field(lambda u: "green" if u.is_active else "red", only=("is_active",)),
+        "registration_date": Field(lambda u: u.date_joined.strftime("%Y-%m-%d"), only=("date_joined",)),
+        "last_login": Field(lambda u: None),
+        "is_staff": Field(lambda u: u.is_staff, only=("is_staff",)),
+        "is_superuser": Field(lambda u: u.is_superuser, only=("is_superuser",)),
+    },
+    ordering={"registration_date": "date_joined", "full_name": "full_name", "email": "email", "role": "role"},
+    default_order=("-registration_date",),
+    required=("user_id",),
+)
+
+
 def list_all_users_for_admin(request, params):
     user = get_user_from_token(request)
     if not user:
@@ -76,7 +110,7 @@ def list_all_users_for_admin(request, params):
     status = params.get("status")
     registration_month = params.get("registration_month")
 
-    users_qs = CustomUser.objects.select_related('clinic', 'branch').all()
+    users_qs = CustomUser.objects.all()
 
     if status == "active":
         users_qs = users_qs.filter(is_active=True)
@@ -107,43 +141,16 @@ def list_all_users_for_admin(request, params):
             Q(phone__icontains=search)
         )
 
-    users_qs = users_qs.order_by('-date_joined')
-
-    data = []
-    for u in users_qs:
-        clinic_name = u.clinic.name if u.clinic else "Без клиники"
-        clinic_id_out = str(u.clinic.id) if u.clinic else None
-        branch_name = u.branch.name if u.branch else "Без филиала"
-        branch_id_out = str(u.branch.id) if u.branch else None
-        status_display = "Активен" if u.is_active else "Заблокирован"
-        status_color = "green" if u.is_active else "red"
-        role_display = u.get_role_display()
-        phone_display = u.phone.as_e164 if u.phone else None
-        reg_date = u.date_joined.strftime("%Y-%m-%d")
-
-        data.append({
-            "user_id": str(u.id),
-            "full_name": u.full_name,
-            "email": u.email,
-            "phone": phone_display,
-            "photo": u.photo.url if u.photo else None,
-            "role": u.role,
-            "role_display": role_display,
-            "clinic": {"id": clinic_id_out, "name": clinic_name},
-            "branch": {"id": branch_id_out, "name": branch_name},
-            "status": "active" if u.is_active else "blocked",
-            "status_display": status_display,
-            "status_color": status_color,
-            "registration_date": reg_date,
-            "last_login": None,
-            "is_staff": u.is_staff,
-            "is_superuser": u.is_superuser,
-        })
+    try:
+        page = paginate(users_qs, params, ADMIN_USER_LIST)
+    except ListingError as e:
+        return {"response": {"error": str(e)}, "status": 400}
 
     return {
         "response": {
-            "users": data,
-            "total": len(data),
+            "users": page.rows(),
+            "total": page.total(),
+            **page.meta(),
             "filters": {
                 "search": params.get("search"),
                 "clinic_id": clinic_id,
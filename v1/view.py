@@ -1,7 +1,22 @@
+import copy
+import time
+from functools import partial
+
+from django.conf import settings
+from django.http import HttpResponseBase
+from django.views.decorators.csrf import csrf_exempt
+from methodism.error_messages import MESSAGE
+from methodism.helper import custom_response, exception_data
 from methodism.main import METHODISM
+from rest_framework.response import Response
+from helper import metrics, routing
+from helper.concurrency import async_streaming, run_in_threadpool, run_parallel
+from helper.renderers import columnar
 from v1 import services
-from v1.services.auth import authenticate_user
+from v1.services.auth import authenticate_user, get_user_from_token
 
+BATCH_METHOD = "batch"
+COLUMNAR_FORMAT = "columnar"
 
 
 class MainView(METHODISM):
@@ -12,5 +27,169 @@ class MainView(METHODISM):
     def get_token(self, request):
         user = authenticate_user(request)
         if user:
-            return {"user": user} 
-        return None 
\ No newline at end of file
+            return {"user": user}
+        return None
+
+    def resolve_method_name(self, method):
+        """Имя функции сервиса для метрик (неизвестные методы — в одну метку)"""
+        if not isinstance(method, str):
+            return metrics.UNKNOWN_METHOD
+        name = method.replace('.', '_').replace('-', '_')
+        return name if callable(getattr(self.file, name, None)) else metrics.UNKNOWN_METHOD
+
+    def post(self, request, *args, **kwargs):
+        # Запись в этом запросе — чтения отчётов этого токена какое-то время с основной БД
+        with routing.session(request):
+            return self.dispatch_call(request, *args, **kwargs)
+
+    def dispatch_call(self, request, *args, **kwargs):
+        if isinstance(request.data, dict) and request.data.get("method") == BATCH_METHOD:
+            return self.batch(request)
+
+        name = self.resolve_method_name(request.data.get("method"))
+
+        with metrics.track_queries() as tracker, metrics.profile(name):
+            start = time.perf_counter()
+            response = super().post(request, *args, **kwargs)
+            wall = time.perf_counter() - start
+
+        # Сервис вернул готовый HTTP-ответ (потоковый экспорт) — отдаём как есть
+        if isinstance(response.data, HttpResponseBase):
+            return self.stream_with_metrics(name, response.data, wall, tracker)
+
+        data = response.data if isinstance(response.data, dict) else {}
+        self.reshape(request.data.get("format"), data)
+
+        def on_render(rendered):
+            metrics.record(name, wall, tracker.queries, tracker.db_time, len(rendered.content), data.get("status"))
+
+        response.add_post_render_callback(on_render)
+        return response
+
+    @staticmethod
+    def reshape(response_format, data):
+        """"format": "columnar" рядом с method/params — списки объектов в ответе передаются колонками"""
+        if response_format == COLUMNAR_FORMAT and "response" in data:
+            data["response"] = columnar(data["response"])
+            data["format"] = COLUMNAR_FORMAT
+
+    def stream_with_metrics(self, name, response, wall, tracker):
+        """Метрики потокового ответа пишутся, когда поток дочитан: время, запросы и байты за всё время отдачи"""
+        if not response.streaming:
+            metrics.record(name, wall, tracker.queries, tracker.db_time, len(response.content), response.status_code)
+            return response
+
+        content = response.streaming_content
+        started = time.perf_counter() - wall
+
+        def stream():
+            size = 0
+            with metrics.track_queries() as streamed:
+                try:
+                    for chunk in content:
+                        size += len(chunk)
+                        yield chunk
+                finally:
+                    metrics.record(
+                        name, time.perf_counter() - started, tracker.queries + streamed.queries,
+                        tracker.db_time + streamed.db_time, size, response.status_code,
+                    )
+
+        response.streaming_content = stream()
+        return response
+
+    def batch(self, request):
+        """Несколько вызовов в одном запросе.
+
+        params: {"calls": [{"method", "params"}, ...], "parallel": false}. Токен проверяется один раз
+        (пользователь запоминается на запросе), каждый вызов получает свой результат в формате
+        обычного ответа. parallel — для независимых вызовов (чтения): выполняются одновременно,
+        каждый со своей копией запроса и пользователя (_detached); по умолчанию — по порядку, чтобы
+        запись могла рассчитывать на предыдущие вызовы.
+        """
+        params = request.data.get("params")
+        calls = params.get("calls") if isinstance(params, dict) else None
+        if not isinstance(calls, list) or not calls:
+            return Response(custom_response(False, method=BATCH_METHOD, message=MESSAGE["ParamsMust"]))
+        limit = getattr(settings, "API_BATCH_MAX_CALLS", 20)
+        if len(calls) > limit:
+            return Response(custom_response(
+                False, method=BATCH_METHOD, message=f"Не больше {limit} вызовов в batch", status_code=400,
+            ))
+
+        with metrics.track_queries() as tracker:
+            start = time.perf_counter()
+            get_user_from_token(request)
+            if params.get("parallel"):
+                results = run_parallel(*[partial(self.batch_call, _detached(request), call) for call in calls])
+            else:
+                results = [self.batch_call(request, call) for call in calls]
+            wall = time.perf_counter() - start
+
+        response = Response({"method": BATCH_METHOD, "status": True, "results": results})
+
+        def on_render(rendered):
+            metrics.record(BATCH_METHOD, wall, tracker.queries, tracker.db_time, len(rendered.content), 200)
+
+        response.add_post_render_callback(on_render)
+        return response
+
+    def batch_call(self, request, call):
+        """Один вызов batch: тот же поиск функции и обработка ошибок, что у одиночного запроса"""
+        method = call.get("method") if isinstance(call, dict) else None
+        params = call.get("params") if isinstance(call, dict) else None
+        if not method:
+            return custom_response(False, method=method, message=MESSAGE["MethodMust"])
+        if params is None:
+            return custom_response(False, method=method, message=MESSAGE["ParamsMust"])
+        name = self.resolve_method_name(method)
+        if name == metrics.UNKNOWN_METHOD or method == BATCH_METHOD:
+            return custom_response(False, method=method, message=MESSAGE["MethodDoesNotExist"])
+
+        with metrics.track_queries() as tracker, metrics.profile(name):
+            start = time.perf_counter()
+            try:
+                result = getattr(self.file, name)(request, params)
+            except Exception as e:
+                result = custom_response(False, method=method, data=exception_data(e), message=MESSAGE["UndefinedError"])
+            wall = time.perf_counter() - start
+
+        if isinstance(result, HttpResponseBase):
+            # Потоковые ответы (экспорт) в batch не встраиваются
+            result.close()
+            result = {"response": {"error": "Метод нельзя вызывать в batch"}, "status": 400}
+        if isinstance(result, dict):
+            result["method"] = method
+            self.reshape(call.get("format"), result)
+        metrics.record(name, wall, tracker.queries, tracker.db_time, 0, result.get("status") if isinstance(result, dict) else None)
+        return result
+
+
+def _detached(request):
+    """Поверхностная копия запроса для параллельного вызова batch: атрибуты, которые ставят на запрос
+    сервисы, и пользователь по токену (его правят и сохраняют) у каждого потока свои"""
+    clone = copy.copy(request)
+    cached = getattr(request, "_token_user", None)
+    if cached is not None and cached[1] is not None:
+        clone._token_user = (cached[0], copy.copy(cached[1]))
+    return clone
+
+
+main_view = MainView.as_view()
+
+
+def _render(request):
+    response = main_view(request)
+    # Рендер (JSON) — тоже в потоке пула, а не в event loop
+    if hasattr(response, "render") and not response.is_rendered:
+        response.render()
+    return response
+
+
+@csrf_exempt
+async def async_main_view(request):
+    """Диспетчер для ASGI (API_ASYNC_DISPATCH): MainView в ограниченном пуле потоков.
+
+    Потоковые ответы (экспорт) получают async-итератор — тело идёт клиенту по кускам.
+    """
+    return async_streaming(await run_in_threadpool(_render, request))